@@ -1,24 +1,59 @@
 import os
+import gc
 import cv2
 import time
 import psutil
 from ultralytics import YOLO
-import easyocr
-from collections import Counter
 import json
 from colorama import Fore, Back, Style
-import uuid
 import streamlit as st
+from utils.perm_log import temporal_redundancy_voting, create_perm_log, create_track_logs, MIN_PLATE_CHARS, MIN_PLATE_CONFIDENCE
+from utils.sighting_history import flush_history
+from utils.segment_store import tmp_store
+from utils.sharding import run_sharded
+from utils.pipeline import StagePipeline
+from utils.plate_tracker import PlatePropagator, best_plate_box
+from utils.detections import vehicle_arrays, tracked_vehicles, plate_arrays, to_frame, crop
+from utils.ocr import load_ocr_engine, read_plate
+from utils.recording import DetectionRecorder, new_recording_path
+from utils.retention import start_retention_worker, retention_config
+from utils.memory_watchdog import MemoryWatchdog, memory_config
+from utils.detector_cascade import DetectorCascade, VEHICLE_CLASSES
+from utils.event_bus import start_event_bus, publish
+from utils.columnar_export import configure_export, export_config, release_export_memory
+from utils.watchlist import Watchlist
+from utils.vehicle_tracker import IntervalTracker, make_tracker
+from utils.track_scheduler import TrackScheduler
+from utils.cameras import open_camera
 
 # initialize models
 def init_models():
-    global vehicle_detector, plate_detector, character_detector
+    global vehicle_detector, vehicle_cascade, vehicle_tracking, plate_detector, character_detector, ocr_engine
+
+    # the SORT tracker can predict the vehicles on the frames between detections (see vehicle tracker in settings)
+    tracker_name = st.session_state.get('vehicle_tracker', 'bytetrack')
+    detect_interval = st.session_state.get('detect_interval', 1) if tracker_name == 'sort' else 1
+
+    # the cascade screens frames with a small model and steps between models to stay within the frame budget (see settings)
+    if st.session_state.get('vehicle_cascade', False):
+        vehicle_detector = None
+        vehicle_cascade = DetectorCascade(budget_ms = st.session_state.get('frame_budget_ms', 0))
+        vehicle_tracking = IntervalTracker(vehicle_cascade.detect_frame, make_tracker(tracker_name), vehicle_cascade.names, detect_interval)
+    else:
+        vehicle_detector = YOLO('models/yolov9c.pt') # object detection
+        vehicle_cascade = None
+
+        # the default keeps the tracker that YOLO.track() persists on the model
+        if tracker_name == 'bytetrack':
+            vehicle_tracking = None
+        else:
+            vehicle_tracking = IntervalTracker(detect_vehicle_boxes, make_tracker(tracker_name), vehicle_detector.names, detect_interval)
 
-    vehicle_detector = YOLO('models/yolov9c.pt') # object detection
     plate_detector = YOLO('models/license_plate.pt') # object detection
 
-    # specify model_storage_directory and download_enabled to False (to prevent downloading the model every time the script is run)
-    character_detector = easyocr.Reader(['en'], model_storage_directory="models", download_enabled=False) # optical character recognition
+    # the slim engine only loads the INT8 quantized recognizer (see OCR engine in settings)
+    ocr_engine = st.session_state.get('ocr_engine', 'full')
+    character_detector = load_ocr_engine(ocr_engine) # optical character recognition
 
 def calc_write_fps(stream, frame_skip):
 
@@ -51,241 +86,61 @@ def clear_tmp_logs():
     else:
         os.makedirs("frames")
 
-def temporal_redundancy_voting(plate_strings):
-
-    # Determine the maximum length of the plates
-    max_length = max(len(plate) for plate in plate_strings)
-
-    # Initialize a list to hold the voted characters for each position
-    voted_characters = []
+#_# ALPR functions #_#
+def watchlist_alert(veh_id, voted_plate):
 
-    # Iterate through each position
-    for i in range(max_length):
-        char_counter = Counter()
+    # alert the moment a voted plate matches a watched plate (also if it's one OCR confusion off)
+    for distance, watched, note in watchlist.match(voted_plate):
 
-        # Count characters at the current position for each plate and count blanks
-        num_blanks = 0
-        for plate in plate_strings:
-            if i < len(plate):
-                char_counter[plate[i]] += 1
-            else:
-                num_blanks += 1
+        # only alert once per watched plate for every vehicle
+        if watched in watchlist_alerts.setdefault(veh_id, set()):
+            continue
+        watchlist_alerts[veh_id].add(watched)
 
-        # If blanks are the majority, stop adding more characters
-        if num_blanks > len(plate_strings) / 2:
-            break
+        message = "Watchlist match: " + watched + ("" if distance == 0 else " (read as " + voted_plate + ")") + (" - " + note if note else "")
 
-        # Find the most common character for this position
-        most_common_char, _ = char_counter.most_common(1)[0]
-        voted_characters.append(most_common_char)
+        print(Fore.RED + Style.BRIGHT + "\n" + message + Style.RESET_ALL)
+        st.toast(message, icon = "🚨")
+        watchlist_status.error(message)
 
-    # Join the characters to form the final voted plate
-    voted_plate = ''.join(voted_characters)
-    return voted_plate
+        publish("watchlist_match", veh_id = veh_id, frame = frame_number, plate = voted_plate, watched = watched, distance = distance, note = note)
 
-def create_perm_log(veh_id, vid, write_fps):
-    
-    # Load plate strings and vehicle tracking data from JSON files if they exist
-    with open(f"logs/tmp/Vehicle_{veh_id}/plates.json", "r") as file:
-        plate_strings = json.load(file)
-        plate_strings = [entry["plate"] for entry in plate_strings]
-    
-    if os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/vehicle_track.json"):
-        with open(f"logs/tmp/Vehicle_{veh_id}/vehicle_track.json", "r") as file:
-            vehicle_data = json.load(file)
-            vehicle_data_found = True
-    else:
-        vehicle_data_found = False
-    
-    if os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/plate_track.json"):
-        with open(f"logs/tmp/Vehicle_{veh_id}/plate_track.json", "r") as file:
-            plate_track_data = json.load(file)
-            plate_data_found = True
-    else:
-        plate_data_found = False
-    
-    # generate the UUID for the perm log
-    perm_uuid = str(uuid.uuid4())
-
-    # Apply the temporal redundancy voting algorithm
-    voted_plate = temporal_redundancy_voting(plate_strings)
-
-    # Create permanent log directory
-    perm_path = f"logs/perm/{perm_uuid}"
-    if not os.path.exists(perm_path):
-        os.makedirs(perm_path)
-
-    # Get frame size for the video
-    width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    # Create video writer object
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(f"{perm_path}/video.mp4", fourcc, write_fps, (width, height))
-
-    # Process each frame and save one cropped image of the vehicle and plate
-    frame_dir = f"logs/tmp/Vehicle_{veh_id}/frames"
-    frame_numbers = sorted([int(frame.split('.')[0]) for frame in os.listdir(frame_dir) if frame.endswith('.jpg')])
-    cropped_vehicle_saved = False
-    cropped_plate_saved = False
-
-    for frame_num in frame_numbers:
-        img_path = f"{frame_dir}/{frame_num}.jpg"
-        if os.path.exists(img_path):
-            img = cv2.imread(img_path)
-
-            # Retrieve vehicle frame data and draw bounding box
-            if (vehicle_data_found):
-                vehicle_frame_data = vehicle_data.get(str(frame_num))
-                if vehicle_frame_data:
-                    vx1, vy1, vx2, vy2 = map(int, [vehicle_frame_data['x1'], vehicle_frame_data['y1'], vehicle_frame_data['x2'], vehicle_frame_data['y2']])
-                    cv2.rectangle(img, (vx1, vy1), (vx2, vy2), (0, 0, 255), 2)
-                    cv2.putText(img, "Target Vehicle", (vx1, vy1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
-
-                    # Crop and save one image of the vehicle and plate
-                    if not cropped_vehicle_saved:
-                        cropped_vehicle = img[vy1:vy2, vx1:vx2]
-                        cv2.imwrite(f"{perm_path}/cropped_vehicle.jpg", cropped_vehicle)
-                        cropped_vehicle_saved = True
-
-            # Retrieve plate frame data, adjust to vehicle coordinates, and draw cornered bounding box
-            if (plate_data_found):
-                plate_frame_data = plate_track_data.get(str(frame_num))
-                if plate_frame_data and vehicle_frame_data:
-                    px1, py1, px2, py2 = map(int, [plate_frame_data['x1'], plate_frame_data['y1'], plate_frame_data['x2'], plate_frame_data['y2']])
-
-                    # Adjust plate coordinates to vehicle coordinates
-                    px1 += vx1
-                    py1 += vy1
-                    px2 += vx1
-                    py2 += vy1
-
-                    # Draw cornered bounding box for the plate
-                    # Top left corner
-                    cv2.line(img, (px1, py1), (px1, py1 + 20), (255, 255, 255), 4)
-                    cv2.line(img, (px1, py1), (px1 + 20, py1), (255, 255, 255), 4)
-                    # Top right corner
-                    cv2.line(img, (px2, py1), (px2, py1 + 20), (255, 255, 255), 4)
-                    cv2.line(img, (px2, py1), (px2 - 20, py1), (255, 255, 255), 4)
-                    # Bottom left corner
-                    cv2.line(img, (px1, py2), (px1, py2 - 20), (255, 255, 255), 4)
-                    cv2.line(img, (px1, py2), (px1 + 20, py2), (255, 255, 255), 4)
-                    # Bottom right corner
-                    cv2.line(img, (px2, py2), (px2, py2 - 20), (255, 255, 255), 4)
-                    cv2.line(img, (px2, py2), (px2 - 20, py2), (255, 255, 255), 4)
-
-                    # Add the voted plate string to the plate area label
-                    cv2.putText(img, voted_plate, (px1, py1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 2)
-
-                    # Crop and save one image of the plate
-                    if not cropped_plate_saved:
-                        cropped_plate = img[py1:py2, px1:px2]
-                        cv2.imwrite(f"{perm_path}/cropped_plate.jpg", cropped_plate)
-                        cropped_plate_saved = True
-
-            # Write the frame to the video
-            out.write(img)
-
-    out.release()
-
-    # create /logs/perm/all_plates.json if it doesn't exist
-    if not os.path.exists("logs/perm/all_plates.json"):
-        with open("logs/perm/all_plates.json", "w") as file:
-            json.dump({}, file)
-
-    # Load all plates from all_plates.json
-    with open("logs/perm/all_plates.json", "r") as file:
-        all_plates = json.load(file)
-
-    # Get the date and time
-    date = time.strftime("%m/%d/%Y")
-    time_now = time.strftime("%H:%M")
-
-    # Add the new detection to all_plates.json
-    if voted_plate in all_plates:
-        all_plates[voted_plate].append({
-            "date": date,
-            "time": time_now,
-            "veh_crop_path": f"/perm/{perm_uuid}/cropped_vehicle.jpg",
-            "plate_crop_path": f"/perm/{perm_uuid}/cropped_plate.jpg",
-            "video_path": f"/perm/{perm_uuid}/video.mp4",
-            "log_id": perm_uuid
-        })
-    else:
-        all_plates[voted_plate] = [{
-            "date": date,
-            "time": time_now,
-            "veh_crop_path": f"/perm/{perm_uuid}/cropped_vehicle.jpg",
-            "plate_crop_path": f"/perm/{perm_uuid}/cropped_plate.jpg",
-            "video_path": f"/perm/{perm_uuid}/video.mp4",
-            "log_id": perm_uuid
-        }]
-
-    # Write the updated all_plates.json
-    with open("logs/perm/all_plates.json", "w") as file:
-        json.dump(all_plates, file, indent=4)
-
-    # delete the tmp folder for the vehicle 
-    os.system("rm -rf logs/tmp/Vehicle_" + str(veh_id))
-        
-#_# ALPR functions #_#
-def detect_chars(plate_crop, plate_plot, veh_plot, veh_id):
+def detect_chars(plate_crop, plate_frame, veh_id, character_results=None):
 
-    # run the cropped image through the character detector
+    # run the cropped image through the character detector (unless the pipelined ocr stage already did)
     # only detect numbers 0-9 and letters A-Z
-    character_results = character_detector.readtext(plate_crop, allowlist="0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ") # allow multiple string detections per frame
+    if character_results is None:
+        character_results = read_plate(character_detector, plate_crop, ocr_engine)
+
+    # the plate box in frame coordinates (see detect_plate)
+    px1, py1, px2, py2 = plate_frame
             
     # if there are any characters detected draw a cornered bounding box of the plate area on the original frame using the color white
     # if not then draw the cornered bounding box of the plate on the original frame using the color red and display "UNKNOWN"
     if len(character_results) > 0:
-        # cv2.rectangle(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (255, 0, 255), 4)
-
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1]) + 20), (255, 255, 255), 4) # top left y
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]) + 20, int(plate_plot[1]) + int(veh_plot[1])), (255, 255, 255), 4) # top left x
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1]) + 20), (255, 255, 255), 4) # top right y
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]) - 20, int(plate_plot[1]) + int(veh_plot[1])), (255, 255, 255), 4) # top right x
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1]) - 20), (255, 255, 255), 4) # bottom left y
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]) + 20, int(plate_plot[3]) + int(veh_plot[1])), (255, 255, 255), 4) # bottom left x
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1]) - 20), (255, 255, 255), 4) # bottom right y
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]) - 20, int(plate_plot[3]) + int(veh_plot[1])), (255, 255, 255), 4) # bottom right x
+        # cv2.rectangle(frame, (px1, py1), (px2, py2), (255, 0, 255), 4)
+
+        cv2.line(frame, (px1, py1), (px1, py1 + 20), (255, 255, 255), 4) # top left y
+        cv2.line(frame, (px1, py1), (px1 + 20, py1), (255, 255, 255), 4) # top left x
+        cv2.line(frame, (px2, py1), (px2, py1 + 20), (255, 255, 255), 4) # top right y
+        cv2.line(frame, (px2, py1), (px2 - 20, py1), (255, 255, 255), 4) # top right x
+        cv2.line(frame, (px1, py2), (px1, py2 - 20), (255, 255, 255), 4) # bottom left y
+        cv2.line(frame, (px1, py2), (px1 + 20, py2), (255, 255, 255), 4) # bottom left x
+        cv2.line(frame, (px2, py2), (px2, py2 - 20), (255, 255, 255), 4) # bottom right y
+        cv2.line(frame, (px2, py2), (px2 - 20, py2), (255, 255, 255), 4) # bottom right x
     else:
-        # cv2.rectangle(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (0, 255, 255), 4)
+        # cv2.rectangle(frame, (px1, py1), (px2, py2), (0, 255, 255), 4)
         
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1]) + 20), (0, 0, 255), 4) # top left y
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]) + 20, int(plate_plot[1]) + int(veh_plot[1])), (0, 0, 255), 4) # top left x
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1]) + 20), (0, 0, 255), 4) # top right y
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[1]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]) - 20, int(plate_plot[1]) + int(veh_plot[1])), (0, 0, 255), 4) # top right x
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1]) - 20), (0, 0, 255), 4) # bottom left y
-        cv2.line(frame, (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[0]) + int(veh_plot[0]) + 20, int(plate_plot[3]) + int(veh_plot[1])), (0, 0, 255), 4) # bottom left x
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1]) - 20), (0, 0, 255), 4) # bottom right y
-        cv2.line(frame, (int(plate_plot[2]) + int(veh_plot[0]), int(plate_plot[3]) + int(veh_plot[1])), (int(plate_plot[2]) + int(veh_plot[0]) - 20, int(plate_plot[3]) + int(veh_plot[1])), (0, 0, 255), 4) # bottom right x
+        cv2.line(frame, (px1, py1), (px1, py1 + 20), (0, 0, 255), 4) # top left y
+        cv2.line(frame, (px1, py1), (px1 + 20, py1), (0, 0, 255), 4) # top left x
+        cv2.line(frame, (px2, py1), (px2, py1 + 20), (0, 0, 255), 4) # top right y
+        cv2.line(frame, (px2, py1), (px2 - 20, py1), (0, 0, 255), 4) # top right x
+        cv2.line(frame, (px1, py2), (px1, py2 - 20), (0, 0, 255), 4) # bottom left y
+        cv2.line(frame, (px1, py2), (px1 + 20, py2), (0, 0, 255), 4) # bottom left x
+        cv2.line(frame, (px2, py2), (px2, py2 - 20), (0, 0, 255), 4) # bottom right y
+        cv2.line(frame, (px2, py2), (px2 - 20, py2), (0, 0, 255), 4) # bottom right x
         
-        cv2.putText(frame, "UNKNOWN", (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) - 20 + int(veh_plot[1])), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
-
-    ############################
-
-    # add the voted plate string to the plate area label if it exists
-    if os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/plates.json"):
-        # if the json file exists, that means there are plates detected for this vehicle, so get the plate strings
-        plate_strings = json.load(open("logs/tmp/Vehicle_" + str(veh_id) + "/plates.json"))
-
-        # extract the plates from the JSON data
-        plates = [entry["plate"] for entry in plate_strings]
-
-        # get the number of plates detected
-        num_plates = len(plates)
-
-        # apply the temporal redundancy voting algorithm
-        voted_plate = temporal_redundancy_voting(plates)
-
-        # print out the voted plate string and the vote count (number of plates detected)
-        print(Fore.MAGENTA + "\nVoted Plate: " + voted_plate + " (" + str(num_plates) + ")" + Style.RESET_ALL)
-
-        # display the voted plate string and the vote count (number of plates detected) in the status widget
-        voted_string_status.code("Voted Plate: " + voted_plate + " (" + str(num_plates) + ")")
-
-        # add the voted plate string to the plate area label
-        cv2.putText(frame, "Voted: " + voted_plate + " (" + str(num_plates) + ")", (int(plate_plot[0]) + int(veh_plot[0]), int(plate_plot[1]) - 60 + int(veh_plot[1])), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2)
+        cv2.putText(frame, "UNKNOWN", (px1, py1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
 
     ############################
 
@@ -302,9 +157,9 @@ def detect_chars(plate_crop, plate_plot, veh_plot, veh_id):
         # if the confidence score is more than 50% AND more than 3 characters use the color green
         # if the confidence score is less than 50% AND more than 3 characters use the color yellow
         # if the length of the string is less than 3 characters use the color red
-        if len(characters) >= 3 and int(confidence) >= 50:
+        if len(characters) >= MIN_PLATE_CHARS and int(confidence) >= MIN_PLATE_CONFIDENCE:
             print(Fore.GREEN + "\nActive Plate: " + characters + " [" + confidence + "%]" + Style.RESET_ALL) # green
-        elif len(characters) >= 3:
+        elif len(characters) >= MIN_PLATE_CHARS:
             print(Fore.YELLOW + "\nActive Plate: " + characters + " [" + confidence + "%]" + Style.RESET_ALL) # yellow
         elif len(characters) > 0:
             print(Fore.LIGHTRED_EX + "\nActive Plate: " + characters + " [" + confidence + "%]" + Style.RESET_ALL) # red
@@ -316,17 +171,18 @@ def detect_chars(plate_crop, plate_plot, veh_plot, veh_id):
         # get the coordinates of the bounding box
         x1, y1, x2, y2 = int(character[0][0][0]), int(character[0][0][1]), int(character[0][2][0]), int(character[0][2][1])
 
-        # draw the bounding box of the character string on the original frame (re-calculate the x&y coords by adding the vehicle & plate coords)
+        # draw the bounding box of the character string on the original frame (re-calculate the x&y coords by adding the plate coords)
         # if the license plate string is less the 3 characters, it is most likely inacurate, so use the color orange
         # if the license plate string is 3 or more characters BUT the confidence score is less than 50%, use the color yellow
         # if the license plate string is 3 or more characters AND the confidence score is greater than 50%, use the color green and log
-        if len(characters) >= 3 and int(confidence) >= 50:
-            cv2.rectangle(frame, (x1 + int(veh_plot[0]) + int(plate_plot[0]), y1 + int(veh_plot[1]) + int(plate_plot[1])), (x2 + int(veh_plot[0]) + int(plate_plot[0]), y2 + int(veh_plot[1]) + int(plate_plot[1])), (0, 255, 0), 4)
-            cv2.putText(frame, "Active: " + characters + " [" + confidence + "%]", (x1 + int(veh_plot[0]) + int(plate_plot[0]), y1 - 20 + int(veh_plot[1]) + int(plate_plot[1])), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2)
+        if len(characters) >= MIN_PLATE_CHARS and int(confidence) >= MIN_PLATE_CONFIDENCE:
+            cv2.rectangle(frame, (x1 + px1, y1 + py1), (x2 + px1, y2 + py1), (0, 255, 0), 4)
+            cv2.putText(frame, "Active: " + characters + " [" + confidence + "%]", (x1 + px1, y1 - 20 + py1), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2)
             
             # add the vehicle id to the target list if it is not already in it
             if veh_id not in target_vehicles:
                 target_vehicles.append(veh_id)
+                publish("track_start", veh_id = veh_id, frame = frame_number, plate = characters, confidence = int(confidence))
 
             # if the directory for the vehicle does not exist, create it
             if not os.path.exists("logs/tmp/Vehicle_" + str(veh_id)):
@@ -358,28 +214,95 @@ def detect_chars(plate_crop, plate_plot, veh_plot, veh_id):
                 with open(plates_file_path, 'w') as f:
                     json.dump(plates_list, f, indent=4)
 
-        elif len(characters) >= 3:
-            cv2.rectangle(frame, (x1 + int(veh_plot[0]) + int(plate_plot[0]), y1 + int(veh_plot[1]) + int(plate_plot[1])), (x2 + int(veh_plot[0]) + int(plate_plot[0]), y2 + int(veh_plot[1]) + int(plate_plot[1])), (0, 255, 255), 4)
-            cv2.putText(frame, "Active: " + characters + " [" + confidence + "%]", (x1 + int(veh_plot[0]) + int(plate_plot[0]), y1 - 20 + int(veh_plot[1]) + int(plate_plot[1])), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 255), 2)
+        elif len(characters) >= MIN_PLATE_CHARS:
+            cv2.rectangle(frame, (x1 + px1, y1 + py1), (x2 + px1, y2 + py1), (0, 255, 255), 4)
+            cv2.putText(frame, "Active: " + characters + " [" + confidence + "%]", (x1 + px1, y1 - 20 + py1), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 255), 2)
         elif len(characters) > 0:
-            cv2.rectangle(frame, (x1 + int(veh_plot[0]) + int(plate_plot[0]), y1 + int(veh_plot[1]) + int(plate_plot[1])), (x2 + int(veh_plot[0]) + int(plate_plot[0]), y2 + int(veh_plot[1]) + int(plate_plot[1])), (0, 165, 255), 4)
-            cv2.putText(frame, "Active: " + characters + " [" + confidence + "%]", (x1 + int(veh_plot[0]) + int(plate_plot[0]), y1 - 20 + int(veh_plot[1]) + int(plate_plot[1])), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 165, 255), 2)
+            cv2.rectangle(frame, (x1 + px1, y1 + py1), (x2 + px1, y2 + py1), (0, 165, 255), 4)
+            cv2.putText(frame, "Active: " + characters + " [" + confidence + "%]", (x1 + px1, y1 - 20 + py1), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 165, 255), 2)
 
         ############################
 
-def detect_plate(veh_crop, veh_plot, veh_id, stream):
+    # add the voted plate string to the plate area label if it exists
+    # (after the reads of this frame were logged above, so the vote and the watchlist check include them)
+    if os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/plates.json"):
+        # if the json file exists, that means there are plates detected for this vehicle, so get the plate strings
+        plate_strings = json.load(open("logs/tmp/Vehicle_" + str(veh_id) + "/plates.json"))
+
+        # extract the plates from the JSON data
+        plates = [entry["plate"] for entry in plate_strings]
+
+        # get the number of plates detected
+        num_plates = len(plates)
+
+        # apply the temporal redundancy voting algorithm
+        voted_plate = temporal_redundancy_voting(plates)
+
+        # print out the voted plate string and the vote count (number of plates detected)
+        print(Fore.MAGENTA + "\nVoted Plate: " + voted_plate + " (" + str(num_plates) + ")" + Style.RESET_ALL)
+
+        # display the voted plate string and the vote count (number of plates detected) in the status widget
+        voted_string_status.code("Voted Plate: " + voted_plate + " (" + str(num_plates) + ")")
+
+        # publish the vote on the event stream and check it against the watchlist when it changed
+        if published_votes.get(veh_id) != (voted_plate, num_plates):
+            published_votes[veh_id] = (voted_plate, num_plates)
+            publish("plate_vote", veh_id = veh_id, frame = frame_number, plate = voted_plate, votes = num_plates)
+
+            # a vehicle whose vote stopped changing is read less often when the plate budget is tight
+            # (only counted when a new read was added, frames without a usable read don't make the vote stable)
+            if track_scheduler is not None:
+                track_scheduler.vote(veh_id, voted_plate)
+
+            watchlist_alert(veh_id, voted_plate)
+
+        # add the voted plate string to the plate area label
+        cv2.putText(frame, "Voted: " + voted_plate + " (" + str(num_plates) + ")", (px1, py1 - 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 2)
+
+    ############################
+
+    return character_results
+
+def find_plates(veh_crop, veh_plot, veh_id):
+
+    # predict the plate box from the vehicle box if the plate was detected recently (see plate interval in settings)
+    if plate_propagator is not None:
+        predicted_plot = plate_propagator.predict(veh_id, veh_plot)
+        if predicted_plot is not None:
+            return plate_arrays([predicted_plot], veh_crop.shape)["boxes"], True
 
     # run the cropped image through the license plate detector
     plate_results = plate_detector(veh_crop, classes=0) # allow multiple plate detections per frame
 
+    # the plate boxes as one int array in vehicle crop coordinates
+    plates = plate_arrays(plate_results[0].boxes.data, veh_crop.shape)
+
+    # remember the best plate box so it can be propagated on the next frames
+    if plate_propagator is not None:
+        plate_propagator.update(veh_id, veh_plot, best_plate_box(plates["boxes"], plates["scores"]))
+
+    return plates["boxes"], False
+
+def detect_plate(veh_crop, veh_plot, veh_id, stream, plate_boxes=None, character_results=None, predicted=False):
+
+    # find the plate boxes (unless the pipelined plate stage already did)
+    if plate_boxes is None:
+        plate_boxes, predicted = find_plates(veh_crop, veh_plot, veh_id)
+
+    # keep the plate boxes and raw OCR results for the detection recording
+    plates = []
+
+    # the plate boxes in frame coordinates for drawing (all plates of the vehicle in one array operation)
+    plate_frames = to_frame(plate_boxes, veh_plot).tolist()
+
     # if there are license plates detected, get the bounding box coordinates of each license plate detected by looping through each array
-    for plate_plot in plate_results[0].boxes.data:
+    for plate_index, plate_plot in enumerate(plate_boxes.tolist()):
     
         # get the coordinates of the bounding box
-        x1, y1, x2, y2 = int(plate_plot[0]), int(plate_plot[1]), int(plate_plot[2]), int(plate_plot[3])
+        x1, y1, x2, y2 = plate_plot
     
         # crop the image to the bounding box using cv2
-        plate_crop = veh_crop[y1:y2, x1:x2]
+        plate_crop = crop(veh_crop, plate_plot)
 
         # convert the cropped image to grayscale
         plate_crop = cv2.cvtColor(plate_crop, cv2.COLOR_BGR2GRAY)
@@ -393,12 +316,9 @@ def detect_plate(veh_crop, veh_plot, veh_id, stream):
         if veh_id in target_vehicles:
             plate_track_file_path = "logs/tmp/Vehicle_" + str(veh_id) + "/plate_track.json"
 
-            # Get the current frame number
-            frame_number = str(int(stream.get(cv2.CAP_PROP_POS_FRAMES)))
-
             # Coordinates dictionary for the current frame
             current_frame_data = {
-                frame_number: {
+                str(frame_number): {
                     "x1": str(x1),
                     "y1": str(y1),
                     "x2": str(x2),
@@ -410,7 +330,7 @@ def detect_plate(veh_crop, veh_plot, veh_id, stream):
             if not os.path.exists(plate_track_file_path):
                 # If the file does not exist, create it with the current frame data
                 with open(plate_track_file_path, 'w') as f:
-                    json.dump({frame_number: current_frame_data[frame_number]}, f, indent=4)
+                    json.dump(current_frame_data, f, indent=4)
             else:
                 # If the file exists, read its content, update it, and write it back
                 with open(plate_track_file_path, 'r') as f:
@@ -431,23 +351,65 @@ def detect_plate(veh_crop, veh_plot, veh_id, stream):
 
             # then run the cropped image through the character detector
             # the detect_chars() function will also draw the plate area data (with different colors depending on char results)
-            detect_chars(plate_crop, plate_plot, veh_plot, veh_id)
+            plate_chars = detect_chars(plate_crop, plate_frames[plate_index], veh_id,
+                                       character_results[plate_index] if character_results is not None else None)
+
+            # if a predicted plate box can't be read, run the plate detector again on the next frame
+            if predicted and len(plate_chars) == 0:
+                plate_propagator.invalidate(veh_id)
 
-def detect_vehicles(frame, stream):
+            plates.append((plate_plot, plate_chars))
+
+    return plates
+
+def detect_vehicle_boxes(frame):
+
+    # detections without tracking as [x1, y1, x2, y2, confidence, class] (the tracker layer assigns the ids)
+    return vehicle_detector.predict(frame, classes=VEHICLE_CLASSES, verbose=False)[0].boxes.data.cpu().numpy()
+
+def track_vehicles(frame):
 
-    # detect the vehicle (veh) in the frame
     # use classes 2 (car), 3 (motorcycle), 5, (bus), and 7 (truck)
-    veh_results = vehicle_detector.track(frame, classes=[2,3,5,7], persist=True)
+    if vehicle_tracking is not None:
+        return vehicle_tracking.track(frame)
+
+    return vehicle_detector.track(frame, classes=VEHICLE_CLASSES, persist=True)
+
+def detect_vehicles(frame, stream, stage_results=None):
+
+    # detect the vehicle (veh) in the frame (unless the pipelined vehicle stage already did)
+    # the boxes, ids and scores are copied to numpy arrays once (see utils/detections.py)
+    if stage_results is None:
+        vehicles = vehicle_arrays(track_vehicles(frame), frame.shape)
+    else:
+        vehicles = stage_results["vehicles"]
 
     # create a list with all of the veh ids
-    all_veh_ids = [int(veh[4]) for veh in veh_results[0].boxes.data]
+    all_veh_ids = vehicles["ids"].tolist()
+
+    # mark the frame in the detection recording (also if there are no vehicles)
+    if recorder is not None:
+        recorder.frame(frame_number)
+
+    # pick the vehicles whose plates are read on this frame within the plate budget (the vehicle stage picks them when pipelined)
+    scheduled = None
+    if track_scheduler is not None:
+        if stage_results is None:
+            scheduled = track_scheduler.select(tracked_vehicles(vehicles), frame.shape)
+        else:
+            scheduled = stage_results["scheduled"]
 
     # print the veh ids to the console
     print("\nTarget Vehicle IDs: " + str(target_vehicles))
     print("Active Vehicle IDs: " + str(all_veh_ids))
 
     # display the veh ids in the status widget
-    voted_active_status.code("Target IDs: " + str(target_vehicles) + "\nActive IDs: " + str(all_veh_ids))
+    deferred = "" if scheduled is None else "\nDeferred IDs: " + str([veh_id for veh_id in all_veh_ids if veh_id not in scheduled])
+    voted_active_status.code("Target IDs: " + str(target_vehicles) + "\nActive IDs: " + str(all_veh_ids) + deferred)
+
+    # forget the propagated plate boxes of vehicles that left the frame (the plate stage prunes them on its own frame when pipelined)
+    if plate_propagator is not None and stage_results is None:
+        plate_propagator.prune(all_veh_ids)
 
     # loop through the target vehicles
     for veh_id in target_vehicles:
@@ -455,20 +417,25 @@ def detect_vehicles(frame, stream):
         if veh_id not in all_veh_ids:
             # remove the vehicle ID from the target list and execute the create_perm_log() function for that vehicle
             target_vehicles.remove(veh_id)
+            published_votes.pop(veh_id, None)
+            watchlist_alerts.pop(veh_id, None)
 
             # update the ALPR_status
             with ALPR_status as status:
                 status.update(label = "Creating permanent log...", state = 'running')
-                create_perm_log(veh_id, stream, write_fps)
+                following_result = create_perm_log(veh_id, stream, write_fps)
 
-    # if there are vehicles detected, get the bounding box coordinates of each veh detected by looping through each array
-    for index, veh_plot in enumerate(veh_results[0].boxes.data):
+            # alert right away if the plate keeps showing up (see utils/following.py)
+            if following_result["alert"]:
+                st.toast("Possible following vehicle: " + following_result["plate"] + " (" + str(following_result["trips"]) + " trips, " +
+                         str(following_result["hour_count"]) + " sightings in the last hour)", icon = "🚨")
 
-        # get the veh if it exists
-        if veh_results[0][index].boxes.id is None:
-            veh_id = 0
-        else:
-            veh_id = int(veh_results[0][index].boxes.id)
+    # time of the plate reads on this frame (fed back to the scheduler)
+    plate_ms = 0
+    plate_reads = 0
+
+    # if there are vehicles detected, get the bounding box coordinates of each veh detected by looping through each array
+    for index, (veh_id, veh_plot) in enumerate(zip(all_veh_ids, vehicles["boxes"].tolist())):
 
         # if the veh id is 0, skip the current loop iteration
         # this is because the veh id is 0 when there's not enough frames to track the veh yet
@@ -476,10 +443,10 @@ def detect_vehicles(frame, stream):
             continue
 
         # get the coordinates of the bounding box
-        x1, y1, x2, y2 = int(veh_plot[0]), int(veh_plot[1]), int(veh_plot[2]), int(veh_plot[3])
+        x1, y1, x2, y2 = veh_plot
 
         # crop the image to the bounding box using cv2
-        veh_crop = frame[y1:y2, x1:x2]
+        veh_crop = crop(frame, veh_plot)
 
         # save the cropped image as current_vehicle.jpg
         cv2.imwrite("frames/current_vehicle.jpg", veh_crop)
@@ -492,23 +459,23 @@ def detect_vehicles(frame, stream):
         if veh_id in target_vehicles:
 
             ### save original frame ###
-            if not os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/frames"):
-                os.makedirs("logs/tmp/Vehicle_" + str(veh_id) + "/frames")
+            if not os.path.exists("logs/tmp/Vehicle_" + str(veh_id)):
+                os.makedirs("logs/tmp/Vehicle_" + str(veh_id))
 
-            if not os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/frames/" + str(int(stream.get(cv2.CAP_PROP_POS_FRAMES))) + ".jpg"):
-                cv2.imwrite("logs/tmp/Vehicle_" + str(veh_id) + "/frames/" + str(int(stream.get(cv2.CAP_PROP_POS_FRAMES))) + ".jpg", frame)
+            # the frames are appended to the tmp segment store instead of one jpg file per frame
+            frame_key = "Vehicle_" + str(veh_id) + "/frames/" + str(frame_number)
+
+            if not tmp_store().exists(frame_key):
+                tmp_store().put(frame_key, cv2.imencode(".jpg", frame)[1].tobytes())
             ###
 
             ### write vehicle track data ###
             # if the json file does not exist, create it and add the frame number and coordinates
             json_file_path = "logs/tmp/Vehicle_" + str(veh_id) + "/vehicle_track.json"
 
-            # Get the current frame number
-            frame_number = str(int(stream.get(cv2.CAP_PROP_POS_FRAMES)))
-
             # Coordinates dictionary for the current frame
             current_frame_data = {
-                frame_number: {
+                str(frame_number): {
                     "x1": str(x1),
                     "y1": str(y1),
                     "x2": str(x2),
@@ -520,7 +487,7 @@ def detect_vehicles(frame, stream):
             if not os.path.exists(json_file_path):
                 # If the file does not exist, create it with the current frame data
                 with open(json_file_path, 'w') as f:
-                    json.dump({frame_number: current_frame_data[frame_number]}, f, indent=4)
+                    json.dump(current_frame_data, f, indent=4)
             else:
                 # If the file exists, read its content, update it, and write it back
                 with open(json_file_path, 'r') as f:
@@ -550,9 +517,188 @@ def detect_vehicles(frame, stream):
 
             # run the cropped image through the license plate detector
             # the detect_plate() function will continue the process to char detection
-            detect_plate(veh_crop, veh_plot, veh_id, stream)
+            if scheduled is not None and veh_id not in scheduled:
+                # the plate of this vehicle is read on a later frame (still tracked and logged)
+                plates = []
+            elif stage_results is None:
+                plate_start = time.perf_counter()
+                plates = detect_plate(veh_crop, veh_plot, veh_id, stream)
+                plate_ms += (time.perf_counter() - plate_start) * 1000
+                plate_reads += 1
+            else:
+                plates = detect_plate(veh_crop, veh_plot, veh_id, stream, stage_results["plate_boxes"][index],
+                                      stage_results["character_results"][index], stage_results["plate_predicted"][index])
+
+        # record the vehicle box, plate boxes and raw OCR candidates so they can be replayed with tools/replay.py
+        if recorder is not None:
+            recorder.vehicle(frame_number, veh_id, veh_plot, plates)
+
+    if track_scheduler is not None and stage_results is None:
+        track_scheduler.done(plate_ms, plate_reads)
 #^# ALPR functions #^#
 
+#_# Pipelined ALPR stages #_#
+# every stage runs on its own thread (see utils/pipeline.py) so vehicle detection on the next frame
+# overlaps plate detection and OCR on the current frame
+# the stages only run the models, drawing, logging and the web app updates stay in detect_vehicles() on the main thread
+
+def read_frame_stage():
+
+    # set the frame_skip on the video stream and get the frame
+    stream.set(cv2.CAP_PROP_POS_FRAMES, stream.get(cv2.CAP_PROP_POS_FRAMES) + frame_skip)
+    ret, frame = stream.read()
+
+    # returning None ends the pipeline
+    if not ret:
+        return None
+
+    return {"frame": frame, "frame_number": int(stream.get(cv2.CAP_PROP_POS_FRAMES))}
+
+def vehicle_stage(item):
+
+    item["vehicles"] = vehicle_arrays(track_vehicles(item["frame"]), item["frame"].shape)
+    item["veh_crops"] = {}
+    item["plate_ms"] = 0
+
+    # only the vehicles picked within the plate budget go to the plate and ocr stages
+    item["scheduled"] = None
+    if track_scheduler is not None:
+        item["scheduled"] = track_scheduler.select(tracked_vehicles(item["vehicles"]), item["frame"].shape)
+
+    # crop every tracked vehicle for the plate stage
+    for index, (veh_id, veh_plot) in enumerate(zip(item["vehicles"]["ids"].tolist(), item["vehicles"]["boxes"].tolist())):
+        if veh_id == 0 or (item["scheduled"] is not None and veh_id not in item["scheduled"]):
+            continue
+
+        item["veh_crops"][index] = (veh_id, veh_plot, crop(item["frame"], veh_plot).copy())
+
+    return item
+
+def plate_stage(item):
+
+    stage_start = time.perf_counter()
+
+    # forget the propagated plate boxes of vehicles that left this frame
+    # (pruning on the main thread would drop the predictions already made for the frames ahead of it)
+    if plate_propagator is not None:
+        plate_propagator.prune(item["vehicles"]["ids"].tolist())
+
+    item["plate_boxes"] = {}
+    item["plate_predicted"] = {}
+    for index, (veh_id, veh_plot, veh_crop) in item["veh_crops"].items():
+        item["plate_boxes"][index], item["plate_predicted"][index] = find_plates(veh_crop, veh_plot, veh_id)
+
+    item["plate_ms"] += (time.perf_counter() - stage_start) * 1000
+    return item
+
+def ocr_stage(item):
+
+    stage_start = time.perf_counter()
+
+    # read every plate of every vehicle (same crop and grayscale conversion as detect_plate)
+    item["character_results"] = {}
+    for index, plate_boxes in item["plate_boxes"].items():
+        veh_crop = item["veh_crops"][index][2]
+        item["character_results"][index] = []
+
+        for plate_plot in plate_boxes.tolist():
+            plate_crop = cv2.cvtColor(crop(veh_crop, plate_plot), cv2.COLOR_BGR2GRAY)
+            item["character_results"][index].append(read_plate(character_detector, plate_crop, ocr_engine))
+
+    item["plate_ms"] += (time.perf_counter() - stage_start) * 1000
+    if track_scheduler is not None:
+        track_scheduler.done(item["plate_ms"], len(item["veh_crops"]))
+
+    return item
+
+#^# Pipelined ALPR stages #^#
+
+#_# Memory watchdog #_#
+# the counters and shedders of the subsystems that grow while the app runs for hours (see utils/memory_watchdog.py)
+
+def vehicle_tracker():
+
+    # the ByteTrack tracker that the vehicle detector persists between frames (None until the first frame is tracked)
+    trackers = getattr(getattr(vehicle_detector, "predictor", None), "trackers", None)
+    return trackers[0] if trackers else None
+
+def count_tracker_stracks():
+
+    # the tracker layer (see utils/vehicle_tracker.py) counts its own tracks
+    if vehicle_tracking is not None:
+        return len(vehicle_tracking.tracker)
+
+    tracker = vehicle_tracker()
+    if tracker is None:
+        return 0
+    return len(tracker.tracked_stracks) + len(tracker.lost_stracks) + len(tracker.removed_stracks)
+
+def shed_preview():
+
+    # halve the size of the preview frame sent to the browser (down to a quarter)
+    global preview_scale
+    preview_scale = max(0.25, preview_scale / 2)
+
+def restore_preview():
+
+    # double the preview size again once the memory dropped under the low water mark, True once it is back to full size
+    global preview_scale
+    preview_scale = min(1.0, preview_scale * 2)
+    return preview_scale >= 1.0
+
+def shed_plate_predictions():
+    if plate_propagator is not None:
+        plate_propagator.clear()
+
+def shed_scheduled_tracks():
+    if track_scheduler is not None:
+        track_scheduler.clear()
+
+def shed_tracker_history():
+
+    # the removed tracks are only kept so their ids aren't matched again
+    if vehicle_tracking is not None:
+        vehicle_tracking.tracker.shed()
+        return
+
+    tracker = vehicle_tracker()
+    if tracker is not None:
+        tracker.removed_stracks.clear()
+
+def init_watchdog():
+
+    watchdog = MemoryWatchdog(memory_config(st.session_state))
+
+    watchdog.register("target_vehicles", counter = lambda: len(target_vehicles))
+    watchdog.register("tracker_stracks", counter = count_tracker_stracks, shedder = shed_tracker_history)
+    watchdog.register("plate_predictions", counter = lambda: len(plate_propagator.tracks) if plate_propagator is not None else 0, shedder = shed_plate_predictions)
+    watchdog.register("scheduled_tracks", counter = lambda: len(track_scheduler) if track_scheduler is not None else 0, shedder = shed_scheduled_tracks)
+    watchdog.register("export_buffers", shedder = release_export_memory)
+    watchdog.register("tmp_frames", counter = lambda: len(tmp_store().keys()))
+    watchdog.register("preview", counter = lambda: preview_scale, shedder = shed_preview, restorer = restore_preview)
+
+    # counting every python object is slow, only do it when the diagnostics are on
+    if watchdog.config["diagnostics"]:
+        watchdog.register("python_objects", counter = lambda: len(gc.get_objects()))
+
+    return watchdog
+
+def display_watchdog(sample):
+
+    # show the last memory sample and the lines that allocated the most since processing started
+    text = "RSS: " + str(sample["rss_mb"]) + " MB"
+    if watchdog.config["ceiling_mb"]:
+        text += " (ceiling " + str(watchdog.config["ceiling_mb"]) + " MB)"
+
+    text += "\n" + "\n".join(name + ": " + str(count) for name, count in sample["objects"].items())
+
+    if watchdog.top_growth:
+        text += "\n\nTop growth sites:\n" + "\n".join(site["site"] + "  +" + str(site["growth_kb"]) + " KB" for site in watchdog.top_growth[:5])
+
+    memory_status.code(text)
+
+#^# Memory watchdog #^#
+
 #########################
 #########################
 #_# Web app functions #_#
@@ -654,6 +800,9 @@ elif 'frame_skip' in st.session_state:
     # set the frame_skip to the value in the session state
     frame_skip = st.session_state['frame_skip']
 
+# uploaded videos can be processed in parallel time shards instead of frame-by-frame
+shard_workers = st.session_state.get('shard_workers', 1) if st.session_state['cam_or_vid'] == True else 1
+
 #^# SETTINGS HANDLING #^#
 #########################
 
@@ -667,6 +816,15 @@ st.sidebar.write(st.session_state) # FOR DEVELOPMENT ONLY
 #########################
 #########################
 
+# the detection recorder and memory watchdog are only created when processing starts
+recorder = None
+watchdog = None
+vehicle_cascade = None
+vehicle_tracking = None
+
+# the preview frame is scaled down when the memory watchdog sheds it
+preview_scale = 1.0
+
 # check if the stream_path & frame_skip are not None
 if stream_path != None and frame_skip != None:
 
@@ -691,13 +849,20 @@ if stream_path != None and frame_skip != None:
         voted_active_status = console_col_status.empty()
         voted_string_status = console_col_status.empty()
         active_string_status = console_col_status.empty()
+        memory_status = console_col_status.empty()
+        detector_status = console_col_status.empty()
+        watchlist_status = console_col_status.empty()
 
         # create a video capture object from video stream
-        stream = cv2.VideoCapture(stream_path)
+        # a webcam is opened in the capture mode picked in settings (or the highest resolution the driver offers)
+        if st.session_state['cam_or_vid'] == False:
+            stream = open_camera(stream_path, st.session_state.get('cam_mode'))
+        else:
+            stream = cv2.VideoCapture(stream_path)
 
-        # set the w and h to the highest possible value to use the highest resolution
-        stream.set(cv2.CAP_PROP_FRAME_WIDTH, 10000)
-        stream.set(cv2.CAP_PROP_FRAME_HEIGHT, 10000)
+            # set the w and h to the highest possible value to use the highest resolution
+            stream.set(cv2.CAP_PROP_FRAME_WIDTH, 10000)
+            stream.set(cv2.CAP_PROP_FRAME_HEIGHT, 10000)
 
         # calculate the write fps
         write_fps = calc_write_fps(stream, frame_skip)
@@ -705,60 +870,173 @@ if stream_path != None and frame_skip != None:
         # create a empty list to hold the target vehicles that have plate detections
         target_vehicles = []
 
+        # the last voted plate published on the event stream for every target vehicle
+        published_votes = {}
+
+        # the watched plates that were already alerted for every target vehicle
+        # the watchlist file is reloaded incrementally when it's edited in settings
+        watchlist = Watchlist()
+        watchlist_alerts = {}
+
+        # run the plate detector on each vehicle only every plate_interval frames and propagate the box in between
+        plate_interval = st.session_state.get('plate_interval', 1)
+        plate_propagator = PlatePropagator(plate_interval) if plate_interval > 1 else None
+
+        # only read the plates of the most valuable vehicles on each frame when there is a plate budget (see settings)
+        plate_budget_ms = st.session_state.get('plate_budget_ms', 0)
+        track_scheduler = TrackScheduler(plate_budget_ms) if plate_budget_ms > 0 else None
+
+        # record every frame's detections to a compact binary log if enabled in settings (live mode only)
+        if st.session_state.get('record_detections', False) and shard_workers == 1:
+            recorder = DetectionRecorder(new_recording_path(), stream.get(cv2.CAP_PROP_FPS), int(stream.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                         int(stream.get(cv2.CAP_PROP_FRAME_HEIGHT)), frame_skip, stream_path)
+
     with ALPR_status as status:
         status.update(label = "Initializing models...", state = 'running')
 
-        init_models()
+        # in sharded mode every worker process loads its own models
+        if shard_workers == 1:
+            init_models()
+
+            # sample the memory and enforce the ceiling set in settings (live mode only)
+            watchdog = init_watchdog()
+
+        # start the background retention worker with the limits set in settings (keeps the perm media within budget)
+        start_retention_worker(retention_config(st.session_state))
 
-# create a loop to go through every frame
-while st.session_state.start_processing:
+        # publish the detections on the local event stream (python -m tools.events subscribes to it)
+        start_event_bus()
 
-    # Re-calculate the resource usage every time a new frame is processed
-    # this is called outside the "with ALPR_status" statement to avoid including the progress bars inside the status widget
-    # the label is updated in the function itself by passing the status widget as an argument)
-    display_resources(ALPR_status)
+        # export every finished track to the columnar files if enabled in settings (see utils/columnar_export.py)
+        configure_export(export_config(st.session_state))
+
+# process the video in overlapping time shards on a process pool
+if st.session_state.start_processing and shard_workers > 1:
 
     with ALPR_status as status:
+        status.update(label = "Processing video in " + str(shard_workers) + " parallel workers...", state = 'running')
 
-        # update the ALPR status to running
-        status.update(label = "Reading next frame...", state = 'running')
+        shard_progress = st.progress(0, text = "Shards processed: 0")
 
-        # set the frame_skip on the video stream
-        stream.set(cv2.CAP_PROP_POS_FRAMES, stream.get(cv2.CAP_PROP_POS_FRAMES) + frame_skip)
+        def update_shard_progress(done, total):
+            shard_progress.progress(int(done / total * 100), text = f"Shards processed: {done} of {total}")
 
-        # get the frame
-        ret, frame = stream.read()
-    
-    # if the frame is empty (the video is over), break the loop
-    if not ret:
-        st.session_state.start_processing = False
+        # detect, track and read plates in every shard and stitch the tracks across the shard boundaries
+        tracks = run_sharded(stream_path, frame_skip, shard_workers, progress = update_shard_progress,
+                             ocr_engine = st.session_state.get('ocr_engine', 'full'))
 
-        # update the ALPR status to stopped
-        with ALPR_status as status:
-            st.error("Stream interupted or ended")
-            status.update(label = "ALPR inactive", state = 'error')
+        status.update(label = "Creating permanent logs...", state = 'running')
+        create_track_logs(tracks, stream, write_fps)
 
-        # break the while loop
-        break
+    st.session_state.start_processing = False
 
-    # start the ALPR process
     with ALPR_status as status:
-        status.update(label = "Detecting vehicle(s)...", state = 'running')
+        st.success("Video processed: " + str(len(tracks)) + " vehicle(s) logged")
+        status.update(label = "ALPR inactive", state = 'complete')
 
-        # detect_vehicles() -> detect_plate() -> detect_chars()
-        detect_vehicles(frame, stream)
+# the cleanup in the finally block also runs when streamlit stops the script in the middle of a frame (page change or rerun)
+# so the stage threads, the recording and the webcam are not left open for the next run
+pipeline = None
+try:
 
-    with ALPR_status as status:
-        status.update(label = "Writing frame data...", state = 'running')
+    # start the stage threads if pipelined execution is enabled in settings
+    if st.session_state.start_processing and st.session_state.get('pipelined', False):
+        pipeline = StagePipeline(read_frame_stage, [vehicle_stage, plate_stage, ocr_stage])
+
+    # create a loop to go through every frame
+    while st.session_state.start_processing:
+
+        # the processing time of every frame is fed back to the detector cascade
+        frame_start = time.perf_counter()
 
-        # save the frame as current_frame.jpg
-        cv2.imwrite("frames/current_frame.jpg", frame)
+        # Re-calculate the resource usage every time a new frame is processed
+        # this is called outside the "with ALPR_status" statement to avoid including the progress bars inside the status widget
+        # the label is updated in the function itself by passing the status widget as an argument)
+        display_resources(ALPR_status)
+
+        # sample the memory (and shed caches if it's over the ceiling)
+        if watchdog is not None:
+            memory_sample = watchdog.check()
+            if memory_sample is not None and watchdog.config["diagnostics"]:
+                display_watchdog(memory_sample)
+
+        with ALPR_status as status:
+
+            # update the ALPR status to running
+            status.update(label = "Reading next frame...", state = 'running')
+
+            if pipeline is None:
+                # set the frame_skip on the video stream
+                stream.set(cv2.CAP_PROP_POS_FRAMES, stream.get(cv2.CAP_PROP_POS_FRAMES) + frame_skip)
+
+                # get the frame
+                ret, frame = stream.read()
+                frame_number = int(stream.get(cv2.CAP_PROP_POS_FRAMES))
+                stage_results = None
+            else:
+                # get the next frame in order with the model results of the stage threads
+                stage_results = next(pipeline, None)
+                ret = stage_results is not None
+                if ret:
+                    frame = stage_results["frame"]
+                    frame_number = stage_results["frame_number"]
+    
+        # if the frame is empty (the video is over), break the loop
+        if not ret:
+            st.session_state.start_processing = False
+
+            # update the ALPR status to stopped
+            with ALPR_status as status:
+                st.error("Stream interupted or ended")
+                status.update(label = "ALPR inactive", state = 'error')
+
+            # break the while loop
+            break
+
+        # start the ALPR process
+        with ALPR_status as status:
+            status.update(label = "Detecting vehicle(s)...", state = 'running')
+
+            # detect_vehicles() -> detect_plate() -> detect_chars()
+            detect_vehicles(frame, stream, stage_results)
+
+        with ALPR_status as status:
+            status.update(label = "Writing frame data...", state = 'running')
+
+            # save the frame as current_frame.jpg
+            cv2.imwrite("frames/current_frame.jpg", frame)
         
-        # display the frame in the web app
-        frame_col_status.image(frame, channels="BGR", use_column_width=True)
+            # display the frame in the web app (scaled down if the memory watchdog shed the preview)
+            if preview_scale < 1:
+                frame = cv2.resize(frame, None, fx = preview_scale, fy = preview_scale, interpolation = cv2.INTER_AREA)
+            frame_col_status.image(frame, channels="BGR", use_column_width=True)
+
+        # step the vehicle detector down (or back up) if the frames take longer than the budget
+        if vehicle_cascade is not None:
+            vehicle_cascade.observe((time.perf_counter() - frame_start) * 1000)
+
+            latency = "" if vehicle_cascade.latency_ms is None else ", " + str(round(vehicle_cascade.latency_ms)) + " ms per frame"
+            detector_status.code("Vehicle detector: " + vehicle_cascade.name + latency)
+
+finally:
+
+    # if the stream is defined
+    if stream_path != None:
+
+        # stop the stage threads before releasing the stream they read from
+        if pipeline is not None:
+            pipeline.close()
+
+        # write the last frame of the detection recording
+        if recorder is not None:
+            recorder.close()
+
+        # write the final memory report
+        if watchdog is not None:
+            watchdog.close()
 
-# if the stream is defined
-if stream_path != None:
+        # save the journaled sightings to all_plates.json and the aggregates
+        flush_history()
     
-    # release the video capture object
-    stream.release()
\ No newline at end of file
+        # release the video capture object
+        stream.release()
\ No newline at end of file
@@ -1,47 +1,123 @@
 import os
 import pandas as pd
-import json
 import streamlit as st
 import time
+from utils.plate_stats import detection_mean, detection_median, risk_level
+from utils.sighting_history import current_plate_stats, current_all_plates, history_version, journal_path, ALL_PLATES_PATH
+from utils.segment_store import read_media, PERM_STORE_DIR
+from utils.retention import get_usage_report, run_retention, retention_config, PERM_DIR, STATE_PATH
+
+# number of plates shown per page of the dataframe
+PAGE_SIZE = 50
+
+# columns the dataframe can be sorted by (label: aggregate key)
+SORT_OPTIONS = {
+    "Last Seen": "last_ts",
+    "First Seen": "first_ts",
+    "Sightings": "count",
+    "Following": "following_score",
+    "Plate": "plate"
+}
+
+# the aggregates and the sorted plates are shared as they are instead of copied on every rerun (cache_data unpickles a copy),
+# so they must be treated as read-only, only the latest history versions are kept
+
+@st.cache_resource(max_entries = 2)
+def get_plate_stats(version):
+
+    # the version argument is only used as the cache key so the aggregates are re-read after every new sighting
+    # (the aggregates file with the sightings journaled since it was written)
+    return current_plate_stats()
+
+@st.cache_resource(max_entries = 2 * 2 * len(SORT_OPTIONS))
+def get_sorted_plates(version, sort_key, descending):
+
+    # sort the plates once per history version and sort option
+    stats = get_plate_stats(version)
+
+    if sort_key == "plate":
+        return sorted(stats["plates"], reverse = descending)
+
+    # plates logged before the following engine existed have no score yet
+    return sorted(stats["plates"], key = lambda plate: stats["plates"][plate].get(sort_key, 0), reverse = descending)
+
+@st.cache_data(ttl = 60)
+def get_storage_report(version, config):
+
+    # the version argument is only used as the cache key so the perm store and the log folders are only walked again
+    # after media was added or removed (the ttl refreshes the free disk space)
+    return get_usage_report(config)
+
+def storage_version():
+
+    # the perm store index, the folder of the older per log media and the retention state
+    version = []
+    for path in (os.path.join(PERM_STORE_DIR, "index.jsonl"), PERM_DIR, STATE_PATH):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+
+    return tuple(version)
 
 def display_dataframe():
 
-    # check if the all_plates.json file exists
-    if os.path.exists("logs/perm/all_plates.json"):
+    # get the aggregates (cached until the history changes)
+    version = history_version()
+    stats = get_plate_stats(version)
+
+    # check if any plate was logged yet
+    if stats["plates"]:
+
+        mean_detection_count = detection_mean(stats)
+        median_detection_count = detection_median(stats)
 
-        # get the all_plates.json file
-        with open("logs/perm/all_plates.json", "r") as file:
-            all_plates = json.load(file)
+        # sorting, filtering and paging controls
+        sort_col, order_col, search_col, risk_col = st.columns([2, 1, 2, 2])
+        sort_by = sort_col.selectbox("Sort by", list(SORT_OPTIONS.keys()))
+        descending = order_col.toggle("Descending", value = True)
+        search = search_col.text_input("Search plate").strip().upper()
+        risk_filter = risk_col.multiselect("Risk", ["High", "Medium", "Low"], default = ["High", "Medium", "Low"])
 
-        # Create a list and append the data to it
+        plates = get_sorted_plates(version, SORT_OPTIONS[sort_by], descending)
+
+        # only walk the plates when a filter is actually set
+        if search:
+            plates = [plate for plate in plates if search in plate]
+
+        if len(risk_filter) < 3:
+            plates = [plate for plate in plates if risk_level(stats["plates"][plate]["count"], mean_detection_count, median_detection_count,
+                                                              stats["plates"][plate].get("following", False)) in risk_filter]
+
+        if not plates:
+            st.info("No plates match the current filters")
+            return
+
+        num_pages = (len(plates) - 1) // PAGE_SIZE + 1
+        page = st.number_input("Page (" + str(num_pages) + " total)", min_value = 1, max_value = num_pages, value = 1)
+
+        # Create a list with only the rows on the current page
         data = []
 
-        for plate, detections in all_plates.items():
+        for plate in plates[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]:
+            entry = stats["plates"][plate]
             data.append({
                 "analyze": "/Analysis?plate=" + plate,
                 "plate": plate,
-                "detection_count": len(detections), # Keep as int for calculations
-                "first_seen": detections[0]["date"] + " " + detections[0]["time"],
-                "last_seen": detections[-1]["date"] + " " + detections[-1]["time"],
+                "detection_count": str(entry["count"]), # Convert to string to align left
+                "first_seen": entry["first_seen"],
+                "last_seen": entry["last_seen"],
+                "trips": str(entry.get("trips", "")),
+                "following_score": int(entry.get("following_score", 0) * 100),
+                "risk": risk_level(entry["count"], mean_detection_count, median_detection_count, entry.get("following", False))
             })
 
         # Create a pandas DataFrame from the list
         df = pd.DataFrame(data)
 
-        mean_detection_count = df['detection_count'].mean()
-        median_detection_count = df['detection_count'].median()
-
-        # Determine risk levels based on detection count and add to DataFrame
-        df['risk'] = df['detection_count'].apply(
-            lambda x: 'High' if x > median_detection_count else
-                    ('Medium' if x > mean_detection_count else 'Low')
-        )
-
-        # Convert to string to align left
-        df['detection_count'] = df['detection_count'].astype(str)
-
         # Display the DataFrame using streamlit
-        all_plates_dataframe.dataframe(
+        st.dataframe(
             df,
             column_config={
                 "analyze": st.column_config.LinkColumn("Analyze", display_text = "View media"),
@@ -49,6 +125,9 @@ def display_dataframe():
                 "detection_count": "Sightings",
                 "first_seen": "First Seen",
                 "last_seen": "Last Seen",
+                "trips": "Trips",
+                "following_score": st.column_config.ProgressColumn("Following", help = "Highest following score of the plate (repeat sightings within 10 minutes, spread over the last hour and separate trips)",
+                                                                   format = "%d%%", min_value = 0, max_value = 100),
                 "risk": "Risk"
             },
 
@@ -57,9 +136,33 @@ def display_dataframe():
         )
 
     else:
-        # if the all_plates.json file does not exist, display an error
+        # if no plate was logged yet, display an error
         st.error("No plates detected yet")
 
+def display_storage():
+
+    # show how much space the perm media uses compared to the budget set in settings
+    config = retention_config(st.session_state)
+    report = get_storage_report(storage_version(), config)
+
+    with st.expander("Storage: " + str(round(report["media_mb"])) + " MB of media in " + str(report["num_logs"]) + " logs"):
+
+        if report["budget_mb"] > 0:
+            used_percent = min(100, int(report["media_mb"] / report["budget_mb"] * 100))
+            st.progress(used_percent, text = f"Budget: {used_percent}% ({round(report['media_mb'])} MB of {report['budget_mb']} MB)")
+        else:
+            st.caption("No disk budget set (see settings)")
+
+        st.code(f"Disk free: {round(report['disk_free_mb'])} MB of {round(report['disk_total_mb'])} MB"
+                f"\nEvicted so far: {round(report['evicted_mb'])} MB"
+                f"\nTranscoded clips: {report['transcoded']}"
+                f"\nLast retention run: {report['last_run']}")
+
+        if st.button("Apply retention now"):
+            with st.spinner("Applying retention..."):
+                run_retention(config)
+            st.rerun()
+
 def clear_logs():
     with st.spinner("Refreshing..."):
         os.system("sudo rm -rf ./logs")  # use sudo to clear perm logs where permissions are required
@@ -82,12 +185,11 @@ if plate != None:
 
     # Get the list of times the plate was detected from /logs/perm/all_plates.json
     
-    # check if the all_plates.json file exists
-    if os.path.exists("logs/perm/all_plates.json"):
+    # check if the all_plates.json file (or the journal of the first sightings) exists
+    if os.path.exists(ALL_PLATES_PATH) or os.path.exists(journal_path()):
 
-        # get the all_plates.json file
-        with open("logs/perm/all_plates.json", "r") as file:
-            all_plates = json.load(file)
+        # get the all_plates.json file with the sightings journaled since it was written
+        all_plates = current_all_plates()
 
         # check if the plate is in the all_plates.json file
         if plate in all_plates:
@@ -103,16 +205,21 @@ if plate != None:
                     # create 2 columns for the video and images
                     vid_col, image_col = st.columns([3, 1])
 
-                    # load video bytes
-                    vid_file = open('logs' + plate["video_path"], 'rb')
-                    vid_bytes = vid_file.read()
+                    # load video bytes through the segment store index (or the file of older logs)
+                    # the media may have been removed by the retention worker (the sighting is kept)
+                    vid_bytes = read_media(plate["video_path"])
 
                     # display the video
-                    vid_col.video(vid_bytes)
+                    if vid_bytes is not None:
+                        vid_col.video(vid_bytes)
+                    else:
+                        vid_col.info("Video removed by storage retention")
 
                     # display the images vertically
-                    image_col.image('logs' + plate["veh_crop_path"], use_column_width=True)
-                    image_col.image('logs' + plate["plate_crop_path"], use_column_width=True)
+                    for crop_path in [plate["veh_crop_path"], plate["plate_crop_path"]]:
+                        crop_bytes = read_media(crop_path)
+                        if crop_bytes is not None:
+                            image_col.image(crop_bytes, use_column_width=True)
 
         else:
             st.error("Plate number not found in logs.")
@@ -148,7 +255,6 @@ else:
             st.session_state.confirm_clear = False  # Reset the state without clearing logs
             st.rerun()  # Rerun to reflect the state reset
 
-    # create an empty dataframe object
-    all_plates_dataframe = st.empty()
+    display_storage()
 
     display_dataframe()
\ No newline at end of file
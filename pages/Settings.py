@@ -1,8 +1,10 @@
-import re
-import subprocess
+import os
 import streamlit as st
-import tempfile
 import cv2
+from utils.uploads import save_upload, touch_upload, probe_video, cleanup_uploads
+from utils.watchlist import read_watchlist, write_watchlist, normalize_plate
+from utils.columnar_export import default_device
+from utils.cameras import list_cameras, best_mode, mode_label
 
 # Initialize session state variables if not already set
 if 'cam_or_vid' not in st.session_state:
@@ -14,32 +16,14 @@ if 'cam_index' not in st.session_state:
 if 'file_path' not in st.session_state:
     st.session_state['file_path'] = None
 
-def list_webcams():
-    # use the lsusb command to list all usb devices
-    device_re = re.compile(b"Bus\s+(?P<bus>\d+)\s+Device\s+(?P<device>\d+).+ID\s(?P<id>\w+:\w+)\s(?P<tag>.+)$", re.I)
-    df = subprocess.check_output("lsusb", shell=True)
-    
-    # create an empty list to store the webcams
-    devices = []
-
-    # iterate through the list of usb devices and check for common webcam identifiers
-    for i in df.split(b'\n'):
-        if i:
-            info = device_re.match(i)
-            if info:
-                dinfo = info.groupdict()
-                if b'camera' in dinfo['tag'].lower() or b'webcam' in dinfo['tag'].lower():  # Check for common webcam identifiers
-                    dinfo['device'] = '/dev/bus/usb/%s/%s' % (dinfo.pop('bus'), dinfo.pop('device'))
-                    devices.append(dinfo)
-
-    # reverse the list of devices
-    devices.reverse()
+if 'retention_budget_mb' not in st.session_state:
+    st.session_state['retention_budget_mb'] = 0 # 0 = no disk budget
 
-    # restructure the list to incude the index as the key
-    for i, device in enumerate(devices):
-        devices[i] = {i: device}
+if 'retention_max_age_days' not in st.session_state:
+    st.session_state['retention_max_age_days'] = 0 # 0 = keep media forever
 
-    return devices
+if 'retention_transcode_days' not in st.session_state:
+    st.session_state['retention_transcode_days'] = 0 # 0 = never transcode
 
 def classify_resolution(width, height):
     if height >= 2160 or width >= 3840:
@@ -67,34 +51,59 @@ st.divider()
 if cam_or_vid == False:
     st.session_state['file_path'] = None
 
-    # get the list of webcams
-    webcams = list_webcams()
+    # get the list of webcams and their capture modes (only enumerated again when a camera is plugged in or out)
+    webcams = list_cameras()
     
     st.write('##### Connected webcams:')
 
-    # if no webcams are found, display an error message
+    # if no webcams are found, display an error message and let the user pick the index by hand
     if not webcams:
-        st.error("No webcams found.Please connect a camera and refresh the page.")
+        st.error("No webcams found. Please connect a camera and refresh the page.")
+
+        st.write('#') # SPACER
+
+        webcam_option = st.selectbox(
+            '##### Select stream index:',
+            options = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+            index = st.session_state['cam_index']
+        )
+
+        # set the session states for the index (the driver picks the mode)
+        st.session_state['cam_index'] = webcam_option
+        st.session_state['cam_mode'] = None
 
-    # if webcams are found, display the list of webcams in a dropdown
+    # if webcams are found, display the list of webcams and their capture modes in dropdowns
     else:
-        # reorganize the webcam list to be a comma separated string of just the tags
-        webcam_tags = [list(webcam.values())[0]['tag'] for webcam in webcams]
+        for webcam in webcams:
+            st.code(webcam['name'] + " (" + webcam['device'] + (", " + webcam['id'] if webcam['id'] else "") + ")")
 
-        # display the list of webcams as h3
-        for tag in enumerate(webcam_tags):
-            st.code(tag[1])
+        st.write('#') # SPACER
 
-    st.write('#') # SPACER
+        webcam_indexes = [webcam['index'] for webcam in webcams]
+        webcam_option = st.selectbox(
+            '##### Select webcam:',
+            options = webcam_indexes,
+            format_func = lambda index: str(index) + ": " + webcams[webcam_indexes.index(index)]['name'],
+            index = webcam_indexes.index(st.session_state['cam_index']) if st.session_state['cam_index'] in webcam_indexes else 0
+        )
 
-    webcam_option = st.selectbox(
-        '##### Select stream index:',
-        options = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
-        index = st.session_state['cam_index']
-    )
+        # set the session states for the index
+        st.session_state['cam_index'] = webcam_option
 
-    # set the session states for the tag and index
-    st.session_state['cam_index'] = webcam_option
+        # pick the exact format, resolution and frame rate instead of whatever the driver negotiates
+        # (a compressed format like MJPG reaches higher frame rates and is cheaper to decode than raw YUYV at the same size)
+        webcam_modes = webcams[webcam_indexes.index(webcam_option)]['modes']
+
+        if webcam_modes:
+            mode_labels = [mode_label(mode) for mode in webcam_modes]
+            current_mode = st.session_state.get('cam_mode')
+            default_mode = current_mode if current_mode in webcam_modes else best_mode(webcam_modes)
+
+            selected_mode = st.selectbox('##### Capture mode:', options = mode_labels, index = mode_labels.index(mode_label(default_mode)),
+                                         help = 'The modes the camera reports. The default is the highest resolution and frame rate.')
+            st.session_state['cam_mode'] = webcam_modes[mode_labels.index(selected_mode)]
+        else:
+            st.session_state['cam_mode'] = None
 
     st.divider()
 
@@ -109,14 +118,18 @@ elif cam_or_vid == True:
     # set the session state
     if uploaded_file is not None:
 
-        # Use tempfile.NamedTemporaryFile to create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+        # only write the upload to disk once, reruns (e.g. moving a slider) reuse the stored file
+        if st.session_state.get('upload_id') != uploaded_file.file_id or not os.path.exists(st.session_state['file_path'] or ''):
+
+            with st.spinner('Saving video...'):
+                # stream the upload to disk in chunks, the same video uploaded again is stored only once
+                st.session_state['file_path'] = save_upload(uploaded_file)
+                st.session_state['upload_id'] = uploaded_file.file_id
 
-            # Write the data from the uploaded file into the temporary file
-            tmp_file.write(uploaded_file.read())
-            
-            # Store the path of the temporary file in session_state
-            st.session_state['file_path'] = tmp_file.name
+                # remove old uploads so they don't fill up the tmp directory
+                cleanup_uploads(keep = st.session_state['file_path'])
+        else:
+            touch_upload(st.session_state['file_path'])
 
     st.divider()
 
@@ -131,30 +144,40 @@ if st.session_state['cam_or_vid'] == False:
         #_# GET WEBCAM PROPERTIES #_#
         #############################
 
-        # try opening the webcam
-        cap = cv2.VideoCapture(st.session_state['cam_index'])
+        webcam_properties = None
+        webcam_mode = st.session_state.get('cam_mode')
+
+        # the capture mode has the frame rate and resolution, so a discovered webcam doesn't have to be opened
+        if webcam_mode is not None and webcam_mode['fps']:
+            webcam_properties = (int(webcam_mode['fps']), webcam_mode['width'], webcam_mode['height'])
+
+        else:
+            # try opening the webcam
+            cap = cv2.VideoCapture(st.session_state['cam_index'])
+
+            if cap.isOpened():
+                # Set the w and h to the highest possible value to use the highest resolution
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, 10000)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 10000)
 
-        # if the cap is not opened, display an error message
-        if not cap.isOpened():
+                webcam_properties = (int(cap.get(cv2.CAP_PROP_FPS)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+            # release the webcam
+            cap.release()
+
+        # if the webcam can't be used, display an error message
+        if webcam_properties is None:
             st.error('That webcam index is not available. Please select another index.')
 
-        elif cap.isOpened():
+        else:
             st.success('Webcam connected successfully')
 
-            # Set the w and h to the highest possible value to use the highest resolution
-            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 10000)
-            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 10000)
-
-            # get the frame rate
-            frame_rate = int(cap.get(cv2.CAP_PROP_FPS))
+            # get the frame rate and resolution
+            frame_rate, width, height = webcam_properties
 
             # set the default fps to 10 if the frame rate is greater than 10
             default_skip = 10 if frame_rate > 10 else max(1, int(frame_rate) - 1)
 
-            # get the resolution from the width and height
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
             # classify the resolution
             resolution = classify_resolution(width, height)
 
@@ -176,9 +199,6 @@ if st.session_state['cam_or_vid'] == False:
             # set the session state for the frame rate
             st.session_state['frame_skip'] = frame_skip
 
-            # release the webcam
-            cap.release()
-
     else:
         st.error('Please select an index')
 
@@ -190,29 +210,25 @@ elif st.session_state['cam_or_vid'] == True:
 
         #_# GET VIDEO PROPERTIES #_#
 
-        # try opening the video file
-        # if the video file is not found, display an error message
-        cap = cv2.VideoCapture(st.session_state['file_path'])
+        # probe the video file (only opened once per upload, the properties are cached)
+        # if the video file can't be opened, display an error message
+        video_metadata = probe_video(st.session_state['file_path']) if os.path.exists(st.session_state['file_path']) else None
 
-        if not cap.isOpened():
+        if video_metadata is None:
             st.error('That video file is not available. Please select another file.')
 
-        elif cap.isOpened():
+        else:
             st.success('Video file connected successfully')
 
-            # Set the w and h to the highest possible value to use the highest resolution
-            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 10000)
-            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 10000)
-
             # get the frame rate
-            frame_rate = int(cap.get(cv2.CAP_PROP_FPS))
+            frame_rate = int(video_metadata['fps'])
 
             # set the default fps to 10 if the frame rate is greater than 10
             default_skip = 10 if frame_rate > 10 else max(1, int(frame_rate) - 1)
 
             # get the resolution from the width and height
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width = video_metadata['width']
+            height = video_metadata['height']
 
             # classify the resolution
             resolution = classify_resolution(width, height)
@@ -235,12 +251,138 @@ elif st.session_state['cam_or_vid'] == True:
             # set the session state for the frame rate
             st.session_state['frame_skip'] = frame_skip
 
-            # release the video file
-            cap.release()
+            # allow the video to be split into time shards that are processed on multiple cores
+            # 1 worker keeps the live frame-by-frame preview
+            st.write('#') # SPACER
+
+            shard_workers = st.slider('#### Parallel workers:', min_value = 1, max_value = max(1, os.cpu_count() or 1),
+                                      value = st.session_state.get('shard_workers', 1))
+            st.session_state['shard_workers'] = shard_workers
+
+            if shard_workers > 1:
+                st.caption('The video is processed in parallel without a live preview. Each worker loads its own copy of the models.')
 
     else:
         st.error('Please upload a video file')
 
+st.divider()
+
+#_# PERFORMANCE #_#
+st.write('### Performance:')
+
+# run vehicle detection, plate detection and OCR on separate threads so consecutive frames overlap
+pipelined = st.toggle('Pipelined execution', value = st.session_state.get('pipelined', False),
+                      help = 'Detects vehicles on the next frame while the plates of the current frame are read. Uses more cores and a little more memory.')
+st.session_state['pipelined'] = pipelined
+
+# only run the plate detector every n frames per vehicle and follow the vehicle box in between
+plate_interval = st.slider('#### Plate detection interval (frames):', min_value = 1, max_value = 10,
+                           value = st.session_state.get('plate_interval', 1),
+                           help = 'The plate box is predicted from the vehicle box between detections. A fresh detection is forced when the vehicle box changes shape or the predicted plate can not be read. 1 detects plates on every frame.')
+st.session_state['plate_interval'] = plate_interval
+
+# in dense traffic only read the plates of the vehicles that need it most and defer the others to the next frames
+st.session_state['plate_budget_ms'] = st.number_input('#### Plate reading budget per frame (ms):', min_value = 0, step = 25,
+                                                      value = st.session_state.get('plate_budget_ms', 0),
+                                                      help = 'Plate detection and OCR run first on the vehicles without a stable plate, the closest vehicles and the ones that waited longest. At least one vehicle is read per frame. 0 reads every vehicle on every frame.')
+
+# screen every frame with a small vehicle detector and only run the heavy one on the ambiguous regions
+vehicle_cascade = st.toggle('Vehicle detector cascade', value = st.session_state.get('vehicle_cascade', False),
+                            help = 'A small model detects the vehicles and the heavy model re-checks the uncertain detections. With a frame budget the detector steps down to lighter models when the frames take too long (e.g. when the device is throttling) and back up when there is headroom.')
+st.session_state['vehicle_cascade'] = vehicle_cascade
+
+if vehicle_cascade:
+    st.session_state['frame_budget_ms'] = st.number_input('#### Frame budget (ms):', min_value = 0, step = 50,
+                                                          value = st.session_state.get('frame_budget_ms', 0),
+                                                          help = 'The processing time per frame the detector cascade aims for. 0 keeps the cascade on the same models.')
+
+# the SORT tracker can follow the vehicles between detections so the vehicle detector doesn't have to run on every frame
+vehicle_trackers = {'bytetrack': 'ByteTrack (detects every frame)', 'sort': 'SORT (can skip detections)'}
+vehicle_tracker = st.selectbox('#### Vehicle tracker:', options = list(vehicle_trackers.keys()), format_func = lambda tracker: vehicle_trackers[tracker],
+                               index = list(vehicle_trackers.keys()).index(st.session_state.get('vehicle_tracker', 'bytetrack')),
+                               help = 'SORT is a lightweight kalman filter tracker that predicts where every vehicle moves on the frames without a detection.')
+st.session_state['vehicle_tracker'] = vehicle_tracker
+
+if vehicle_tracker == 'sort':
+    detect_interval = st.slider('#### Vehicle detection interval (frames):', min_value = 1, max_value = 10,
+                                value = st.session_state.get('detect_interval', 1),
+                                help = 'The vehicle detector runs on every n-th processed frame. The vehicle boxes, crops and plate lookups continue on the frames in between from the tracker predictions.')
+    st.session_state['detect_interval'] = detect_interval
+
+# the slim engine skips the text detector and always runs the INT8 recognizer on the cpu (see utils/ocr.py)
+ocr_engines = {'full': 'Full (text detector + recognizer)', 'slim': 'Slim (recognizer only, cpu)'}
+ocr_engine = st.selectbox('#### OCR engine:', options = list(ocr_engines.keys()), format_func = lambda engine: ocr_engines[engine],
+                          index = list(ocr_engines.keys()).index(st.session_state.get('ocr_engine', 'full')),
+                          help = 'The slim engine skips the text detector, which saves memory and cpu time. On the cpu both engines use the same INT8 recognizer. Run tools/ocr_benchmark.py to compare them on your own plates.')
+st.session_state['ocr_engine'] = ocr_engine
+
+# record the detections so the voting thresholds can be tuned later without running the models again
+record_detections = st.toggle('Record detections', value = st.session_state.get('record_detections', False),
+                              help = 'Writes every frame\'s vehicle boxes, plate boxes and OCR reads to logs/recordings/. Replay them with tools/replay.py.')
+st.session_state['record_detections'] = record_detections
+
+st.divider()
+
+#_# STORAGE RETENTION #_#
+st.write('### Storage retention:')
+st.caption('Media of the oldest and lowest risk sightings is removed first. The sightings themselves are kept. Set a value to 0 to disable it.')
+
+st.session_state['retention_budget_mb'] = st.number_input('#### Media disk budget (MB):', min_value = 0, step = 256,
+                                                          value = st.session_state['retention_budget_mb'])
+st.session_state['retention_max_age_days'] = st.number_input('#### Remove media older than (days):', min_value = 0,
+                                                             value = st.session_state['retention_max_age_days'])
+st.session_state['retention_transcode_days'] = st.number_input('#### Shrink videos older than (days):', min_value = 0,
+                                                               value = st.session_state['retention_transcode_days'])
+
+st.divider()
+
+#_# COLUMNAR EXPORT #_#
+st.write('### Columnar export:')
+st.caption('Every finished track is also written to Parquet files under logs/export/ (sightings, OCR reads and box trajectories, partitioned by date). Run python -m tools.export to add the older sightings and merge the files.')
+
+columnar_export = st.toggle('Export tracks to Parquet', value = st.session_state.get('columnar_export', False))
+st.session_state['columnar_export'] = columnar_export
+
+# the device name keeps the files of several vehicles apart when they are merged
+st.session_state['export_device'] = st.text_input('#### Device name:', value = st.session_state.get('export_device', default_device()),
+                                                  disabled = not columnar_export)
+
+st.divider()
+
+#_# MEMORY #_#
+st.write('### Memory:')
+
+# shed caches and preview frames when the app goes over the ceiling (checked every 30 seconds)
+st.session_state['memory_ceiling_mb'] = st.number_input('#### Memory ceiling (MB):', min_value = 0, step = 256,
+                                                        value = st.session_state.get('memory_ceiling_mb', 0),
+                                                        help = 'When the app uses more memory than this the removed tracker tracks, plate predictions, scheduler state and export buffers are dropped and the preview frame is scaled down. The preview is restored once the memory is under 80% of the ceiling. 0 disables the ceiling.')
+
+# take tracemalloc snapshots to find the code that keeps allocating memory
+memory_diagnostics = st.toggle('Memory diagnostics', value = st.session_state.get('memory_diagnostics', False),
+                               help = 'Shows the memory use per subsystem and the lines that allocated the most while processing. A report is written to logs/diagnostics/. Makes processing slower.')
+st.session_state['memory_diagnostics'] = memory_diagnostics
+
+st.divider()
+
+#_# WATCHLIST #_#
+st.write('### Watchlist:')
+st.caption('One plate per line, optionally followed by a comma and a note. A read that is one OCR confusion off (e.g. 8/B) also matches. Changes are picked up by the running ALPR within a few seconds.')
+
+# show the current watchlist as editable text
+watchlist_entries = read_watchlist()
+watchlist_text = st.text_area('#### Watched plates:', height = 200, placeholder = 'ABC1234, white van',
+                              value = "\n".join(plate + (", " + note if note else "") for plate, note in watchlist_entries.items()))
+
+if st.button('Save watchlist'):
+    entries = {}
+    for line in watchlist_text.splitlines():
+        plate, _, note = line.partition(",")
+        plate = normalize_plate(plate)
+        if plate:
+            entries[plate] = note.strip()
+
+    write_watchlist(entries)
+    st.success('Watchlist saved (' + str(len(entries)) + ' plates)')
 
 # write the session state variables to the sidebar (navbar) for development
 st.sidebar.write('### Session state variables') # FOR DEVELOPMENT ONLY
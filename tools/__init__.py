@@ -0,0 +1 @@
+# command line tools, run from the repository root (e.g. python -m tools.ocr_benchmark)
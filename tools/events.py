@@ -0,0 +1,40 @@
+import time
+import argparse
+from utils.event_bus import subscribe, SOCKET_PATH
+
+# print the live detection events published by Pursuit_Alert.py (see utils/event_bus.py)
+#
+# usage (from the repository root, while the ALPR is running):
+#   python -m tools.events
+#   python -m tools.events --types sighting --min-count 2   (only plates that were seen before)
+
+def format_event(event):
+
+    clock = time.strftime("%H:%M:%S", time.localtime(event["ts"]))
+    fields = " ".join(key + "=" + str(value) for key, value in event.items() if key not in ("type", "ts"))
+    return clock + " " + event["type"].ljust(12) + fields
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Subscribe to the live detection events")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--types", nargs="+", help="only print these event types (track_start, plate_vote, watchlist_match, sighting, following)")
+    parser.add_argument("--min-count", type=int, default=0, help="only print sightings of plates seen at least this many times")
+    args = parser.parse_args()
+
+    try:
+        for event in subscribe(args.socket):
+            if args.types and event["type"] not in args.types and event["type"] != "dropped":
+                continue
+            if event["type"] == "sighting" and event.get("count", 0) < args.min_count:
+                continue
+
+            print(format_event(event), flush=True)
+
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("No event stream at " + args.socket + " (start the ALPR first)")
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+import argparse
+from utils.columnar_export import export_all, load_export, default_device, EXPORT_DIR
+from utils.sighting_history import current_all_plates, ALL_PLATES_PATH
+
+# export the sighting history to partitioned parquet files and merge the per track files of the incremental export
+#
+# usage (from the repository root):
+#   python -m tools.export
+#   python -m tools.export --device van-2 --out /mnt/fleet/export   (merge several vehicles into one folder)
+#
+# read the export with pyarrow, pandas, duckdb, ... e.g.
+#   from utils.columnar_export import load_export
+#   load_export("sightings").to_table().group_by("plate").aggregate([("log_id", "count")])
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Export the sightings, OCR reads and box trajectories to Parquet")
+    parser.add_argument("--all-plates", default=ALL_PLATES_PATH, help="the sightings journaled next to it are included")
+    parser.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--device", default=default_device(), help="name of this vehicle in the export (default: the hostname)")
+    args = parser.parse_args()
+
+    all_plates = current_all_plates(args.all_plates)
+    if not all_plates:
+        print("No sightings at " + args.all_plates)
+        return
+
+    rows = export_all(all_plates, args.device, args.out)
+
+    for name, count in rows.items():
+        print(name.ljust(14) + str(count).rjust(10) + " rows")
+
+    if os.path.exists(os.path.join(args.out, "sightings")):
+        print("devices in " + args.out + ": " + ", ".join(sorted(set(load_export("sightings", args.out).to_table(columns=["device"])["device"].to_pylist()))))
+
+if __name__ == "__main__":
+    main()
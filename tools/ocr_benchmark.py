@@ -0,0 +1,138 @@
+import os
+import csv
+import time
+import argparse
+import cv2
+import psutil
+import torch
+import easyocr
+from utils.ocr import OCR_ENGINES, QUANTIZED_RECOGNIZER_PATH, load_ocr_engine, quantize_recognizer, is_quantized, read_plate
+from utils.perm_log import MIN_PLATE_CHARS, MIN_PLATE_CONFIDENCE
+
+# compare the OCR engines on a local set of labelled plate crops
+#
+# the plate set is a directory of plate images with either:
+#   - a labels.csv file with "file,plate" rows
+#   - or the plate as the file name (e.g. ABC1234.jpg or ABC1234_2.jpg)
+#
+# usage (from the repository root):
+#   python -m tools.ocr_benchmark --plates test_files/plates
+#   python -m tools.ocr_benchmark --export   (writes the pre-quantized recognizer to models/)
+
+def load_plate_set(directory):
+
+    labels_path = os.path.join(directory, "labels.csv")
+
+    if os.path.exists(labels_path):
+        with open(labels_path, "r") as file:
+            return [(os.path.join(directory, row["file"]), row["plate"].upper()) for row in csv.DictReader(file)]
+
+    plates = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            plates.append((os.path.join(directory, name), os.path.splitext(name)[0].split("_")[0].upper()))
+
+    return plates
+
+def char_accuracy(read, label):
+
+    # share of label positions read correctly
+    matches = sum(1 for a, b in zip(read, label) if a == b)
+    return matches / max(len(read), len(label), 1)
+
+def benchmark_engine(engine, plates):
+
+    # measure the memory the engine adds to the process and its accuracy and latency on the plate set
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    start = time.perf_counter()
+    reader = load_ocr_engine(engine)
+    load_s = time.perf_counter() - start
+
+    rss_loaded = process.memory_info().rss
+
+    # what actually differs between the engines (the full engine is INT8 too on the cpu)
+    device = "gpu" if str(reader.device).startswith("cuda") else "cpu"
+    recognizer = "int8" if is_quantized(reader.recognizer) else "fp32"
+    if engine == "slim" and os.path.exists(QUANTIZED_RECOGNIZER_PATH):
+        recognizer += " (exported)"
+
+    exact = 0
+    logged = 0
+    char_total = 0
+    read_s = 0
+
+    for path, label in plates:
+        plate_crop = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY)
+
+        start = time.perf_counter()
+        character_results = read_plate(reader, plate_crop, engine)
+        read_s += time.perf_counter() - start
+
+        # use the most confident string like the voting would see it
+        read = max(character_results, key=lambda character: character[2])[1] if character_results else ""
+        confidence = int(max([character[2] for character in character_results] or [0]) * 100)
+
+        exact += read == label
+        char_total += char_accuracy(read, label)
+        logged += len(read) >= MIN_PLATE_CHARS and confidence >= MIN_PLATE_CONFIDENCE
+
+    num_plates = max(len(plates), 1)
+    return {
+        "engine": engine,
+        "setup": device + ", " + recognizer + (", CRAFT" if getattr(reader, "detector", None) is not None else ""),
+        "load_s": load_s,
+        "model_mb": (rss_loaded - rss_before) / (1024 ** 2),
+        "peak_rss_mb": process.memory_info().rss / (1024 ** 2),
+        "ms_per_plate": read_s / num_plates * 1000,
+        "exact": exact / num_plates,
+        "chars": char_total / num_plates,
+        "logged": logged / num_plates
+    }
+
+def export_quantized():
+
+    # quantize the fp32 recognizer once and save it so the slim engine can skip the fp32 load
+    # (easyocr would quantize it on the cpu while loading, so the fp32 weights are loaded without it)
+    reader = easyocr.Reader(['en'], gpu=False, model_storage_directory="models", download_enabled=False, detector=False, quantize=False)
+    recognizer = quantize_recognizer(reader.recognizer)
+    torch.save(recognizer, QUANTIZED_RECOGNIZER_PATH)
+
+    print("Saved " + QUANTIZED_RECOGNIZER_PATH + " (" + str(round(os.path.getsize(QUANTIZED_RECOGNIZER_PATH) / (1024 ** 2), 1)) + " MB)")
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the OCR engines on a labelled plate set")
+    parser.add_argument("--plates", help="directory of labelled plate crops")
+    parser.add_argument("--engines", nargs="+", default=OCR_ENGINES, choices=OCR_ENGINES)
+    parser.add_argument("--export", action="store_true", help="write the pre-quantized recognizer to " + QUANTIZED_RECOGNIZER_PATH)
+    args = parser.parse_args()
+
+    if args.export:
+        export_quantized()
+
+    if not args.plates:
+        return
+
+    plates = load_plate_set(args.plates)
+    print("Plates: " + str(len(plates)))
+
+    # the engines are measured one after the other in the same process, so the memory of the
+    # first one is still counted in the peak of the second (run them separately with --engines for exact numbers)
+    results = [benchmark_engine(engine, plates) for engine in args.engines]
+
+    print("\n{:<6} {:<28} {:>8} {:>9} {:>10} {:>8} {:>8} {:>8}".format("engine", "setup", "load s", "model MB", "ms/plate", "exact", "chars", "logged"))
+    for result in results:
+        print("{engine:<6} {setup:<28} {load_s:>8.1f} {model_mb:>9.0f} {ms_per_plate:>10.1f} {exact:>8.1%} {chars:>8.1%} {logged:>8.1%}".format(**result))
+
+    # accuracy delta of every engine against the first one
+    if len(results) > 1:
+        base = results[0]
+        for result in results[1:]:
+            print("\n" + result["engine"] + " vs " + base["engine"] + ": "
+                  + "exact {:+.1%}, chars {:+.1%}, ".format(result["exact"] - base["exact"], result["chars"] - base["chars"])
+                  + "{:+.0f} MB, {:+.1f} ms/plate".format(result["model_mb"] - base["model_mb"], result["ms_per_plate"] - base["ms_per_plate"]))
+
+if __name__ == "__main__":
+    main()
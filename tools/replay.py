@@ -0,0 +1,81 @@
+import os
+import time
+import argparse
+import itertools
+import cv2
+from utils.recording import load_recording, recording_frames
+from utils.sharding import collect_tracks
+from utils.perm_log import temporal_redundancy_voting, create_track_logs, MIN_PLATE_CHARS, MIN_PLATE_CONFIDENCE
+
+# re-run the plate logging decisions and voting from a detection recording (see "Record detections" in settings)
+# without running the models again
+#
+# usage (from the repository root):
+#   python -m tools.replay logs/recordings/20240420_120000.padr --min-chars 3 4 5 --min-confidence 30 50 70
+#   python -m tools.replay logs/recordings/20240420_120000.padr --write-logs   (create the perm logs from the source video)
+
+def replay(frames, min_chars, min_confidence):
+
+    # returns the tracks that would be logged and their voted plates
+    tracks = collect_tracks(frames, min_chars, min_confidence)
+    votes = {veh_id: temporal_redundancy_voting([entry["plate"] for entry in track["plates"]]) for veh_id, track in tracks.items()}
+
+    return tracks, votes
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Replay a detection recording with different voting thresholds")
+    parser.add_argument("recordings", nargs="+", help="detection recording(s) (.padr)")
+    parser.add_argument("--min-chars", nargs="+", type=int, default=[MIN_PLATE_CHARS])
+    parser.add_argument("--min-confidence", nargs="+", type=int, default=[MIN_PLATE_CONFIDENCE])
+    parser.add_argument("--write-logs", action="store_true", help="create perm logs (needs a single threshold combination)")
+    parser.add_argument("--video", help="source video for --write-logs (defaults to the path stored in the recording)")
+    parser.add_argument("--plates", action="store_true", help="print the voted plate of every track")
+    args = parser.parse_args()
+
+    combinations = list(itertools.product(args.min_chars, args.min_confidence))
+    if args.write_logs and (len(combinations) > 1 or len(args.recordings) > 1):
+        parser.error("--write-logs needs a single recording and a single --min-chars and --min-confidence value")
+
+    for path in args.recordings:
+        start = time.perf_counter()
+        header, records = load_recording(path)
+        frames = recording_frames(records)
+
+        print(path + ": " + str(len(frames)) + " frames, " + str(len(records)) + " records, loaded in "
+              + str(round(time.perf_counter() - start, 2)) + " s")
+
+        print("{:>9} {:>14} {:>7} {:>8} {:>15} {:>7}".format("min chars", "min confidence", "tracks", "plates", "reads per track", "s"))
+
+        for min_chars, min_confidence in combinations:
+            start = time.perf_counter()
+            tracks, votes = replay(frames, min_chars, min_confidence)
+            elapsed = time.perf_counter() - start
+
+            reads = sum(len(track["plates"]) for track in tracks.values())
+            print("{:>9} {:>14} {:>7} {:>8} {:>15.1f} {:>7.2f}".format(min_chars, min_confidence, len(tracks), len(set(votes.values())),
+                                                                     reads / max(len(tracks), 1), elapsed))
+
+            if args.plates:
+                for veh_id, plate in sorted(votes.items()):
+                    print("    Vehicle " + str(veh_id) + ": " + plate + " (" + str(len(tracks[veh_id]["plates"])) + ")")
+
+        if args.write_logs:
+            video = args.video or header["source"]
+            stream = cv2.VideoCapture(video)
+            if not stream.isOpened():
+                parser.error("can't open the source video " + video + " (use --video)")
+
+            # same write fps as calc_write_fps
+            write_fps = header["fps"] / header["frame_skip"] if header["frame_skip"] else header["fps"]
+
+            if not os.path.exists("logs/tmp"):
+                os.makedirs("logs/tmp")
+
+            create_track_logs(tracks, stream, write_fps)
+            stream.release()
+
+            print("Created " + str(len(tracks)) + " perm log(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import shutil
+import tempfile
+import subprocess
+import tracemalloc
+import psutil
+
+# scale/stress harness for the sighting history and the Analysis page
+#
+# for every scale it synthesizes a sighting history (plates, timestamps and placeholder media) in a scratch
+# directory and measures the insert latency of a new sighting, the Analysis page load time, the per plate page
+# time and the memory used, then writes a report that can be compared across releases
+#
+# usage (from the repository root):
+#   python -m tools.stress --scales 10000 100000 1000000 --report stress_report.json
+#   python -m tools.stress --scales 10000 --compare stress_report.json
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYSIS_PAGE = os.path.join(REPO_DIR, "pages", "Analysis.py")
+
+sys.path.insert(0, REPO_DIR)
+
+from utils.perm_log import record_sighting
+from utils.sighting_history import sighting_history
+from utils.plate_index import load_plate_index, save_plate_index
+from utils.plate_stats import rebuild_plate_stats, save_plate_stats
+from utils.following import rebuild_following, save_following
+from utils.segment_store import perm_store, close_stores
+
+# number of new sightings timed at every scale
+NUM_INSERTS = 20
+
+# share of the sightings that are of a new plate (most plates are only seen once)
+UNIQUE_PLATE_RATIO = 0.3
+
+# common plate layouts (L = letter, D = digit)
+PLATE_FORMATS = ["LLLDDDD", "DLLLDDD", "LLDDLLL", "LLLDDD", "DDDLLL"]
+
+#_# HISTORY GENERATION #_#
+##########################
+
+def random_plate(rng):
+    plate_format = rng.choice(PLATE_FORMATS)
+    return "".join(rng.choice(string.ascii_uppercase) if c == "L" else rng.choice(string.digits) for c in plate_format)
+
+def generate_history(num_sightings, rng, days=90, media_kb=(4, 1, 1)):
+
+    # sightings happen during two trips a day, a few plates show up on a lot of trips (the ones that would be following)
+    num_plates = max(1, int(num_sightings * UNIQUE_PLATE_RATIO))
+    plates = list(set(random_plate(rng) for _ in range(num_plates)))
+    now = time.time()
+
+    trips = []
+    for day in range(days):
+        for trip_start_h in (8, 17):
+            start = now - (days - day) * 86400 + trip_start_h * 3600
+            trips.append((start, start + rng.uniform(0.5, 2) * 3600))
+
+    all_plates = {}
+    sightings = []
+    for _ in range(num_sightings):
+
+        # skewed plate choice: low indexes are picked far more often
+        plate = plates[int(len(plates) * rng.random() ** 3)]
+        trip_start, trip_end = rng.choice(trips)
+        sightings.append((rng.uniform(trip_start, trip_end), plate))
+
+    sightings.sort()
+
+    for index, (timestamp, plate) in enumerate(sightings):
+        log_id = "stress-" + str(index)
+        all_plates.setdefault(plate, []).append({
+            "date": time.strftime("%m/%d/%Y", time.localtime(timestamp)),
+            "time": time.strftime("%H:%M", time.localtime(timestamp)),
+            "veh_crop_path": f"/perm/{log_id}/cropped_vehicle.jpg",
+            "plate_crop_path": f"/perm/{log_id}/cropped_plate.jpg",
+            "video_path": f"/perm/{log_id}/video.mp4",
+            "log_id": log_id,
+            "read_plate": plate,
+            "timestamp": round(timestamp, 3)
+        })
+
+    os.makedirs("logs/perm", exist_ok=True)
+    with open("logs/perm/all_plates.json", "w") as file:
+        json.dump(all_plates, file, indent=4)
+
+    save_plate_stats(rebuild_plate_stats(all_plates))
+    save_plate_index(load_plate_index(all_plates))
+    save_following(rebuild_following(all_plates))
+
+    # placeholder media in the perm segment store (video, vehicle crop, plate crop)
+    if media_kb:
+        video, vehicle_crop, plate_crop = [os.urandom(kb * 1024) for kb in media_kb]
+        for plate, detections in all_plates.items():
+            for detection in detections:
+                perm_store().put(detection["video_path"], video)
+                perm_store().put(detection["veh_crop_path"], vehicle_crop)
+                perm_store().put(detection["plate_crop_path"], plate_crop)
+
+    return all_plates
+
+#^# HISTORY GENERATION #^#
+##########################
+
+#_# MEASUREMENTS #_#
+####################
+
+def measure(function):
+
+    # run a function and return its result, wall time (s), python peak allocation (MB) and the process RSS (MB) after it
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, elapsed, peak / (1024 ** 2), psutil.Process().memory_info().rss / (1024 ** 2)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def measure_inserts(all_plates, rng):
+
+    # half of the new sightings are of known plates and half are new plates
+    known = list(all_plates.keys())
+    latencies = []
+    peaks = []
+
+    # the history is loaded once per process (the inserts after it only append to the journal)
+    history = sighting_history()
+    _, load_s, _, _ = measure(history.load)
+
+    for i in range(NUM_INSERTS):
+        plate = rng.choice(known) if i % 2 == 0 else random_plate(rng)
+        _, elapsed, peak, rss = measure(lambda: record_sighting(plate, "stress-insert-" + str(i)))
+        latencies.append(elapsed * 1000)
+        peaks.append(peak)
+
+    return {
+        "history_load_s": load_s,
+        "insert_ms_mean": sum(latencies) / len(latencies),
+        "insert_ms_p95": percentile(latencies, 0.95),
+        "insert_peak_mb": max(peaks)
+    }
+
+def run_page(query_params=None):
+
+    # run the Analysis page script headless with streamlit's app testing framework
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(ANALYSIS_PAGE, default_timeout=600)
+    for key, value in (query_params or {}).items():
+        app.query_params[key] = value
+
+    app.run()
+
+    if app.exception:
+        raise RuntimeError("Analysis page failed: " + str(app.exception[0].value))
+
+    return app
+
+def measure_pages(all_plates):
+
+    # time the dashboard and the page of the most sighted plate (the largest one)
+    _, dashboard_s, dashboard_peak, _ = measure(run_page)
+
+    top_plate = max(all_plates, key=lambda plate: len(all_plates[plate]))
+    _, plate_s, plate_peak, rss = measure(lambda: run_page({"plate": top_plate}))
+
+    return {
+        "dashboard_s": dashboard_s,
+        "dashboard_peak_mb": dashboard_peak,
+        "plate_page_s": plate_s,
+        "plate_page_sightings": len(all_plates[top_plate]),
+        "plate_page_peak_mb": plate_peak,
+        "rss_mb": rss
+    }
+
+def disk_usage_mb():
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk("logs") for name in names) / (1024 ** 2)
+
+def run_scale(num_sightings, seed, media_kb, keep=False):
+
+    # generate the history in a fresh scratch directory (all paths of the app are relative to the working directory)
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="pursuit-alert-stress-")
+    os.chdir(workdir)
+
+    # the stores of the previous scale still point at its (relative) directory
+    # (the sighting history notices the new files by itself, see utils/sighting_history.py)
+    close_stores()
+
+    print("\n" + str(num_sightings) + " sightings in " + workdir)
+
+    start = time.perf_counter()
+    all_plates = generate_history(num_sightings, rng, media_kb=media_kb)
+    print("  generated " + str(len(all_plates)) + " plates in " + str(round(time.perf_counter() - start, 1)) + " s")
+
+    result = {"sightings": num_sightings, "plates": len(all_plates)}
+    result.update(measure_inserts(all_plates, rng))
+    print("  insert: {insert_ms_mean:.1f} ms mean, {insert_ms_p95:.1f} ms p95 (history loaded in {history_load_s:.2f} s)".format(**result))
+
+    result.update(measure_pages(all_plates))
+    print("  dashboard: {dashboard_s:.2f} s, plate page: {plate_page_s:.2f} s ({plate_page_sightings} sightings)".format(**result))
+
+    result["disk_mb"] = disk_usage_mb()
+
+    # remove the scratch directory so the larger scales don't run out of disk
+    close_stores()
+    os.chdir(REPO_DIR)
+    if not keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return result
+
+#^# MEASUREMENTS #^#
+####################
+
+#_# REPORT #_#
+##############
+
+REPORT_COLUMNS = [
+    ("sightings", "{:>9}"), ("plates", "{:>8}"), ("history_load_s", "{:>10.2f}"),
+    ("insert_ms_mean", "{:>10.1f}"), ("insert_ms_p95", "{:>9.1f}"), ("insert_peak_mb", "{:>10.1f}"),
+    ("dashboard_s", "{:>11.2f}"), ("dashboard_peak_mb", "{:>12.1f}"),
+    ("plate_page_s", "{:>11.2f}"), ("plate_page_peak_mb", "{:>12.1f}"),
+    ("rss_mb", "{:>7.0f}"), ("disk_mb", "{:>8.0f}")
+]
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def format_table(results):
+
+    lines = ["| " + " | ".join(name for name, fmt in REPORT_COLUMNS) + " |",
+             "|" + "---|" * len(REPORT_COLUMNS)]
+    for result in results:
+        lines.append("| " + " | ".join(fmt.format(result[name]).strip() for name, fmt in REPORT_COLUMNS) + " |")
+
+    return "\n".join(lines)
+
+def format_comparison(results, previous):
+
+    # ratio of every timing and memory column against the previous report at the same scale
+    old = {result["sightings"]: result for result in previous["results"]}
+    lines = ["\nCompared to " + previous["revision"] + " (new / old):"]
+
+    for result in results:
+        if result["sightings"] not in old:
+            continue
+
+        ratios = []
+        for name, fmt in REPORT_COLUMNS[2:]:
+            if old[result["sightings"]].get(name):
+                ratios.append(name + " x" + format(result[name] / old[result["sightings"]][name], ".2f"))
+        lines.append("  " + str(result["sightings"]) + ": " + ", ".join(ratios))
+
+    return "\n".join(lines)
+
+#^# REPORT #^#
+##############
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Measure the sighting history and the Analysis page at scale")
+    parser.add_argument("--scales", nargs="+", type=int, default=[10000, 100000, 1000000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--media-kb", nargs=3, type=int, default=[4, 1, 1], metavar=("VIDEO", "VEHICLE", "PLATE"),
+                        help="size of the placeholder video, vehicle crop and plate crop of every sighting")
+    parser.add_argument("--no-media", action="store_true", help="don't write placeholder media")
+    parser.add_argument("--keep", action="store_true", help="keep the generated histories")
+    parser.add_argument("--report", default="stress_report.json", help="where to write the json report (a .md table is written next to it)")
+    parser.add_argument("--compare", help="previous json report to compare with")
+    args = parser.parse_args()
+
+    report_path = os.path.abspath(args.report)
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as file:
+            previous = json.load(file)
+
+    media_kb = None if args.no_media else args.media_kb
+    results = [run_scale(num_sightings, args.seed, media_kb, args.keep) for num_sightings in args.scales]
+
+    report = {
+        "revision": git_revision(),
+        "date": time.strftime("%Y-%m-%d %H:%M"),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "results": results
+    }
+
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=4)
+
+    table = format_table(results)
+    with open(os.path.splitext(report_path)[0] + ".md", "w") as file:
+        file.write("# Stress report " + report["revision"] + " (" + report["date"] + ")\n\n" + table + "\n")
+
+    print("\n" + table)
+    if previous is not None:
+        print(format_comparison(results, previous))
+
+    print("\nReport written to " + report_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# shared helpers for Pursuit_Alert.py and the pages/ scripts
+# (kept outside of pages/ so streamlit does not list them as pages)
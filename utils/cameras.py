@@ -0,0 +1,250 @@
+import os
+import fcntl
+import ctypes
+import threading
+import cv2
+
+# camera discovery from sysfs and the V4L2 api (linux)
+# the devices and their capture modes are enumerated once and cached until a camera is plugged in or out,
+# so the settings page doesn't shell out to lsusb or open the camera on every rerun
+# querying the modes only opens the device node for a few ioctls, it doesn't start a capture (safe while the ALPR runs)
+
+SYSFS_ROOT = "/sys/class/video4linux"
+DEV_ROOT = "/dev"
+
+#_# V4L2 #_#
+############
+
+# ioctl numbers and structs from linux/videodev2.h
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+
+class v4l2_capability(ctypes.Structure):
+    _fields_ = [("driver", ctypes.c_char * 16), ("card", ctypes.c_char * 32), ("bus_info", ctypes.c_char * 32),
+                ("version", ctypes.c_uint32), ("capabilities", ctypes.c_uint32), ("device_caps", ctypes.c_uint32),
+                ("reserved", ctypes.c_uint32 * 3)]
+
+class v4l2_fmtdesc(ctypes.Structure):
+    _fields_ = [("index", ctypes.c_uint32), ("type", ctypes.c_uint32), ("flags", ctypes.c_uint32),
+                ("description", ctypes.c_char * 32), ("pixelformat", ctypes.c_uint32), ("mbus_code", ctypes.c_uint32),
+                ("reserved", ctypes.c_uint32 * 3)]
+
+class v4l2_frmsizeenum(ctypes.Structure):
+    # the union is read as its largest member (stepwise), the discrete size is its first two fields
+    _fields_ = [("index", ctypes.c_uint32), ("pixel_format", ctypes.c_uint32), ("type", ctypes.c_uint32),
+                ("size", ctypes.c_uint32 * 6), ("reserved", ctypes.c_uint32 * 2)]
+
+class v4l2_frmivalenum(ctypes.Structure):
+    # the discrete interval is the first fraction of the union (numerator, denominator)
+    _fields_ = [("index", ctypes.c_uint32), ("pixel_format", ctypes.c_uint32), ("width", ctypes.c_uint32),
+                ("height", ctypes.c_uint32), ("type", ctypes.c_uint32), ("interval", ctypes.c_uint32 * 6),
+                ("reserved", ctypes.c_uint32 * 2)]
+
+def _iowr(nr, struct, read_only=False):
+    return ((2 if read_only else 3) << 30) | (ctypes.sizeof(struct) << 16) | (ord("V") << 8) | nr
+
+VIDIOC_QUERYCAP = _iowr(0, v4l2_capability, read_only=True)
+VIDIOC_ENUM_FMT = _iowr(2, v4l2_fmtdesc)
+VIDIOC_ENUM_FRAMESIZES = _iowr(74, v4l2_frmsizeenum)
+VIDIOC_ENUM_FRAMEINTERVALS = _iowr(75, v4l2_frmivalenum)
+
+def fourcc_string(code):
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip()
+
+def _enumerate(fd, request, struct):
+
+    # call an enumeration ioctl with index 0, 1, ... until the driver runs out of entries (EINVAL)
+    index = 0
+    while True:
+        struct.index = index
+        try:
+            fcntl.ioctl(fd, request, struct)
+        except OSError:
+            return
+        yield struct
+        index += 1
+
+def query_modes(device_path):
+
+    # every (format, width, height, fps) the camera can capture, or None if the device can't be queried
+    try:
+        fd = os.open(device_path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+
+    try:
+        capability = v4l2_capability()
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, capability)
+
+        # uvc cameras also expose a metadata node that can't capture video
+        caps = capability.device_caps if capability.capabilities & V4L2_CAP_DEVICE_CAPS else capability.capabilities
+        if not caps & V4L2_CAP_VIDEO_CAPTURE:
+            return None
+
+        modes = []
+        formats = [(fmt.pixelformat, fmt.description.decode(errors="replace")) for fmt in _enumerate(fd, VIDIOC_ENUM_FMT, v4l2_fmtdesc(type=V4L2_BUF_TYPE_VIDEO_CAPTURE))]
+
+        for pixelformat, description in formats:
+            sizes = [(size.size[0], size.size[1]) for size in _enumerate(fd, VIDIOC_ENUM_FRAMESIZES, v4l2_frmsizeenum(pixel_format=pixelformat))
+                     if size.type == V4L2_FRMSIZE_TYPE_DISCRETE]
+
+            # stepwise sizes (rare on usb cameras) are listed by their largest size
+            if not sizes:
+                size = v4l2_frmsizeenum(pixel_format=pixelformat)
+                try:
+                    fcntl.ioctl(fd, VIDIOC_ENUM_FRAMESIZES, size)
+                    sizes = [(size.size[1], size.size[4])]
+                except OSError:
+                    pass
+
+            for width, height in sizes:
+                rates = set()
+                for interval in _enumerate(fd, VIDIOC_ENUM_FRAMEINTERVALS, v4l2_frmivalenum(pixel_format=pixelformat, width=width, height=height)):
+                    numerator, denominator = interval.interval[0], interval.interval[1]
+                    if numerator:
+                        rates.add(round(denominator / numerator, 2))
+
+                for fps in sorted(rates, reverse=True) or [0]:
+                    modes.append({"format": fourcc_string(pixelformat), "description": description, "width": width, "height": height, "fps": fps})
+
+        return {"card": capability.card.decode(errors="replace"), "bus": capability.bus_info.decode(errors="replace"), "modes": modes}
+
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+#^# V4L2 #^#
+############
+
+#_# DISCOVERY #_#
+#################
+
+def _read(path):
+    try:
+        with open(path, "r") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def _signature(sysfs_root, dev_root):
+
+    # changes when a camera is plugged in or out (udev creates a new device node every time)
+    if not os.path.isdir(sysfs_root):
+        return ()
+
+    signature = []
+    for node in sorted(os.listdir(sysfs_root)):
+        try:
+            stat = os.stat(os.path.join(dev_root, node))
+            signature.append((node, stat.st_rdev, stat.st_ctime_ns))
+        except OSError:
+            signature.append((node, None, None))
+
+    return tuple(signature)
+
+def _usb_info(sysfs_node):
+
+    # the usb device is the parent of the video interface in sysfs
+    device = os.path.realpath(os.path.join(sysfs_node, "device"))
+    for path in (device, os.path.dirname(device)):
+        vendor = _read(os.path.join(path, "idVendor"))
+        if vendor:
+            return {"id": vendor + ":" + (_read(os.path.join(path, "idProduct")) or ""),
+                    "serial": _read(os.path.join(path, "serial")) or ""}
+    return {"id": "", "serial": ""}
+
+def _discover(sysfs_root, dev_root):
+
+    cameras = []
+    if not os.path.isdir(sysfs_root):
+        return cameras
+
+    for node in sorted(os.listdir(sysfs_root), key=lambda node: int("".join(c for c in node if c.isdigit()) or 0)):
+        if not node.startswith("video"):
+            continue
+
+        sysfs_node = os.path.join(sysfs_root, node)
+
+        # the secondary nodes of a device (index > 0) are metadata nodes on uvc cameras
+        if (_read(os.path.join(sysfs_node, "index")) or "0") != "0":
+            continue
+
+        device_path = os.path.join(dev_root, node)
+        info = query_modes(device_path)
+        if info is None:
+            continue
+
+        cameras.append({
+            "index": int(node[len("video"):]), # the index cv2.VideoCapture() opens
+            "device": device_path,
+            "name": _read(os.path.join(sysfs_node, "name")) or info["card"],
+            "bus": info["bus"],
+            **_usb_info(sysfs_node),
+            "modes": info["modes"]
+        })
+
+    return cameras
+
+# the cameras of the last discovery and the device nodes they were found on (one cache per process)
+_cache = {"signature": None, "cameras": []}
+_cache_lock = threading.Lock()
+
+def list_cameras(sysfs_root=SYSFS_ROOT, dev_root=DEV_ROOT):
+
+    # the capture cameras and their modes, only enumerated again after a hotplug
+    signature = _signature(sysfs_root, dev_root)
+
+    with _cache_lock:
+        if signature != _cache["signature"]:
+            _cache["cameras"] = _discover(sysfs_root, dev_root)
+            _cache["signature"] = signature
+
+        return _cache["cameras"]
+
+#^# DISCOVERY #^#
+#################
+
+#_# CAPTURE MODES #_#
+#####################
+
+# compressed formats need much less usb bandwidth, so they reach higher frame rates at high resolutions
+COMPRESSED_FORMATS = ["MJPG", "H264"]
+
+def best_mode(modes):
+
+    # the highest resolution, then the highest frame rate, then a compressed format
+    if not modes:
+        return None
+    return max(modes, key=lambda mode: (mode["width"] * mode["height"], mode["fps"], mode["format"] in COMPRESSED_FORMATS))
+
+def mode_label(mode):
+    return mode["format"] + " " + str(mode["width"]) + "x" + str(mode["height"]) + " @ " + str(round(mode["fps"], 2)).rstrip("0").rstrip(".") + " fps"
+
+def open_camera(index, mode=None):
+
+    # open the camera in the exact capture mode picked in settings (the driver's default if there is none)
+    if mode is None:
+        stream = cv2.VideoCapture(index)
+
+        # set the w and h to the highest possible value to use the highest resolution
+        stream.set(cv2.CAP_PROP_FRAME_WIDTH, 10000)
+        stream.set(cv2.CAP_PROP_FRAME_HEIGHT, 10000)
+        return stream
+
+    stream = cv2.VideoCapture(index, cv2.CAP_V4L2)
+
+    # the format has to be set before the size for the driver to accept the mode
+    stream.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode["format"].ljust(4)))
+    stream.set(cv2.CAP_PROP_FRAME_WIDTH, mode["width"])
+    stream.set(cv2.CAP_PROP_FRAME_HEIGHT, mode["height"])
+    if mode["fps"]:
+        stream.set(cv2.CAP_PROP_FPS, mode["fps"])
+
+    return stream
+
+#^# CAPTURE MODES #^#
+#####################
@@ -0,0 +1,248 @@
+import os
+import glob
+import time
+import socket
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from utils.plate_stats import sighting_timestamp
+
+# columnar export of the sightings, the ocr reads of every track and the box trajectories for bulk analytics
+#
+# every table is a directory of parquet files partitioned by the local date of the sighting (hive style):
+#   logs/export/sightings/date=2024-03-15/part-<device>.<log id>.parquet (part-<device>.parquet once compacted)
+# the files of several vehicles can be copied into one export folder and read as one dataset (see load_export())
+# the device column and the file names keep them apart
+
+EXPORT_DIR = "logs/export"
+
+# the schemas are fixed so files written months apart (or by other vehicles) can be scanned together
+# (the date column comes from the partition directory)
+SIGHTINGS_SCHEMA = pa.schema([
+    ("device", pa.string()),
+    ("log_id", pa.string()),
+    ("plate", pa.string()), # the plate the sighting was attached to
+    ("read_plate", pa.string()), # the voted plate before it was matched to a known plate
+    ("timestamp", pa.timestamp("ms", tz="UTC"))
+])
+
+READS_SCHEMA = pa.schema([
+    ("device", pa.string()),
+    ("log_id", pa.string()),
+    ("read_index", pa.int32()), # order of the read within the track
+    ("text", pa.string()),
+    ("confidence", pa.int16()) # %
+])
+
+TRAJECTORIES_SCHEMA = pa.schema([
+    ("device", pa.string()),
+    ("log_id", pa.string()),
+    ("frame", pa.int32()),
+    ("object", pa.dictionary(pa.int8(), pa.string())), # "vehicle" or "plate"
+    ("x1", pa.int32()), # frame coordinates (the plate boxes too)
+    ("y1", pa.int32()),
+    ("x2", pa.int32()),
+    ("y2", pa.int32())
+])
+
+TABLES = {"sightings": SIGHTINGS_SCHEMA, "reads": READS_SCHEMA, "trajectories": TRAJECTORIES_SCHEMA}
+
+def default_device():
+    return socket.gethostname()
+
+def export_config(session_state):
+
+    # build the export config from the values set on the settings page
+    return {
+        "enabled": session_state.get('columnar_export', False),
+        "device": session_state.get('export_device', "") or default_device()
+    }
+
+def partition_date(timestamp):
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+def file_device(device):
+    # the device name is part of the file names ("." separates it from the log id)
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in device)
+
+#_# TABLES #_#
+##############
+
+def sighting_table(device, sightings):
+
+    # sightings is a list of (log id, plate, read plate, timestamp)
+    return pa.Table.from_pydict({
+        "device": [device] * len(sightings),
+        "log_id": [sighting[0] for sighting in sightings],
+        "plate": [sighting[1] for sighting in sightings],
+        "read_plate": [sighting[2] for sighting in sightings],
+        "timestamp": [int(sighting[3] * 1000) for sighting in sightings]
+    }, schema=SIGHTINGS_SCHEMA)
+
+def reads_table(device, log_id, reads):
+
+    # reads are the entries of the plates.json of the track
+    return pa.Table.from_pydict({
+        "device": [device] * len(reads),
+        "log_id": [log_id] * len(reads),
+        "read_index": list(range(len(reads))),
+        "text": [read["plate"] for read in reads],
+        "confidence": [int(float(read["confidence"])) for read in reads]
+    }, schema=READS_SCHEMA)
+
+def trajectories_table(device, log_id, vehicle_track, plate_track):
+
+    # the tracks are the vehicle_track.json and plate_track.json of the track ({frame: {"x1": ..., ...}})
+    # plate boxes are stored relative to the vehicle crop, they are moved to frame coordinates like in create_perm_log()
+    rows = []
+    for frame, box in vehicle_track.items():
+        rows.append((int(frame), "vehicle", *(int(float(box[key])) for key in ("x1", "y1", "x2", "y2"))))
+
+    for frame, box in plate_track.items():
+        vehicle_box = vehicle_track.get(frame)
+        if not vehicle_box:
+            continue
+
+        vx1, vy1 = int(float(vehicle_box["x1"])), int(float(vehicle_box["y1"]))
+        px1, py1, px2, py2 = (int(float(box[key])) for key in ("x1", "y1", "x2", "y2"))
+        rows.append((int(frame), "plate", px1 + vx1, py1 + vy1, px2 + vx1, py2 + vy1))
+
+    rows.sort()
+    columns = list(zip(*rows)) if rows else [[]] * 6
+
+    return pa.Table.from_pydict({
+        "device": [device] * len(rows),
+        "log_id": [log_id] * len(rows),
+        "frame": list(columns[0]),
+        "object": list(columns[1]),
+        "x1": list(columns[2]),
+        "y1": list(columns[3]),
+        "x2": list(columns[4]),
+        "y2": list(columns[5])
+    }, schema=TRAJECTORIES_SCHEMA)
+
+#^# TABLES #^#
+##############
+
+#_# WRITING #_#
+###############
+
+def partition_path(name, date, export_dir=EXPORT_DIR):
+    return os.path.join(export_dir, name, "date=" + date)
+
+def write_part(table, name, date, part, export_dir=EXPORT_DIR):
+
+    # write the table as one file of the date partition (renamed into place so a reader never sees half a file)
+    directory = partition_path(name, date, export_dir)
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, "part-" + part + ".parquet")
+    tmp_path = os.path.join(directory, ".part-" + part + ".tmp") # dataset readers skip dot files
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+    return path
+
+def export_track(log_id, plate, read_plate, timestamp, reads, vehicle_track, plate_track, device=None, export_dir=EXPORT_DIR):
+
+    # incremental export of a finished track (called by create_perm_log() before the tmp folder is deleted)
+    device = device or default_device()
+    date = partition_date(timestamp)
+    part = file_device(device) + "." + log_id
+
+    write_part(sighting_table(device, [(log_id, plate, read_plate, timestamp)]), "sightings", date, part, export_dir)
+    write_part(reads_table(device, log_id, reads), "reads", date, part, export_dir)
+    write_part(trajectories_table(device, log_id, vehicle_track, plate_track), "trajectories", date, part, export_dir)
+
+def compact_partitions(name, device=None, export_dir=EXPORT_DIR):
+
+    # merge the per track files of the device into one file per date partition (fewer and larger files scan faster)
+    # returns the number of files that were merged
+    device = file_device(device or default_device())
+    merged = 0
+
+    for directory in sorted(glob.glob(os.path.join(export_dir, name, "date=*"))):
+        compacted = os.path.join(directory, "part-" + device + ".parquet")
+        parts = sorted(glob.glob(os.path.join(directory, "part-" + device + ".*.parquet")))
+        if not parts:
+            continue
+
+        # the compacted file of an earlier run is merged again with the new parts
+        files = ([compacted] if os.path.exists(compacted) else []) + parts
+        table = pa.concat_tables([pq.read_table(path, schema=TABLES[name]) for path in files])
+
+        write_part(table, name, directory.rsplit("date=", 1)[1], device, export_dir)
+        for path in parts:
+            os.remove(path)
+
+        merged += len(parts)
+
+    return merged
+
+def export_all(all_plates, device=None, export_dir=EXPORT_DIR):
+
+    # full export: the sightings are rewritten from all_plates.json (so sightings from before the export was enabled are included)
+    # the reads and trajectories only exist for the tracks that were exported incrementally, those are compacted
+    # returns the number of rows per table
+    device = device or default_device()
+    prefix = file_device(device)
+
+    by_date = {}
+    for plate, detections in all_plates.items():
+        for detection in detections:
+            timestamp = sighting_timestamp(detection)
+            by_date.setdefault(partition_date(timestamp), []).append((detection["log_id"], plate, detection.get("read_plate", plate), timestamp))
+
+    # replace every sightings file of this device (files of other vehicles in the same folder are kept)
+    for path in glob.glob(os.path.join(export_dir, "sightings", "date=*", "part-" + prefix + ".parquet")) + \
+                glob.glob(os.path.join(export_dir, "sightings", "date=*", "part-" + prefix + ".*.parquet")):
+        os.remove(path)
+
+    for date, sightings in by_date.items():
+        sightings.sort(key=lambda sighting: sighting[3])
+        write_part(sighting_table(device, sightings), "sightings", date, prefix, export_dir)
+
+    compact_partitions("reads", device, export_dir)
+    compact_partitions("trajectories", device, export_dir)
+
+    rows = {"sightings": sum(len(sightings) for sightings in by_date.values())}
+    for name in ("reads", "trajectories"):
+        rows[name] = load_export(name, export_dir).count_rows() if os.path.exists(os.path.join(export_dir, name)) else 0
+
+    return rows
+
+#^# WRITING #^#
+###############
+
+def load_export(name, export_dir=EXPORT_DIR):
+
+    # the table as a pyarrow dataset (all dates and devices), e.g.
+    #   load_export("sightings").to_table(filter=ds.field("plate") == "ABC123").to_pandas()
+    return ds.dataset(os.path.join(export_dir, name), schema=TABLES[name].append(pa.field("date", pa.string())),
+                      format="parquet", partitioning="hive", exclude_invalid_files=True)
+
+# the incremental export is configured once per process (the perm logs are created by the streamlit script, the shards and the replay tool)
+_config = {"enabled": False, "device": None}
+_config_lock = threading.Lock()
+
+def configure_export(config):
+    with _config_lock:
+        _config.update(config)
+
+def export_finished_track(log_id, plate, read_plate, timestamp, reads, vehicle_track, plate_track):
+
+    # does nothing if the export wasn't enabled on the settings page
+    if not _config["enabled"]:
+        return
+
+    try:
+        export_track(log_id, plate, read_plate, timestamp, reads, vehicle_track, plate_track, _config["device"])
+    except OSError as e:
+        # the perm log is already written, a failed export can be redone with tools/export.py
+        print("Columnar export of " + log_id + " failed: " + str(e))
+
+def release_export_memory():
+
+    # return the buffers pyarrow keeps cached after writing the files to the os
+    pa.default_memory_pool().release_unused()
@@ -0,0 +1,59 @@
+import numpy as np
+
+# the detector outputs are copied to numpy once per frame instead of indexing the result tensors box by box
+# (every int() on a tensor element is a new tensor and a device sync), all later stages read the same arrays
+
+def to_numpy(data):
+
+    # a torch tensor (on any device), a numpy array or a list of boxes as a float array
+    if hasattr(data, "cpu"):
+        data = data.cpu().numpy()
+    return np.asarray(data, dtype=np.float32)
+
+def clip_boxes(boxes, shape):
+
+    # [x1, y1, x2, y2] pixel coordinates inside an image of this shape (truncated like int())
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    boxes = np.clip(boxes, 0, [shape[1], shape[0], shape[1], shape[0]])
+    return boxes.astype(np.int32)
+
+def vehicle_arrays(veh_results, shape):
+
+    # the tracked vehicles of a frame:
+    #   boxes (N, 4) int frame coordinates, ids (N,) int (0 = not tracked yet), scores (N,) and classes (N,)
+    # the tracker output has the id in column 4 ([x1, y1, x2, y2, id, confidence, class]), untracked boxes don't have it
+    data = to_numpy(veh_results[0].boxes.data)
+    data = data.reshape(-1, data.shape[1] if data.ndim == 2 and data.shape[1] else 6)
+    tracked = data.shape[1] == 7
+
+    return {
+        "boxes": clip_boxes(data[:, :4], shape),
+        "ids": data[:, 4].astype(np.int64) if tracked else np.zeros(len(data), dtype=np.int64),
+        "scores": data[:, -2],
+        "classes": data[:, -1].astype(np.int64)
+    }
+
+def tracked_vehicles(vehicles):
+
+    # (veh id, box) of every vehicle the tracker assigned an id to
+    tracked = vehicles["ids"] != 0
+    return list(zip(vehicles["ids"][tracked].tolist(), vehicles["boxes"][tracked]))
+
+def plate_arrays(plate_data, crop_shape):
+
+    # the plate detections of a vehicle crop: boxes (M, 4) int crop coordinates and scores (M,)
+    # predicted plate boxes (see utils/plate_tracker.py) don't have a score, they get 1
+    data = to_numpy(plate_data)
+    data = data.reshape(-1, data.shape[1] if data.ndim == 2 and data.shape[1] else 4)
+    scores = data[:, 4] if data.shape[1] > 4 else np.ones(len(data), dtype=np.float32)
+
+    return {"boxes": clip_boxes(data[:, :4], crop_shape), "scores": scores}
+
+def to_frame(boxes, veh_box):
+
+    # move boxes from vehicle crop coordinates to frame coordinates
+    return np.asarray(boxes).reshape(-1, 4) + np.asarray(veh_box)[[0, 1, 0, 1]]
+
+def crop(image, box):
+    x1, y1, x2, y2 = box
+    return image[y1:y2, x1:x2]
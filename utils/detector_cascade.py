@@ -0,0 +1,238 @@
+import os
+import threading
+import numpy as np
+from ultralytics import YOLO
+
+# classes 2 (car), 3 (motorcycle), 5, (bus), and 7 (truck)
+VEHICLE_CLASSES = [2, 3, 5, 7]
+
+HEAVY_MODEL = "models/yolov9c.pt"
+SMALL_MODEL = "models/yolov8s.pt"
+TINY_MODEL = "models/yolov8n.pt"
+
+# the small models aren't part of the repository, they are fetched once at install time (see fetch_models())
+# so the cascade works offline, levels whose weights are missing are skipped
+FETCHED_MODELS = [SMALL_MODEL, TINY_MODEL]
+
+# detector levels from the heaviest to the lightest: (screening model, model that re-checks the ambiguous regions)
+LEVELS = [
+    (HEAVY_MODEL, None),
+    (SMALL_MODEL, HEAVY_MODEL), # cascade
+    (SMALL_MODEL, None),
+    (TINY_MODEL, None)
+]
+CASCADE_LEVEL = 1
+
+LEVEL_NAMES = ["heavy", "cascade", "small", "tiny"]
+
+# detections of the screening model between these confidences are re-checked by the heavy model
+AMBIGUOUS_CONFIDENCE = (0.25, 0.6)
+
+# with more ambiguous regions than this the heavy model runs on the whole frame instead of every region
+MAX_REFINE_REGIONS = 3
+
+# the heavy model also checks the whole frame every n frames to catch vehicles the screening model missed
+FULL_CHECK_EVERY = 15
+
+# a region is grown by this fraction of its size before it is cropped for the heavy model
+REGION_PADDING = 0.15
+
+# a heavy detection confirms a screening detection if they overlap at least this much
+CONFIRM_IOU = 0.3
+
+# the frame latency is smoothed with an exponential moving average
+LATENCY_SMOOTHING = 0.2
+
+# step down after this many frames over the budget, step up after this many frames under HEADROOM * budget
+DOWNGRADE_FRAMES = 5
+UPGRADE_FRAMES = 60
+HEADROOM = 0.6
+
+# frames that are not measured after a level change (the new model warms up and frames of the old level are still in flight)
+SETTLE_FRAMES = 3
+
+def fetch_models():
+
+    # download the small models from the ultralytics release assets (run by the Dockerfile and venv-run.sh)
+    #   python -c "from utils.detector_cascade import fetch_models; fetch_models()"
+    from ultralytics.utils.downloads import attempt_download_asset
+
+    for path in FETCHED_MODELS:
+        if not os.path.exists(path):
+            attempt_download_asset(path)
+
+def available_levels():
+
+    # the levels whose models are all on disk
+    return [level for level, models in enumerate(LEVELS) if all(path is None or os.path.exists(path) for path in models)]
+
+def box_iou(a, b):
+    ix1, iy1, ix2, iy2 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0
+
+class DetectorCascade:
+
+    # detects vehicles with a detector level that fits the per frame latency budget
+    # the tracker is kept outside of the models (see utils/vehicle_tracker.py) so the vehicle ids stay the same when the level changes
+    # budget_ms = 0 keeps the starting level
+    def __init__(self, budget_ms=0, level=CASCADE_LEVEL, min_level=0):
+        self.budget_ms = budget_ms
+        self.min_level = min_level
+
+        # only step between the levels whose weights were fetched (ultralytics would try to download them mid-run)
+        self.levels = available_levels()
+        if not self.levels:
+            raise FileNotFoundError("No vehicle detector weights found (" + HEAVY_MODEL + ")")
+
+        missing = [LEVEL_NAMES[missing] for missing in range(len(LEVELS)) if missing not in self.levels]
+        if missing:
+            print("Vehicle detector: skipping the " + ", ".join(missing) + " level(s), their weights are missing (see fetch_models())")
+
+        # start on the closest lighter level if the requested one isn't available (a heavier one if there is none)
+        self.level = min(self.levels, key=lambda available: (available < level, abs(available - level)))
+        self.models = {}
+        self.lock = threading.Lock()
+
+        self.latency_ms = None
+        self.over_budget = 0
+        self.under_budget = 0
+        self.settle = 0
+        self.frame_count = 0
+        self.switches = []
+
+        # load the models of the starting level (the other levels are loaded the first time they are used)
+        self.model(LEVELS[self.level][0])
+        if LEVELS[self.level][1] is not None:
+            self.model(LEVELS[self.level][1])
+
+    def model(self, path):
+        if path not in self.models:
+            self.models[path] = YOLO(path)
+        return self.models[path]
+
+    @property
+    def name(self):
+        screen, refine = LEVELS[self.level]
+        if refine is None:
+            return LEVEL_NAMES[self.level] + " (" + screen.split("/")[-1] + ")"
+        return LEVEL_NAMES[self.level] + " (" + screen.split("/")[-1] + " + " + refine.split("/")[-1] + ")"
+
+    #_# DETECTION #_#
+    #################
+
+    def detect(self, model_path, image):
+
+        # returns the detections as an array of [x1, y1, x2, y2, confidence, class]
+        results = self.model(model_path).predict(image, classes=VEHICLE_CLASSES, conf=AMBIGUOUS_CONFIDENCE[0], verbose=False)
+        return results[0].boxes.data.cpu().numpy().reshape(-1, 6)
+
+    def refine(self, refine_path, frame, detections):
+
+        # re-check the ambiguous detections of the screening model with the heavy model
+        confidences = detections[:, 4]
+        ambiguous = np.where(confidences < AMBIGUOUS_CONFIDENCE[1])[0]
+        full_check = self.frame_count % FULL_CHECK_EVERY == 0
+
+        if len(ambiguous) == 0 and not full_check:
+            return detections
+
+        # an ambiguous frame (or the periodic check) runs the heavy model on the whole frame
+        if full_check or len(ambiguous) > MAX_REFINE_REGIONS:
+            return self.detect(refine_path, frame)
+
+        h, w = frame.shape[:2]
+        keep = [detections[confidences >= AMBIGUOUS_CONFIDENCE[1]]]
+
+        for index in ambiguous:
+            x1, y1, x2, y2 = detections[index, :4]
+            pad_x, pad_y = (x2 - x1) * REGION_PADDING, (y2 - y1) * REGION_PADDING
+            rx1, ry1 = int(max(0, x1 - pad_x)), int(max(0, y1 - pad_y))
+            rx2, ry2 = int(min(w, x2 + pad_x)), int(min(h, y2 + pad_y))
+            if rx2 <= rx1 or ry2 <= ry1:
+                continue
+
+            region = self.detect(refine_path, frame[ry1:ry2, rx1:rx2])
+            region[:, [0, 2]] += rx1
+            region[:, [1, 3]] += ry1
+
+            # keep the heavy box that matches best, or drop the detection if the heavy model doesn't confirm it
+            best = max(region, key=lambda box: box_iou(box, detections[index]), default=None)
+            if best is not None and box_iou(best, detections[index]) >= CONFIRM_IOU:
+                keep.append(best[None])
+
+        return np.concatenate(keep)
+
+    def names(self):
+        return self.model(LEVELS[self.level][0]).names
+
+    def detect_frame(self, frame):
+
+        # detect the vehicles in the frame with the current level, returns [x1, y1, x2, y2, confidence, class]
+        with self.lock:
+            screen, refine = LEVELS[self.level]
+            self.frame_count += 1
+
+        detections = self.detect(screen, frame)
+        if refine is not None:
+            detections = self.refine(refine, frame, detections)
+
+        return detections
+
+    #^# DETECTION #^#
+    #################
+
+    #_# LATENCY BUDGET #_#
+    ######################
+
+    def observe(self, frame_ms):
+
+        # called with the processing time of every frame, steps the level down when the frames take longer than the
+        # budget and back up when there is enough headroom
+        if not self.budget_ms:
+            return
+
+        with self.lock:
+            if self.settle > 0:
+                self.settle -= 1
+                return
+
+            if self.latency_ms is None:
+                self.latency_ms = frame_ms
+            else:
+                self.latency_ms += LATENCY_SMOOTHING * (frame_ms - self.latency_ms)
+
+            if self.latency_ms > self.budget_ms:
+                self.over_budget += 1
+                self.under_budget = 0
+            elif self.latency_ms < self.budget_ms * HEADROOM:
+                self.under_budget += 1
+                self.over_budget = 0
+            else:
+                self.over_budget = 0
+                self.under_budget = 0
+
+            lighter = [level for level in self.levels if level > self.level]
+            heavier = [level for level in self.levels if self.min_level <= level < self.level]
+
+            if self.over_budget >= DOWNGRADE_FRAMES and lighter:
+                self.switch(lighter[0])
+            elif self.under_budget >= UPGRADE_FRAMES and heavier:
+                self.switch(heavier[-1])
+
+    def switch(self, level):
+
+        # the latency of the new level is measured from scratch
+        self.switches.append((self.frame_count, LEVEL_NAMES[self.level], LEVEL_NAMES[level], round(self.latency_ms)))
+        print("Vehicle detector: " + LEVEL_NAMES[self.level] + " -> " + LEVEL_NAMES[level] +
+              " (" + str(round(self.latency_ms)) + " ms per frame, budget " + str(self.budget_ms) + " ms)")
+
+        self.level = level
+        self.latency_ms = None
+        self.over_budget = 0
+        self.under_budget = 0
+        self.settle = SETTLE_FRAMES
+
+    #^# LATENCY BUDGET #^#
+    ######################
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import socket
+import tempfile
+import selectors
+import threading
+from collections import deque
+
+# local event stream of the live detections, published as one compact json object per line on a unix socket
+#
+# events:
+#   {"type": "track_start", "ts": ..., "veh_id": 3, "frame": 120, "plate": "ABC123", "confidence": 87}
+#   {"type": "plate_vote", "ts": ..., "veh_id": 3, "frame": 125, "plate": "ABC123", "votes": 4}
+#   {"type": "watchlist_match", "ts": ..., "veh_id": 3, "frame": 125, "plate": "A8C123", "watched": "ABC123", "distance": 1, "note": "..."}
+#   {"type": "sighting", "ts": ..., "plate": "ABC123", "read_plate": "A8C123", "log_id": "<uuid>", "count": 2}
+#   {"type": "following", "ts": ..., "plate": "ABC123", "score": 0.6, "short_count": 2, "hour_count": 3, "spread_min": 42.0, "trips": 2, "alert": true}
+#   {"type": "dropped", "ts": ..., "count": 12} (sent to a subscriber that was too slow to read its buffer)
+#
+# subscribe with tools/events.py, or any client that connects to the socket and reads lines
+
+# the socket lives in the runtime dir instead of logs/ so Clear Logs can't remove it while the bus is bound
+# (the bus binds it again if it is removed anyway, see EventBus._check_socket())
+SOCKET_PATH = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), "pursuit-alert-" + str(os.getuid()), "events.sock")
+
+# how often the bus checks that its socket file still exists
+SOCKET_CHECK_S = 1
+
+# events buffered per subscriber, the oldest are dropped when a subscriber doesn't keep up
+BUFFER_SIZE = 256
+
+class EventBus:
+
+    # every subscriber gets its own bounded buffer so one slow client can't hold up the detection loop or the others
+    def __init__(self, path=SOCKET_PATH, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.subscribers = {} # socket: {"buffer": deque of encoded events, "pending": bytes being sent, "dropped": count}
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+
+        self.server = None
+        self._bind()
+
+        # publish() wakes the loop up through this pair
+        self.wake_read, self.wake_write = socket.socketpair()
+        self.wake_read.setblocking(False)
+        self.wake_write.setblocking(False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ)
+
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _bind(self):
+
+        # a stale socket file of an earlier run would stop the bind
+        os.makedirs(os.path.dirname(self.path) or ".", mode=0o700, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.last_check = time.time()
+
+    def _check_socket(self):
+
+        # bind a new socket if the file was removed (the connected subscribers keep their connections)
+        if time.time() - self.last_check < SOCKET_CHECK_S:
+            return
+        self.last_check = time.time()
+
+        if os.path.exists(self.path):
+            return
+
+        try:
+            self.selector.unregister(self.server)
+        except (KeyError, ValueError):
+            pass
+        self.server.close()
+
+        try:
+            self._bind()
+        except OSError as e:
+            print("Event bus: could not bind " + self.path + " again: " + str(e))
+
+    def publish(self, event_type, **fields):
+
+        # cheap enough to call on every frame, nothing is encoded without subscribers
+        if not self.subscribers:
+            return
+
+        event = {"type": event_type, "ts": round(time.time(), 3)}
+        event.update(fields)
+        data = (json.dumps(event, separators=(",", ":")) + "\n").encode()
+
+        with self.lock:
+            for subscriber in self.subscribers.values():
+                if len(subscriber["buffer"]) == self.buffer_size:
+                    subscriber["dropped"] += 1
+                subscriber["buffer"].append(data)
+
+        try:
+            self.wake_write.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _loop(self):
+        while self.running:
+            for key, mask in self.selector.select(timeout=1):
+                if key.fileobj is self.server:
+                    self._accept()
+                elif key.fileobj is self.wake_read:
+                    try:
+                        while self.wake_read.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                elif mask & selectors.EVENT_READ:
+                    # subscribers only read, anything they send is ignored (an empty read means they disconnected)
+                    try:
+                        if not key.fileobj.recv(4096):
+                            self._remove(key.fileobj)
+                            continue
+                    except (BlockingIOError, OSError):
+                        pass
+
+            self._send()
+            self._check_socket()
+
+    def _accept(self):
+        try:
+            connection, _ = self.server.accept()
+        except (BlockingIOError, OSError):
+            return
+
+        connection.setblocking(False)
+        with self.lock:
+            self.subscribers[connection] = {"buffer": deque(maxlen=self.buffer_size), "pending": b"", "dropped": 0}
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def _remove(self, connection):
+        with self.lock:
+            self.subscribers.pop(connection, None)
+        try:
+            self.selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
+
+    def _send(self):
+
+        # write as much of every buffer as the sockets take without blocking
+        with self.lock:
+            subscribers = list(self.subscribers.items())
+
+        for connection, subscriber in subscribers:
+            with self.lock:
+                if not subscriber["pending"] and subscriber["buffer"]:
+                    subscriber["pending"] = b"".join(subscriber["buffer"])
+                    subscriber["buffer"].clear()
+
+                    # tell the subscriber how many events it missed before the ones that are left
+                    if subscriber["dropped"]:
+                        notice = {"type": "dropped", "ts": round(time.time(), 3), "count": subscriber["dropped"]}
+                        subscriber["pending"] = (json.dumps(notice, separators=(",", ":")) + "\n").encode() + subscriber["pending"]
+                        subscriber["dropped"] = 0
+
+            if not subscriber["pending"]:
+                continue
+
+            try:
+                sent = connection.send(subscriber["pending"])
+                subscriber["pending"] = subscriber["pending"][sent:]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self._remove(connection)
+
+        # wait for the writable sockets on the next select if something is still pending
+        for connection, subscriber in subscribers:
+            if connection.fileno() == -1:
+                continue
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if subscriber["pending"] or subscriber["buffer"] else 0)
+            try:
+                self.selector.modify(connection, events)
+            except (KeyError, ValueError):
+                pass
+
+    def close(self):
+        self.running = False
+        self.thread.join(timeout=2)
+
+        for connection in list(self.subscribers):
+            self._remove(connection)
+
+        self.selector.close()
+        self.server.close()
+        self.wake_read.close()
+        self.wake_write.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# one bus per process (streamlit reruns the script but the socket stays bound)
+_bus = None
+_bus_lock = threading.Lock()
+
+def start_event_bus(path=SOCKET_PATH):
+    global _bus
+
+    with _bus_lock:
+        if _bus is None:
+            _bus = EventBus(path)
+
+    return _bus
+
+def publish(event_type, **fields):
+
+    # does nothing if the bus wasn't started (e.g. in the replay tool)
+    if _bus is not None:
+        _bus.publish(event_type, **fields)
+
+def subscribe(path=SOCKET_PATH):
+
+    # yields the events published on the bus as dicts (blocks while waiting)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+
+        with connection.makefile("r") as lines:
+            for line in lines:
+                yield json.loads(line)
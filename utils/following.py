@@ -0,0 +1,134 @@
+import os
+import json
+from bisect import bisect_left
+from utils.plate_stats import sighting_timestamp
+
+FOLLOWING_PATH = "logs/perm/following.json"
+
+# the sliding windows the sightings of a plate are counted over
+SHORT_WINDOW_S = 10 * 60
+LONG_WINDOW_S = 60 * 60
+
+# a new trip starts when nothing was sighted for this long (the app was off or the vehicle was parked)
+TRIP_GAP_S = 2 * 60 * 60
+
+# how much each score component alone counts towards the score
+REPEAT_WEIGHT = 0.3 # sighted again within the short window
+SPREAD_WEIGHT = 0.6 # sighted over a long part of the long window
+TRIPS_WEIGHT = 0.5 # sighted on separate trips
+
+# a plate is reported as following once its score reaches this (once per trip)
+ALERT_SCORE = 0.5
+
+#_# FOLLOWING ENGINE #_#
+########################
+
+def following_score(short_count, spread_s, trips):
+
+    # every component saturates at 1: 3 sightings in 10 minutes, sightings 30 minutes apart within the hour, 3 trips
+    repeat = min(short_count - 1, 2) / 2
+    spread = min(spread_s / (LONG_WINDOW_S / 2), 1)
+    trip = min(trips - 1, 2) / 2
+
+    # the components are combined like independent evidence so each one alone can't go over its weight
+    return round(1 - (1 - REPEAT_WEIGHT * repeat) * (1 - SPREAD_WEIGHT * spread) * (1 - TRIPS_WEIGHT * trip), 3)
+
+class FollowingEngine:
+
+    # keeps the sightings of every plate in the last hour and the number of trips it was seen on
+    # so a new sighting is scored without going over the history
+    def __init__(self, state=None):
+        state = state or {}
+        self.last_ts = state.get("last_ts")
+        self.trip = state.get("trip", 0)
+
+        # seq of the last sighting of the journal the windows contain (see utils/sighting_history.py)
+        self.seq = state.get("seq", 0)
+
+        # plate: {"recent": [timestamps in the long window], "trips": n, "last_trip": trip id, "peak": highest score,
+        #         "alerted_trip": trip id of the last alert}
+        self.plates = state.get("plates", {})
+
+    def observe(self, plate, timestamp):
+
+        # add a sighting and return the windows and following score of the plate
+        if self.last_ts is None or timestamp - self.last_ts > TRIP_GAP_S:
+            self.trip += 1
+        self.last_ts = timestamp if self.last_ts is None else max(self.last_ts, timestamp)
+
+        entry = self.plates.get(plate)
+        if entry is None:
+            entry = {"recent": [], "trips": 0, "last_trip": None, "peak": 0, "alerted_trip": None}
+            self.plates[plate] = entry
+
+        if entry["last_trip"] != self.trip:
+            entry["trips"] += 1
+            entry["last_trip"] = self.trip
+
+        # slide the long window (the list only holds the sightings of the last hour)
+        recent = entry["recent"]
+        recent.insert(bisect_left(recent, timestamp), timestamp)
+        del recent[:bisect_left(recent, recent[-1] - LONG_WINDOW_S)]
+
+        short_count = len(recent) - bisect_left(recent, recent[-1] - SHORT_WINDOW_S)
+        spread_s = recent[-1] - recent[0]
+
+        score = following_score(short_count, spread_s, entry["trips"])
+        entry["peak"] = max(entry["peak"], score)
+
+        # only alert once per trip
+        alert = score >= ALERT_SCORE and entry["alerted_trip"] != self.trip
+        if alert:
+            entry["alerted_trip"] = self.trip
+
+        return {
+            "plate": plate,
+            "score": score,
+            "short_count": short_count,
+            "hour_count": len(recent),
+            "spread_min": round(spread_s / 60, 1),
+            "trips": entry["trips"],
+            "alert": alert
+        }
+
+    def state(self):
+        return {"last_ts": self.last_ts, "trip": self.trip, "seq": self.seq, "plates": self.plates}
+
+#^# FOLLOWING ENGINE #^#
+########################
+
+#_# PERSISTENCE #_#
+###################
+
+def rebuild_following(all_plates):
+
+    # replay the full history in time order (only needed when following.json is missing)
+    engine = FollowingEngine()
+
+    sightings = sorted((sighting_timestamp(detection), plate) for plate, detections in all_plates.items() for detection in detections)
+    for timestamp, plate in sightings:
+        engine.observe(plate, timestamp)
+
+    return engine
+
+def load_following(all_plates=None, path=FOLLOWING_PATH):
+
+    # returns the engine and whether it had to be rebuilt from the history
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            return FollowingEngine(json.load(file)), False
+
+    if all_plates is not None:
+        return rebuild_following(all_plates), True
+
+    return FollowingEngine(), False
+
+def save_following(engine, path=FOLLOWING_PATH):
+
+    with open(path + ".tmp", "w") as file:
+        json.dump(engine.state(), file, separators=(",", ":"))
+
+    os.replace(path + ".tmp", path)
+
+#^# PERSISTENCE #^#
+###################
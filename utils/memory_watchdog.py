@@ -0,0 +1,216 @@
+import os
+import gc
+import json
+import time
+import tracemalloc
+import psutil
+
+REPORT_DIR = "logs/diagnostics"
+
+# default memory settings (0 disables the ceiling)
+DEFAULT_CONFIG = {
+    "diagnostics": False, # take tracemalloc snapshots and write a growth report
+    "ceiling_mb": 0, # shed caches and preview frames when the process RSS goes over this
+    "low_water": 0.8, # share of the ceiling the RSS has to drop under before the shed preview is restored
+    "interval_s": 30, # how often the memory is sampled
+    "snapshot_every": 10, # take a tracemalloc snapshot every n samples
+    "top_sites": 10, # number of growth sites in the report
+    "trace_frames": 5 # stack depth recorded by tracemalloc (more is slower)
+}
+
+# only the last samples are kept in memory (the watchdog should not leak itself)
+MAX_SAMPLES = 720
+
+def memory_config(session_state):
+
+    # build the memory config from the values set on the settings page
+    return {
+        "diagnostics": session_state.get('memory_diagnostics', False),
+        "ceiling_mb": session_state.get('memory_ceiling_mb', 0)
+    }
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / (1024 ** 2)
+
+class MemoryWatchdog:
+
+    # samples the process memory while the app runs for hours, call check() once per frame
+    # subsystems register a counter (how many objects they hold) and optionally a shedder (a function that frees memory)
+    # when the RSS goes over the ceiling the shedders run in the order they were registered until it is back under it
+    # a shedder that degrades something (e.g. the preview size) can have a restorer, it runs on every sample once the RSS
+    # is under the low water mark until it returns True (fully restored)
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_CONFIG)
+        self.config.update(config or {})
+
+        self.counters = {} # name: function returning the number of objects held
+        self.shedders = [] # (name, function) in the order they run
+        self.restorers = {} # name: function that undoes the shedder, returns True once it is fully restored
+        self.degraded = [] # names of the shedders that ran and have a restorer
+        self.samples = []
+        self.shed_events = []
+        self.top_growth = []
+        self.baseline = None
+        self.last_check = 0
+        self.sample_count = 0
+        self.started = time.time()
+        self.report_path = None
+
+        if self.config["diagnostics"]:
+            os.makedirs(REPORT_DIR, exist_ok=True)
+            self.report_path = os.path.join(REPORT_DIR, "memory_" + time.strftime("%Y%m%d_%H%M%S") + ".json")
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.config["trace_frames"])
+            self.baseline = tracemalloc.take_snapshot()
+
+    @property
+    def enabled(self):
+        return self.config["diagnostics"] or self.config["ceiling_mb"] > 0
+
+    def register(self, name, counter=None, shedder=None, restorer=None):
+        if counter is not None:
+            self.counters[name] = counter
+        if shedder is not None:
+            self.shedders.append((name, shedder))
+        if restorer is not None:
+            self.restorers[name] = restorer
+
+    def count_objects(self):
+
+        # a broken counter should not stop the video processing
+        counts = {}
+        for name, counter in self.counters.items():
+            try:
+                counts[name] = counter()
+            except Exception:
+                counts[name] = None
+
+        return counts
+
+    def check(self, force=False):
+
+        # sample the memory at most every interval_s seconds, returns the sample or None if it was skipped
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        if not force and now - self.last_check < self.config["interval_s"]:
+            return None
+        self.last_check = now
+
+        sample = {"t": round(now - self.started, 1), "rss_mb": round(rss_mb(), 1), "objects": self.count_objects()}
+        if tracemalloc.is_tracing():
+            sample["traced_mb"] = round(tracemalloc.get_traced_memory()[0] / (1024 ** 2), 1)
+
+        # free memory until the process is back under the ceiling
+        if self.config["ceiling_mb"] and sample["rss_mb"] > self.config["ceiling_mb"]:
+            sample["shed"] = self.shed(sample["rss_mb"])
+
+        # undo the degraded shedders step by step once there is room again
+        elif self.degraded and sample["rss_mb"] < self.config["ceiling_mb"] * self.config["low_water"]:
+            sample["restored"] = self.restore()
+
+        self.samples.append(sample)
+        del self.samples[:-MAX_SAMPLES]
+
+        # compare a snapshot to the baseline every few samples to find the lines that keep allocating
+        self.sample_count += 1
+        if self.baseline is not None and (force or self.sample_count % self.config["snapshot_every"] == 0):
+            self.snapshot()
+
+        return sample
+
+    def shed(self, current_mb):
+
+        shed = []
+        for name, shedder in self.shedders:
+            try:
+                shedder()
+            except Exception as e:
+                print("Memory watchdog: shedding " + name + " failed: " + str(e))
+                continue
+
+            gc.collect()
+            shed.append(name)
+
+            if name in self.restorers and name not in self.degraded:
+                self.degraded.append(name)
+
+            current_mb = rss_mb()
+            if current_mb <= self.config["ceiling_mb"]:
+                break
+
+        self.shed_events.append({"t": round(time.time() - self.started, 1), "shed": shed, "rss_mb": round(current_mb, 1)})
+        del self.shed_events[:-MAX_SAMPLES]
+
+        print("Memory watchdog: over the " + str(self.config["ceiling_mb"]) + " MB ceiling, shed " + ", ".join(shed) +
+              " (" + str(round(current_mb)) + " MB now)")
+
+        return shed
+
+    def restore(self):
+
+        # the last degraded shedder is restored first
+        restored = []
+        for name in reversed(list(self.degraded)):
+            try:
+                done = self.restorers[name]()
+            except Exception as e:
+                print("Memory watchdog: restoring " + name + " failed: " + str(e))
+                done = True
+
+            restored.append(name)
+            if done:
+                self.degraded.remove(name)
+
+        return restored
+
+    def snapshot(self):
+
+        # only the allocations of the app are interesting, not the tracemalloc bookkeeping itself
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ])
+
+        self.top_growth = []
+        for stat in snapshot.compare_to(self.baseline, "lineno")[:self.config["top_sites"]]:
+            frame = stat.traceback[0]
+            self.top_growth.append({
+                "site": frame.filename + ":" + str(frame.lineno),
+                "growth_kb": round(stat.size_diff / 1024, 1),
+                "size_kb": round(stat.size / 1024, 1),
+                "count_growth": stat.count_diff
+            })
+
+        self.write_report()
+
+    def report(self):
+        return {
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "config": self.config,
+            "samples": self.samples,
+            "shed_events": self.shed_events,
+            "top_growth": self.top_growth
+        }
+
+    def write_report(self):
+        if self.report_path is None:
+            return
+
+        with open(self.report_path + ".tmp", "w") as file:
+            json.dump(self.report(), file, indent=4)
+
+        os.replace(self.report_path + ".tmp", self.report_path)
+
+    def close(self):
+
+        # take a last sample and snapshot and stop tracing
+        if not self.enabled:
+            return
+
+        self.check(force=True)
+        if self.baseline is not None:
+            self.baseline = None
+            tracemalloc.stop()
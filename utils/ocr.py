@@ -0,0 +1,62 @@
+import os
+import easyocr
+import torch
+from easyocr.utils import CTCLabelConverter
+
+# characters that can be on a plate
+PLATE_ALLOWLIST = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# full: CRAFT text detector + english_g2 recognizer (finds every string on the plate crop)
+#       on the gpu if there is one (fp32), on the cpu easyocr already quantizes the recognizer to INT8 by default
+# slim: the INT8 recognizer only, always on the cpu (reads the whole plate crop as one string)
+# so on the cpu the engines differ by the CRAFT detector, and by the fp32 weights that the slim engine never loads
+# if the pre-quantized recognizer was exported
+OCR_ENGINES = ["full", "slim"]
+
+# pre-quantized recognizer written by tools/ocr_benchmark.py --export
+QUANTIZED_RECOGNIZER_PATH = "models/english_g2_int8.pt"
+
+# the character dictionary of the english recognizer (only used by the beam search decoders)
+ENGLISH_DICT_PATH = os.path.join(os.path.dirname(easyocr.__file__), "dict", "en.txt")
+
+def load_ocr_engine(engine="full"):
+
+    # specify model_storage_directory and download_enabled to False (to prevent downloading the model every time the script is run)
+    if engine == "full":
+        return easyocr.Reader(['en'], model_storage_directory="models", download_enabled=False) # optical character recognition
+
+    if engine != "slim":
+        raise ValueError("Unknown OCR engine: " + str(engine))
+
+    # easyocr only quantizes on the cpu, so the slim engine always runs there
+    if not os.path.exists(QUANTIZED_RECOGNIZER_PATH):
+        # load the fp32 recognizer and quantize it while loading
+        return easyocr.Reader(['en'], gpu=False, model_storage_directory="models", download_enabled=False, detector=False, quantize=True)
+
+    # build the reader without any model and load the pre-quantized recognizer so the fp32 weights are never in memory
+    reader = easyocr.Reader(['en'], gpu=False, model_storage_directory="models", download_enabled=False, detector=False, recognizer=False)
+    reader.recognizer = torch.load(QUANTIZED_RECOGNIZER_PATH, map_location="cpu", weights_only=False)
+    reader.recognizer.eval()
+    reader.converter = CTCLabelConverter(reader.character, {}, {"en": ENGLISH_DICT_PATH})
+
+    return reader
+
+def quantize_recognizer(recognizer):
+
+    # apply dynamic INT8 quantization to the LSTM and linear layers of an fp32 recognizer
+    # readers on the gpu wrap the recognizer in DataParallel, dynamic quantization only runs on the cpu
+    if isinstance(recognizer, torch.nn.DataParallel):
+        recognizer = recognizer.module
+
+    return torch.quantization.quantize_dynamic(recognizer.cpu().float().eval(), {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+
+def is_quantized(recognizer):
+    return any(isinstance(module, torch.nn.quantized.dynamic.Linear) for module in recognizer.modules())
+
+def read_plate(reader, plate_crop, engine="full"):
+
+    # returns the same [(box, string, confidence)] list as easyocr readtext for both engines
+    if engine == "slim":
+        return reader.recognize(plate_crop, allowlist=PLATE_ALLOWLIST)
+
+    return reader.readtext(plate_crop, allowlist=PLATE_ALLOWLIST) # allow multiple string detections per frame
@@ -0,0 +1,230 @@
+import os
+import cv2
+import numpy as np
+import time
+import json
+import uuid
+from collections import Counter
+from colorama import Fore, Style
+from utils.segment_store import perm_store, tmp_store
+from utils.event_bus import publish
+from utils.sighting_history import sighting_history, flush_history
+from utils.columnar_export import export_finished_track
+
+# plate voting and perm log creation, shared by the live pipeline, the parallel shards and the replay tool
+
+# a plate read is only logged with at least this many characters and this confidence (%)
+MIN_PLATE_CHARS = 3
+MIN_PLATE_CONFIDENCE = 50
+
+def temporal_redundancy_voting(plate_strings):
+
+    # Determine the maximum length of the plates
+    max_length = max(len(plate) for plate in plate_strings)
+
+    # Initialize a list to hold the voted characters for each position
+    voted_characters = []
+
+    # Iterate through each position
+    for i in range(max_length):
+        char_counter = Counter()
+
+        # Count characters at the current position for each plate and count blanks
+        num_blanks = 0
+        for plate in plate_strings:
+            if i < len(plate):
+                char_counter[plate[i]] += 1
+            else:
+                num_blanks += 1
+
+        # If blanks are the majority, stop adding more characters
+        if num_blanks > len(plate_strings) / 2:
+            break
+
+        # Find the most common character for this position
+        most_common_char, _ = char_counter.most_common(1)[0]
+        voted_characters.append(most_common_char)
+
+    # Join the characters to form the final voted plate
+    voted_plate = ''.join(voted_characters)
+    return voted_plate
+
+def create_perm_log(veh_id, vid, write_fps):
+    
+    # Load plate strings and vehicle tracking data from JSON files if they exist
+    with open(f"logs/tmp/Vehicle_{veh_id}/plates.json", "r") as file:
+        plate_reads = json.load(file)
+        plate_strings = [entry["plate"] for entry in plate_reads]
+    
+    if os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/vehicle_track.json"):
+        with open(f"logs/tmp/Vehicle_{veh_id}/vehicle_track.json", "r") as file:
+            vehicle_data = json.load(file)
+            vehicle_data_found = True
+    else:
+        vehicle_data_found = False
+    
+    if os.path.exists("logs/tmp/Vehicle_" + str(veh_id) + "/plate_track.json"):
+        with open(f"logs/tmp/Vehicle_{veh_id}/plate_track.json", "r") as file:
+            plate_track_data = json.load(file)
+            plate_data_found = True
+    else:
+        plate_data_found = False
+    
+    # generate the UUID for the perm log
+    perm_uuid = str(uuid.uuid4())
+
+    # Apply the temporal redundancy voting algorithm
+    voted_plate = temporal_redundancy_voting(plate_strings)
+
+    # Create the permanent log directory (the media itself is appended to the perm segment store)
+    perm_path = f"/perm/{perm_uuid}"
+    if not os.path.exists("logs/perm"):
+        os.makedirs("logs/perm")
+
+    # Get frame size for the video
+    width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    # Create video writer object (the video is encoded in the tmp folder and then appended to the perm store)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    tmp_video_path = f"logs/tmp/Vehicle_{veh_id}/video.mp4"
+    out = cv2.VideoWriter(tmp_video_path, fourcc, write_fps, (width, height))
+
+    # Process each frame and save one cropped image of the vehicle and plate
+    frame_prefix = f"Vehicle_{veh_id}/frames/"
+    frame_numbers = sorted([int(key[len(frame_prefix):]) for key in tmp_store().keys(frame_prefix)])
+    cropped_vehicle_saved = False
+    cropped_plate_saved = False
+
+    for frame_num in frame_numbers:
+        img_bytes = tmp_store().get(f"{frame_prefix}{frame_num}")
+        if img_bytes is not None:
+            img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+            # Retrieve vehicle frame data and draw bounding box
+            if (vehicle_data_found):
+                vehicle_frame_data = vehicle_data.get(str(frame_num))
+                if vehicle_frame_data:
+                    vx1, vy1, vx2, vy2 = map(int, [vehicle_frame_data['x1'], vehicle_frame_data['y1'], vehicle_frame_data['x2'], vehicle_frame_data['y2']])
+                    cv2.rectangle(img, (vx1, vy1), (vx2, vy2), (0, 0, 255), 2)
+                    cv2.putText(img, "Target Vehicle", (vx1, vy1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
+
+                    # Crop and save one image of the vehicle and plate
+                    if not cropped_vehicle_saved:
+                        cropped_vehicle = img[vy1:vy2, vx1:vx2]
+                        perm_store().put(f"{perm_path}/cropped_vehicle.jpg", cv2.imencode(".jpg", cropped_vehicle)[1].tobytes())
+                        cropped_vehicle_saved = True
+
+            # Retrieve plate frame data, adjust to vehicle coordinates, and draw cornered bounding box
+            if (plate_data_found):
+                plate_frame_data = plate_track_data.get(str(frame_num))
+                if plate_frame_data and vehicle_frame_data:
+                    px1, py1, px2, py2 = map(int, [plate_frame_data['x1'], plate_frame_data['y1'], plate_frame_data['x2'], plate_frame_data['y2']])
+
+                    # Adjust plate coordinates to vehicle coordinates
+                    px1 += vx1
+                    py1 += vy1
+                    px2 += vx1
+                    py2 += vy1
+
+                    # Draw cornered bounding box for the plate
+                    # Top left corner
+                    cv2.line(img, (px1, py1), (px1, py1 + 20), (255, 255, 255), 4)
+                    cv2.line(img, (px1, py1), (px1 + 20, py1), (255, 255, 255), 4)
+                    # Top right corner
+                    cv2.line(img, (px2, py1), (px2, py1 + 20), (255, 255, 255), 4)
+                    cv2.line(img, (px2, py1), (px2 - 20, py1), (255, 255, 255), 4)
+                    # Bottom left corner
+                    cv2.line(img, (px1, py2), (px1, py2 - 20), (255, 255, 255), 4)
+                    cv2.line(img, (px1, py2), (px1 + 20, py2), (255, 255, 255), 4)
+                    # Bottom right corner
+                    cv2.line(img, (px2, py2), (px2, py2 - 20), (255, 255, 255), 4)
+                    cv2.line(img, (px2, py2), (px2 - 20, py2), (255, 255, 255), 4)
+
+                    # Add the voted plate string to the plate area label
+                    cv2.putText(img, voted_plate, (px1, py1 - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 2)
+
+                    # Crop and save one image of the plate
+                    if not cropped_plate_saved:
+                        cropped_plate = img[py1:py2, px1:px2]
+                        perm_store().put(f"{perm_path}/cropped_plate.jpg", cv2.imencode(".jpg", cropped_plate)[1].tobytes())
+                        cropped_plate_saved = True
+
+            # Write the frame to the video
+            out.write(img)
+
+    out.release()
+
+    # append the encoded video to the perm store as one sequential write
+    with open(tmp_video_path, "rb") as file:
+        perm_store().put(f"{perm_path}/video.mp4", file.read())
+
+    # add the sighting to the history
+    timestamp = time.time()
+    plate_identity, following_result = record_sighting(voted_plate, perm_uuid, timestamp)
+
+    # export the reads and boxes of the track to the columnar files if enabled (they are only kept in the tmp folder)
+    export_finished_track(perm_uuid, plate_identity, voted_plate, timestamp, plate_reads,
+                          vehicle_data if vehicle_data_found else {}, plate_track_data if plate_data_found else {})
+
+    # delete the tmp folder and tmp frames for the vehicle 
+    os.system("rm -rf logs/tmp/Vehicle_" + str(veh_id))
+    tmp_store().delete_prefix(frame_prefix)
+
+    return following_result
+        
+def record_sighting(voted_plate, perm_uuid, timestamp=None):
+
+    # add a sighting of the voted plate to the history, the plate index, the Analysis aggregates and the following engine
+    # (kept in memory and journaled, see utils/sighting_history.py)
+    # returns the plate the sighting was attached to and its following result (see utils/following.py)
+
+    # Get the date and time
+    if timestamp is None:
+        timestamp = time.time()
+
+    plate_identity, sighting, following_result, count = sighting_history().add(voted_plate, perm_uuid, timestamp)
+
+    if plate_identity != voted_plate:
+        print(Fore.CYAN + "\nMatched " + voted_plate + " to known plate " + plate_identity + Style.RESET_ALL)
+
+    if following_result["alert"]:
+        print(Fore.RED + "\nPossible following vehicle: " + plate_identity + " (score " + str(following_result["score"]) + ", " +
+              str(following_result["trips"]) + " trips, " + str(following_result["hour_count"]) + " sightings in the last hour)" + Style.RESET_ALL)
+        publish("following", **following_result)
+
+    # let the event stream subscribers know without them polling all_plates.json
+    publish("sighting", plate=plate_identity, read_plate=voted_plate, log_id=perm_uuid, date=sighting["date"], time=sighting["time"],
+            count=count, following_score=following_result["score"])
+
+    return plate_identity, following_result
+
+def create_track_logs(tracks, stream, write_fps):
+
+    # write finished tracks (from the parallel shards or a replayed recording) to tmp logs in the same format as the live pipeline
+    # then create the perm logs in the order the vehicles left the video
+    for veh_id, track in sorted(tracks.items(), key=lambda item: item[1]["last_frame"]):
+
+        if not os.path.exists("logs/tmp/Vehicle_" + str(veh_id)):
+            os.makedirs("logs/tmp/Vehicle_" + str(veh_id))
+
+        with open("logs/tmp/Vehicle_" + str(veh_id) + "/plates.json", 'w') as f:
+            json.dump(track["plates"], f, indent=4)
+
+        with open("logs/tmp/Vehicle_" + str(veh_id) + "/vehicle_track.json", 'w') as f:
+            json.dump(track["vehicle_track"], f, indent=4)
+
+        with open("logs/tmp/Vehicle_" + str(veh_id) + "/plate_track.json", 'w') as f:
+            json.dump(track["plate_track"], f, indent=4)
+
+        # re-read the frames of the track from the video
+        for frame_number in track["frames"]:
+            stream.set(cv2.CAP_PROP_POS_FRAMES, frame_number - 1)
+            ret, frame = stream.read()
+            if ret:
+                tmp_store().put("Vehicle_" + str(veh_id) + "/frames/" + str(frame_number), cv2.imencode(".jpg", frame)[1].tobytes())
+
+        create_perm_log(veh_id, stream, write_fps)
+
+    # save the journaled sightings to all_plates.json and the aggregates
+    flush_history()
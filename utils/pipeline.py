@@ -0,0 +1,110 @@
+import queue
+import threading
+
+# default number of items that can wait between two stages
+# small so a slow stage applies backpressure instead of frames piling up in memory
+QUEUE_SIZE = 2
+
+# how often blocked threads check if the pipeline was closed
+POLL_S = 0.1
+
+class _End:
+    pass
+
+class _Error:
+    def __init__(self, error):
+        self.error = error
+
+class StagePipeline:
+
+    # runs a source and a list of stage functions on their own threads connected by bounded queues
+    # while stage 2 works on item N, stage 1 can already work on item N + 1
+    # every stage has exactly one thread so the items come out in the same order they went in
+    # (this only helps if the stages release the GIL, which torch and opencv do)
+    def __init__(self, source, stages, queue_size=QUEUE_SIZE):
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self.stopped = threading.Event()
+        self.threads = [threading.Thread(target=self._run_source, args=(source, self.queues[0]), daemon=True)]
+
+        for i, stage in enumerate(stages):
+            self.threads.append(threading.Thread(target=self._run_stage, args=(stage, self.queues[i], self.queues[i + 1]), daemon=True))
+
+        for thread in self.threads:
+            thread.start()
+
+    def _put(self, q, item):
+
+        # block until there is room, unless the pipeline is closed
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=POLL_S)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+
+        while not self.stopped.is_set():
+            try:
+                return q.get(timeout=POLL_S)
+            except queue.Empty:
+                pass
+        return _End()
+
+    def _run_source(self, source, out_q):
+
+        # the source returns None when there are no more items
+        while not self.stopped.is_set():
+            try:
+                item = source()
+            except Exception as e:
+                self._put(out_q, _Error(e))
+                return
+
+            if item is None:
+                self._put(out_q, _End())
+                return
+
+            if not self._put(out_q, item):
+                return
+
+    def _run_stage(self, stage, in_q, out_q):
+
+        while True:
+            item = self._get(in_q)
+
+            # pass the end marker and errors on to the next stage
+            if not isinstance(item, (_End, _Error)):
+                try:
+                    item = stage(item)
+                except Exception as e:
+                    item = _Error(e)
+
+            if not self._put(out_q, item) or isinstance(item, (_End, _Error)):
+                return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+
+        item = self._get(self.queues[-1])
+
+        if isinstance(item, _Error):
+            self.close()
+            raise item.error
+
+        if isinstance(item, _End):
+            self.close()
+            raise StopIteration
+
+        return item
+
+    def close(self):
+
+        # stop every thread (the items still in the queues are dropped)
+        self.stopped.set()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1)
@@ -0,0 +1,175 @@
+import os
+import json
+
+#_# OCR CONFUSION DISTANCE #_#
+##############################
+
+# pairs of characters that the OCR model commonly mixes up on plates
+OCR_CONFUSIONS = [
+    ("0", "O"), ("0", "D"), ("O", "D"), ("0", "Q"), ("O", "Q"),
+    ("1", "I"), ("1", "L"), ("I", "L"), ("1", "T"),
+    ("2", "Z"), ("5", "S"), ("6", "G"), ("8", "B"), ("4", "A"), ("7", "T"),
+]
+
+# the distance is scaled by 2 so it stays an integer (needed for the BK-tree buckets)
+# a confused character costs 1, any other substitution, insertion or deletion costs 2
+CONFUSION_COST = 1
+EDIT_COST = 2
+
+# by default only attach a sighting to an existing plate if they differ by one OCR confusion
+DEFAULT_MAX_DISTANCE = CONFUSION_COST
+
+_confusion_set = set()
+for a, b in OCR_CONFUSIONS:
+    _confusion_set.add((a, b))
+    _confusion_set.add((b, a))
+
+def substitution_cost(a, b):
+    if a == b:
+        return 0
+    if (a, b) in _confusion_set:
+        return CONFUSION_COST
+    return EDIT_COST
+
+def ocr_distance(s1, s2):
+
+    # weighted levenshtein distance where OCR confusions are cheaper than other edits
+    # the costs are symmetric and satisfy the triangle inequality, so it is a metric (required by the BK-tree)
+    if s1 == s2:
+        return 0
+
+    previous = [j * EDIT_COST for j in range(len(s2) + 1)]
+
+    for i, c1 in enumerate(s1, 1):
+        current = [i * EDIT_COST]
+        for j, c2 in enumerate(s2, 1):
+            current.append(min(
+                previous[j] + EDIT_COST, # deletion
+                current[j - 1] + EDIT_COST, # insertion
+                previous[j - 1] + substitution_cost(c1, c2) # substitution
+            ))
+        previous = current
+
+    return previous[-1]
+
+#^# OCR CONFUSION DISTANCE #^#
+##############################
+
+#_# BK-TREE INDEX #_#
+#####################
+
+class PlateIndex:
+
+    # BK-tree stored as a flat list of nodes so it can be written to json without recursion
+    # each node is [plate, {distance: child node index}]
+    def __init__(self, nodes=None):
+        self.nodes = nodes if nodes is not None else []
+        self.plates = set(node[0] for node in self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, plate):
+        return plate in self.plates
+
+    def add(self, plate):
+
+        # skip plates that are already indexed
+        if plate in self.plates:
+            return False
+
+        self.plates.add(plate)
+
+        # the first plate becomes the root of the tree
+        if not self.nodes:
+            self.nodes.append([plate, {}])
+            return True
+
+        # walk down the tree following the bucket of the distance to each node
+        node = self.nodes[0]
+        while True:
+            dist = str(ocr_distance(plate, node[0]))
+            child = node[1].get(dist)
+
+            if child is None:
+                node[1][dist] = len(self.nodes)
+                self.nodes.append([plate, {}])
+                return True
+
+            node = self.nodes[child]
+
+    def find(self, plate, max_distance=DEFAULT_MAX_DISTANCE):
+
+        # return a list of (distance, plate) for every indexed plate within max_distance, closest first
+        matches = []
+
+        if not self.nodes:
+            return matches
+
+        # only the buckets in [dist - max_distance, dist + max_distance] can hold matches (triangle inequality)
+        candidates = [0]
+        while candidates:
+            node = self.nodes[candidates.pop()]
+            dist = ocr_distance(plate, node[0])
+
+            if dist <= max_distance:
+                matches.append((dist, node[0]))
+
+            for child_dist, child in node[1].items():
+                if dist - max_distance <= int(child_dist) <= dist + max_distance:
+                    candidates.append(child)
+
+        matches.sort()
+        return matches
+
+#^# BK-TREE INDEX #^#
+#####################
+
+#_# PERSISTENCE #_#
+###################
+
+INDEX_PATH = "logs/perm/plate_index.json"
+
+def load_plate_index(all_plates=None, path=INDEX_PATH):
+
+    # load the index from disk if it exists
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            index = PlateIndex(json.load(file)["nodes"])
+    else:
+        index = PlateIndex()
+
+    # backfill plates that were logged before the index existed (or if the index file was removed)
+    if all_plates is not None and len(index) < len(all_plates):
+        for plate in all_plates:
+            index.add(plate)
+
+    return index
+
+def save_plate_index(index, path=INDEX_PATH):
+
+    # write to a tmp file first and then replace so a crash mid-write can't corrupt the index
+    with open(path + ".tmp", "w") as file:
+        json.dump({"nodes": index.nodes}, file, separators=(",", ":"))
+
+    os.replace(path + ".tmp", path)
+
+def resolve_plate(index, voted_plate, all_plates, max_distance=DEFAULT_MAX_DISTANCE):
+
+    # an exact match is always the same identity
+    if voted_plate in all_plates:
+        return voted_plate
+
+    # find the closest known plate, preferring the one with the most sightings if there is a tie
+    matches = [(dist, plate) for dist, plate in index.find(voted_plate, max_distance) if plate in all_plates]
+
+    if matches:
+        dist, plate = min(matches, key=lambda match: (match[0], -len(all_plates[match[1]]), match[1]))
+        return plate
+
+    # no close match so this is a new identity
+    index.add(voted_plate)
+    return voted_plate
+
+#^# PERSISTENCE #^#
+###################
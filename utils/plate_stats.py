@@ -0,0 +1,155 @@
+import os
+import json
+import time
+
+STATS_PATH = "logs/perm/plate_stats.json"
+
+# the date and time format used by the sightings in all_plates.json (for display, new sightings also store an epoch timestamp)
+DATE_FORMAT = "%m/%d/%Y"
+TIME_FORMAT = "%H:%M"
+
+#_# AGGREGATE UPDATES #_#
+#########################
+
+def empty_plate_stats():
+
+    # plates: per plate aggregates
+    # count_histogram: {sighting count: number of plates with that count} so the median never needs a full scan
+    return {
+        "plates": {},
+        "count_histogram": {},
+        "total_sightings": 0
+    }
+
+def sighting_timestamp(sighting):
+
+    # sightings logged before the epoch timestamp was stored only have the date and time strings (minute resolution)
+    if "timestamp" in sighting:
+        return sighting["timestamp"]
+
+    return time.mktime(time.strptime(sighting["date"] + " " + sighting["time"], DATE_FORMAT + " " + TIME_FORMAT))
+
+def update_plate_stats(stats, plate, timestamp):
+
+    # add a single sighting of a plate to the aggregates
+    seen = time.strftime(DATE_FORMAT + " " + TIME_FORMAT, time.localtime(timestamp))
+
+    if plate in stats["plates"]:
+        entry = stats["plates"][plate]
+
+        # move the plate from its old count bucket to the new one
+        old_count = str(entry["count"])
+        stats["count_histogram"][old_count] -= 1
+        if stats["count_histogram"][old_count] == 0:
+            del stats["count_histogram"][old_count]
+
+        entry["count"] += 1
+
+        if timestamp < entry["first_ts"]:
+            entry["first_ts"] = timestamp
+            entry["first_seen"] = seen
+
+        if timestamp >= entry["last_ts"]:
+            entry["last_ts"] = timestamp
+            entry["last_seen"] = seen
+    else:
+        entry = {
+            "count": 1,
+            "first_ts": timestamp,
+            "first_seen": seen,
+            "last_ts": timestamp,
+            "last_seen": seen
+        }
+        stats["plates"][plate] = entry
+
+    new_count = str(entry["count"])
+    stats["count_histogram"][new_count] = stats["count_histogram"].get(new_count, 0) + 1
+    stats["total_sightings"] += 1
+
+def rebuild_plate_stats(all_plates):
+
+    # build the aggregates from the full history (only needed when plate_stats.json is missing)
+    stats = empty_plate_stats()
+
+    for plate, detections in all_plates.items():
+        for detection in detections:
+            update_plate_stats(stats, plate, sighting_timestamp(detection))
+
+    return stats
+
+#^# AGGREGATE UPDATES #^#
+#########################
+
+#_# RISK LEVEL #_#
+##################
+
+def detection_mean(stats):
+
+    if not stats["plates"]:
+        return 0
+
+    return stats["total_sightings"] / len(stats["plates"])
+
+def detection_median(stats):
+
+    # walk the count histogram in order instead of sorting every plate
+    num_plates = len(stats["plates"])
+    if num_plates == 0:
+        return 0
+
+    # the median is the average of the lower and upper middle values (same as pandas)
+    lower_pos = (num_plates - 1) // 2
+    upper_pos = num_plates // 2
+    lower = upper = None
+
+    seen = 0
+    for count in sorted(stats["count_histogram"], key=int):
+        seen += stats["count_histogram"][count]
+
+        if lower is None and seen > lower_pos:
+            lower = int(count)
+        if seen > upper_pos:
+            upper = int(count)
+            break
+
+    return (lower + upper) / 2
+
+def risk_level(count, mean, median, following=False):
+
+    # a plate that the following engine flagged (see utils/following.py) is always high risk
+    # otherwise the same thresholds as the analysis page has always used
+    if following or count > median:
+        return "High"
+    elif count > mean:
+        return "Medium"
+    else:
+        return "Low"
+
+#^# RISK LEVEL #^#
+##################
+
+#_# PERSISTENCE #_#
+###################
+
+def load_plate_stats(all_plates=None, path=STATS_PATH):
+
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            return json.load(file)
+
+    # backfill from the full history if the aggregates have not been created yet
+    if all_plates is not None:
+        return rebuild_plate_stats(all_plates)
+
+    return empty_plate_stats()
+
+def save_plate_stats(stats, path=STATS_PATH):
+
+    # write to a tmp file first and then replace so the dashboard never reads a half written file
+    with open(path + ".tmp", "w") as file:
+        json.dump(stats, file, separators=(",", ":"))
+
+    os.replace(path + ".tmp", path)
+
+#^# PERSISTENCE #^#
+###################
@@ -0,0 +1,90 @@
+import threading
+import numpy as np
+
+# how much the prediction confidence drops for every frame since the last plate detection
+CONFIDENCE_DECAY = 0.9
+
+# a fresh plate detection is forced once the prediction confidence drops below this
+MIN_CONFIDENCE = 0.5
+
+class PlatePropagator:
+
+    # predicts the plate box of a tracked vehicle between plate detector runs
+    # the plate is stored relative to the vehicle box (as a fraction of its width and height)
+    # so it follows the vehicle box as it moves and scales
+    def __init__(self, interval, min_confidence=MIN_CONFIDENCE):
+        self.interval = interval
+        self.min_confidence = min_confidence
+        self.tracks = {} # veh id: {"rel": (x1, y1, x2, y2), "size": (w, h), "age": frames since detection}
+        self.lock = threading.Lock()
+
+    def predict(self, veh_id, veh_box):
+
+        # return the predicted plate box in vehicle crop coordinates, or None if the plate detector has to run
+        with self.lock:
+            track = self.tracks.get(veh_id)
+            if track is None:
+                return None
+
+            track["age"] += 1
+            if track["age"] >= self.interval:
+                return None
+
+            w, h = box_size(veh_box)
+            w0, h0 = track["size"]
+            if w <= 0 or h <= 0:
+                return None
+
+            # the prediction gets less reliable the longer ago the detection was and the more the vehicle box changed shape
+            size_similarity = min(w / w0, w0 / w) * min(h / h0, h0 / h)
+            confidence = size_similarity * CONFIDENCE_DECAY ** track["age"]
+            if confidence < self.min_confidence:
+                return None
+
+            rx1, ry1, rx2, ry2 = track["rel"]
+            return (int(rx1 * w), int(ry1 * h), int(rx2 * w), int(ry2 * h))
+
+    def update(self, veh_id, veh_box, plate_box):
+
+        # store a fresh detection (or forget the vehicle if no plate was found)
+        with self.lock:
+            w, h = box_size(veh_box)
+            if plate_box is None or w <= 0 or h <= 0:
+                self.tracks.pop(veh_id, None)
+                return
+
+            self.tracks[veh_id] = {
+                "rel": (float(plate_box[0]) / w, float(plate_box[1]) / h, float(plate_box[2]) / w, float(plate_box[3]) / h),
+                "size": (w, h),
+                "age": 0
+            }
+
+    def invalidate(self, veh_id):
+
+        # force a fresh detection on the next frame (e.g. the predicted plate couldn't be read)
+        with self.lock:
+            self.tracks.pop(veh_id, None)
+
+    def prune(self, active_ids):
+
+        # forget the vehicles that are no longer tracked
+        with self.lock:
+            for veh_id in [veh_id for veh_id in self.tracks if veh_id not in active_ids]:
+                del self.tracks[veh_id]
+
+    def clear(self):
+
+        # drop every prediction (the plates are detected again on the next frame)
+        with self.lock:
+            self.tracks.clear()
+
+def box_size(box):
+    return float(box[2]) - float(box[0]), float(box[3]) - float(box[1])
+
+def best_plate_box(plate_boxes, scores):
+
+    # the detection with the highest confidence (see plate_arrays() in utils/detections.py)
+    if len(plate_boxes) == 0:
+        return None
+
+    return plate_boxes[int(np.argmax(scores))]
@@ -0,0 +1,144 @@
+import os
+import struct
+import time
+import numpy as np
+
+# compact binary recording of the detection results so tracking decisions, voting and perm logs can be
+# re-run from it (tools/replay.py) without running the models again
+#
+# file layout (little endian):
+#   header: magic, version, fps, width, height, frame_skip, source path
+#   records: one fixed size record per OCR candidate, so the file can be memory mapped as a numpy array
+#     - a record with veh_id -1 marks every processed frame (also frames without vehicles)
+#     - a vehicle without a plate or without reads still gets one record with the matching flags unset
+
+MAGIC = b"PADR"
+VERSION = 1
+HEADER = struct.Struct("<4sHfIIH256s")
+
+# max plate string length that is kept (longer reads are cut)
+TEXT_SIZE = 16
+
+RECORD_DTYPE = np.dtype([
+    ("frame", "<u4"), # frame number (CAP_PROP_POS_FRAMES after the read)
+    ("veh_id", "<i4"), # tracker id, -1 for the frame marker
+    ("veh_box", "<i2", 4), # vehicle box in frame coordinates
+    ("plate_box", "<i2", 4), # plate box in vehicle crop coordinates
+    ("plate_index", "u1"), # index of the plate in the vehicle crop
+    ("flags", "u1"), # HAS_PLATE | HAS_READ
+    ("confidence", "u1"), # OCR confidence (%)
+    ("text", "S" + str(TEXT_SIZE)), # raw OCR string
+    ("pad", "V5")
+])
+
+HAS_PLATE = 1
+HAS_READ = 2
+
+RECORDINGS_DIR = "logs/recordings"
+
+#_# WRITING #_#
+###############
+
+class DetectionRecorder:
+
+    # buffers the records of a frame and appends them in one write
+    def __init__(self, path, fps, width, height, frame_skip, source=""):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, fps, width, height, frame_skip, str(source).encode()[:256]))
+        self.records = []
+
+    def frame(self, frame_number):
+
+        # write the records of the previous frame and start a new one
+        self.flush()
+        self.records.append((frame_number, -1, (0, 0, 0, 0), (0, 0, 0, 0), 0, 0, 0, b"", b""))
+
+    def vehicle(self, frame_number, veh_id, veh_box, plates):
+
+        # plates: [(plate box, [(box, string, confidence)] from easyocr)]
+        veh_box = tuple(int(v) for v in veh_box[:4])
+
+        if not plates:
+            self.records.append((frame_number, veh_id, veh_box, (0, 0, 0, 0), 0, 0, 0, b"", b""))
+
+        for plate_index, (plate_box, character_results) in enumerate(plates):
+            plate_box = tuple(int(v) for v in plate_box[:4])
+
+            if not character_results:
+                self.records.append((frame_number, veh_id, veh_box, plate_box, plate_index, HAS_PLATE, 0, b"", b""))
+
+            for character in character_results:
+                self.records.append((frame_number, veh_id, veh_box, plate_box, plate_index, HAS_PLATE | HAS_READ,
+                                     int(character[2] * 100), character[1].encode()[:TEXT_SIZE], b""))
+
+    def flush(self):
+
+        if self.records:
+            self.file.write(np.array(self.records, dtype=RECORD_DTYPE).tobytes())
+            self.records = []
+
+    def close(self):
+
+        self.flush()
+        self.file.close()
+
+def new_recording_path():
+    return os.path.join(RECORDINGS_DIR, time.strftime("%Y%m%d_%H%M%S") + ".padr")
+
+#^# WRITING #^#
+###############
+
+#_# READING #_#
+###############
+
+def load_recording(path):
+
+    # returns the header values and the records memory mapped as a numpy structured array
+    with open(path, "rb") as file:
+        magic, version, fps, width, height, frame_skip, source = HEADER.unpack(file.read(HEADER.size))
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(path + " is not a detection recording (version " + str(VERSION) + ")")
+
+    header = {"fps": fps, "width": width, "height": height, "frame_skip": frame_skip, "source": source.rstrip(b"\0").decode()}
+
+    # an interrupted recording can end with a partial record, which is ignored
+    num_records = (os.path.getsize(path) - HEADER.size) // RECORD_DTYPE.itemsize
+    if num_records == 0:
+        return header, np.zeros(0, dtype=RECORD_DTYPE)
+
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(num_records,))
+    return header, records
+
+def recording_frames(records):
+
+    # rebuild the per frame results in the format of utils.sharding.stitch_shards
+    # [(frame number, [(veh id, vehicle box, plate box or None, [(plate string, confidence)])])]
+    frames = []
+    vehicles = {}
+
+    for record in records.tolist():
+        frame_number, veh_id, veh_box, plate_box, plate_index, flags, confidence, text, pad = record
+
+        if veh_id == -1:
+            vehicles = {}
+            frames.append((frame_number, vehicles))
+            continue
+
+        # every plate of the vehicle overwrites the previous one (like the plate_track.json of the live pipeline)
+        vehicle = vehicles.setdefault(veh_id, [tuple(int(v) for v in veh_box), None, []])
+        if flags & HAS_PLATE:
+            vehicle[1] = tuple(int(v) for v in plate_box)
+        if flags & HAS_READ:
+            vehicle[2].append((text.decode(), confidence))
+
+    return [(frame_number, [(veh_id, vehicle[0], vehicle[1], vehicle[2]) for veh_id, vehicle in vehicles.items()])
+            for frame_number, vehicles in frames]
+
+#^# READING #^#
+###############
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import shutil
+import threading
+import cv2
+from utils.plate_stats import sighting_timestamp, detection_mean, detection_median, risk_level
+from utils.sighting_history import current_all_plates, current_plate_stats
+from utils.segment_store import perm_store, read_media, media_size, delete_media, SEGMENT_SIZE
+
+PERM_DIR = "logs/perm"
+STATE_PATH = "logs/perm/retention.json"
+
+# default retention settings (0 disables the limit)
+DEFAULT_CONFIG = {
+    "budget_mb": 0, # maximum size of the perm media
+    "max_age_days": 0, # remove media older than this
+    "transcode_after_days": 0, # shrink clips older than this
+    "interval_s": 60 # how often the background worker runs
+}
+
+# media files of a sighting in the order they are evicted (largest first)
+# the sighting itself stays in all_plates.json so it is still counted on the Analysis page
+MEDIA_FILES = ["video.mp4", "cropped_vehicle.jpg", "cropped_plate.jpg"]
+
+# eviction order of the risk levels (lowest risk is evicted first)
+RISK_ORDER = {"Low": 0, "Medium": 1, "High": 2}
+
+# scale applied to the frame size when transcoding an older clip
+TRANSCODE_SCALE = 0.5
+
+def retention_config(session_state):
+
+    # build the retention config from the values set on the settings page
+    return {
+        "budget_mb": session_state.get('retention_budget_mb', 0),
+        "max_age_days": session_state.get('retention_max_age_days', 0),
+        "transcode_after_days": session_state.get('retention_transcode_days', 0)
+    }
+
+#_# STATE #_#
+#############
+
+def load_state():
+
+    # the retention state is only written by the retention worker
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, "r") as file:
+            return json.load(file)
+
+    return {"transcoded": [], "evicted_bytes": 0, "last_run": None}
+
+def save_state(state):
+
+    with open(STATE_PATH + ".tmp", "w") as file:
+        json.dump(state, file)
+
+    os.replace(STATE_PATH + ".tmp", STATE_PATH)
+
+#^# STATE #^#
+#############
+
+#_# SPACE USAGE #_#
+###################
+
+def sighting_media_size(log_id):
+
+    # size in bytes of the media that is still stored for a sighting
+    return sum(media_size("/perm/" + log_id + "/" + name) for name in MEDIA_FILES)
+
+def get_usage_report(config=None):
+
+    # report the space used by the perm media and the disk the logs are on
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+
+    # media appended to the segment store plus the media files of logs created before it
+    store = perm_store()
+    used = store.disk_size()
+    log_ids = set(key.split("/")[2] for key in store.keys("/perm/"))
+
+    if os.path.exists(PERM_DIR):
+        for entry in os.scandir(PERM_DIR):
+            if entry.is_dir() and entry.name != "segments":
+                used += sighting_media_size(entry.name)
+                log_ids.add(entry.name)
+
+    num_logs = len(log_ids)
+
+    disk = shutil.disk_usage(PERM_DIR if os.path.exists(PERM_DIR) else ".")
+    state = load_state() if os.path.exists(STATE_PATH) else {"evicted_bytes": 0, "last_run": None, "transcoded": []}
+
+    return {
+        "media_mb": used / (1024 ** 2),
+        "budget_mb": config["budget_mb"],
+        "num_logs": num_logs,
+        "disk_free_mb": disk.free / (1024 ** 2),
+        "disk_total_mb": disk.total / (1024 ** 2),
+        "evicted_mb": state["evicted_bytes"] / (1024 ** 2),
+        "transcoded": len(state["transcoded"]),
+        "last_run": state["last_run"]
+    }
+
+#^# SPACE USAGE #^#
+###################
+
+#_# EVICTION #_#
+################
+
+def load_sightings():
+
+    # list every sighting with its plate, timestamp and risk level
+    # returns None if a file of the history is being written at the same time (try again on the next run)
+    try:
+        all_plates = current_all_plates()
+        stats = current_plate_stats()
+    except json.JSONDecodeError:
+        return None
+
+    mean = detection_mean(stats)
+    median = detection_median(stats)
+    risk = {plate: risk_level(entry["count"], mean, median, entry.get("following", False)) for plate, entry in stats["plates"].items()}
+
+    sightings = []
+    for plate, detections in all_plates.items():
+        for detection in detections:
+            sightings.append({
+                "plate": plate,
+                "log_id": detection["log_id"],
+                "timestamp": sighting_timestamp(detection),
+                "risk": risk.get(plate, "Low")
+            })
+
+    return sightings
+
+def evict_media(log_id, names):
+
+    # delete the given media of a sighting and return the number of bytes released
+    return sum(delete_media("/perm/" + log_id + "/" + name) for name in names)
+
+def transcode_clip(log_id, scale=TRANSCODE_SCALE):
+
+    # re-encode a clip at a lower resolution to reduce its bitrate
+    media_path = "/perm/" + log_id + "/video.mp4"
+    vid_bytes = read_media(media_path)
+
+    if vid_bytes is None:
+        return 0
+
+    # opencv can only decode and encode files, so the clip goes through two tmp files
+    path = os.path.join(PERM_DIR, "transcode_in.mp4")
+    tmp_path = os.path.join(PERM_DIR, "transcode_out.mp4")
+
+    with open(path, "wb") as file:
+        file.write(vid_bytes)
+
+    vid = cv2.VideoCapture(path)
+    fps = vid.get(cv2.CAP_PROP_FPS)
+    width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH) * scale)
+    height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT) * scale)
+
+    out = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+    while True:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        out.write(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+
+    vid.release()
+    out.release()
+
+    # only replace the original clip if the smaller one was written
+    freed = 0
+    if os.path.exists(tmp_path) and 0 < os.path.getsize(tmp_path) < len(vid_bytes):
+        freed = len(vid_bytes) - os.path.getsize(tmp_path)
+
+        # older logs keep their media as files, newer logs supersede the entry in the segment store
+        if os.path.exists("logs" + media_path):
+            os.replace(tmp_path, "logs" + media_path)
+        else:
+            with open(tmp_path, "rb") as file:
+                perm_store().put(media_path, file.read())
+
+    for tmp in [path, tmp_path]:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return freed
+
+def run_retention(config=None):
+
+    # apply the age limit, transcode older clips and then evict media until the budget is met
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+
+    sightings = load_sightings()
+    if sightings is None:
+        return None
+
+    state = load_state()
+    now = time.time()
+    freed = 0
+
+    # remove all media older than the age limit
+    if config["max_age_days"] > 0:
+        cutoff = now - config["max_age_days"] * 86400
+        for sighting in sightings:
+            if sighting["timestamp"] < cutoff:
+                freed += evict_media(sighting["log_id"], MEDIA_FILES)
+
+    # shrink older clips that haven't been transcoded yet
+    if config["transcode_after_days"] > 0:
+        cutoff = now - config["transcode_after_days"] * 86400
+        transcoded = set(state["transcoded"])
+        for sighting in sightings:
+            if sighting["timestamp"] < cutoff and sighting["log_id"] not in transcoded:
+                freed += transcode_clip(sighting["log_id"])
+                transcoded.add(sighting["log_id"])
+        state["transcoded"] = sorted(transcoded)
+
+    # evict the lowest risk, oldest media first until the perm media fits in the budget
+    # videos are evicted from every sighting before any of the cropped images
+    if config["budget_mb"] > 0:
+        budget = config["budget_mb"] * (1024 ** 2)
+        used = sum(sighting_media_size(sighting["log_id"]) for sighting in sightings)
+        order = sorted(sightings, key=lambda sighting: (RISK_ORDER[sighting["risk"]], sighting["timestamp"]))
+
+        for names in [MEDIA_FILES[:1], MEDIA_FILES[1:]]:
+            for sighting in order:
+                if used <= budget:
+                    break
+                evicted = evict_media(sighting["log_id"], names)
+                used -= evicted
+                freed += evicted
+
+    # rewrite mostly dead segments so their space is reclaimed in whole segments
+    # (compacting also rewrites the whole index, so only after this run removed media or once a segment worth is dead)
+    store = perm_store()
+    if freed > 0 or store.dead_bytes() >= SEGMENT_SIZE:
+        store.compact()
+
+    state["evicted_bytes"] += freed
+    state["last_run"] = time.strftime("%m/%d/%Y %H:%M")
+    save_state(state)
+
+    return freed
+
+#^# EVICTION #^#
+################
+
+#_# BACKGROUND WORKER #_#
+#########################
+
+# the worker lives at module level so it survives streamlit reruns (only one per process)
+_worker = None
+_worker_config = dict(DEFAULT_CONFIG)
+_worker_lock = threading.Lock()
+
+def _retention_loop():
+
+    while True:
+        with _worker_lock:
+            config = dict(_worker_config)
+
+        try:
+            run_retention(config)
+        except Exception as e:
+            print("Retention error: " + str(e))
+
+        time.sleep(config["interval_s"])
+
+def start_retention_worker(config):
+
+    # start the background worker once and update its settings on every later call
+    global _worker
+
+    with _worker_lock:
+        _worker_config.update(config)
+
+        # nothing to do if every limit is disabled
+        if not (_worker_config["budget_mb"] or _worker_config["max_age_days"] or _worker_config["transcode_after_days"]):
+            return
+
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_retention_loop, daemon=True)
+            _worker.start()
+
+#^# BACKGROUND WORKER #^#
+#########################
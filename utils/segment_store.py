@@ -0,0 +1,323 @@
+import os
+import json
+import threading
+
+# segments are closed and a new one is started once they reach this size
+SEGMENT_SIZE = 64 * (1024 ** 2)
+
+# closed segments with less than this share of live bytes are rewritten by compact()
+COMPACT_RATIO = 0.5
+
+PERM_STORE_DIR = "logs/perm/segments"
+TMP_STORE_DIR = "logs/tmp/segments"
+
+#_# SEGMENT STORE #_#
+#####################
+
+class SegmentStore:
+
+    # append-only container for small media files
+    # blobs are appended to large segment files (segment_<n>.seg) and located through an append-only index
+    # each line of index.jsonl is {"k": key, "s": segment, "o": offset, "n": length} or {"k": key, "d": 1} for a delete
+    # space is only reclaimed in whole segments (see compact)
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+
+        self.entries = {} # key: [segment, offset, length]
+        self.live_bytes = {} # segment: bytes that are still referenced
+        self.index_offset = 0 # how much of index.jsonl has been read
+        self.index_inode = None
+        self.active = None # open file of the segment being appended to
+        self.active_segment = 0
+        self.active_size = 0
+
+    def _refresh(self):
+
+        # catch up with the index on disk (handles the logs being cleared by another page)
+        if not os.path.exists(self.index_path):
+            if self.entries or self.active is not None:
+                self._close_active()
+                self._reset()
+            return
+
+        stat = os.stat(self.index_path)
+
+        # the index was replaced (cleared or compacted) so replay it from the start
+        if stat.st_ino != self.index_inode or stat.st_size < self.index_offset:
+            self._close_active()
+            self._reset()
+            self.index_inode = stat.st_ino
+
+        if stat.st_size == self.index_offset:
+            return
+
+        with open(self.index_path, "r") as file:
+            file.seek(self.index_offset)
+            for line in file:
+
+                # stop at a partially written last line (crash while appending)
+                if not line.endswith("\n"):
+                    break
+
+                self.index_offset += len(line.encode())
+                self._apply(json.loads(line))
+
+    def _apply(self, record):
+
+        # replace or remove the entry of a key and keep the live byte count of each segment
+        old = self.entries.pop(record["k"], None)
+        if old is not None:
+            self.live_bytes[old[0]] -= old[2]
+
+        if not record.get("d"):
+            self.entries[record["k"]] = [record["s"], record["o"], record["n"]]
+            self.live_bytes[record["s"]] = self.live_bytes.get(record["s"], 0) + record["n"]
+            self.active_segment = max(self.active_segment, record["s"])
+
+    def _append_index(self, record):
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with open(self.index_path, "a") as file:
+            file.write(line)
+
+        if self.index_inode is None:
+            self.index_inode = os.stat(self.index_path).st_ino
+
+        self.index_offset += len(line.encode())
+        self._apply(record)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "segment_" + str(segment) + ".seg")
+
+    def _close_active(self):
+
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+    def _open_active(self, size):
+
+        # start a new segment if the current one would grow past the segment size
+        if self.active is not None and self.active_size + size > self.segment_size and self.active_size > 0:
+            self._close_active()
+            self.active_segment += 1
+
+        if self.active is None:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            self.active = open(self._segment_path(self.active_segment), "ab")
+            self.active_size = self.active.tell()
+
+            if self.active_size > 0 and self.active_size + size > self.segment_size:
+                self.active.close()
+                self.active_segment += 1
+                self.active = open(self._segment_path(self.active_segment), "ab")
+                self.active_size = 0
+
+    def put(self, key, data):
+
+        # append the data to the active segment and then record where it is
+        with self.lock:
+            self._refresh()
+            self._open_active(len(data))
+
+            offset = self.active_size
+            self.active.write(data)
+            self.active.flush()
+            self.active_size += len(data)
+
+            self._append_index({"k": key, "s": self.active_segment, "o": offset, "n": len(data)})
+
+    def get(self, key):
+
+        with self.lock:
+            self._refresh()
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            segment, offset, length = entry
+            with open(self._segment_path(segment), "rb") as file:
+                file.seek(offset)
+                return file.read(length)
+
+    def exists(self, key):
+
+        with self.lock:
+            self._refresh()
+            return key in self.entries
+
+    def size(self, key):
+
+        with self.lock:
+            self._refresh()
+            entry = self.entries.get(key)
+            return entry[2] if entry is not None else 0
+
+    def keys(self, prefix=""):
+
+        with self.lock:
+            self._refresh()
+            return [key for key in self.entries if key.startswith(prefix)]
+
+    def delete(self, key):
+
+        # deleting only writes a tombstone, the bytes are reclaimed with the whole segment
+        with self.lock:
+            self._refresh()
+            if key not in self.entries:
+                return 0
+
+            length = self.entries[key][2]
+            self._append_index({"k": key, "d": 1})
+            self.reclaim()
+            return length
+
+    def delete_prefix(self, prefix):
+
+        with self.lock:
+            freed = 0
+            for key in self.keys(prefix):
+                freed += self.delete(key)
+            return freed
+
+    def disk_size(self):
+
+        # bytes used on disk by all segment files
+        if not os.path.exists(self.directory):
+            return 0
+
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".seg"))
+
+    def dead_bytes(self):
+
+        # bytes of the segment files that no entry points to anymore (deleted or superseded media)
+        with self.lock:
+            self._refresh()
+            return max(self.disk_size() - sum(self.live_bytes.values()), 0)
+
+    def reclaim(self):
+
+        # delete closed segments that no longer hold any live entries and return the bytes freed
+        with self.lock:
+            freed = 0
+            for segment, live in list(self.live_bytes.items()):
+                if live == 0 and segment != self.active_segment:
+                    path = self._segment_path(segment)
+                    if os.path.exists(path):
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+                    del self.live_bytes[segment]
+
+            return freed
+
+    def compact(self, ratio=COMPACT_RATIO):
+
+        # rewrite the live entries of mostly dead closed segments into the active segment so they can be reclaimed
+        with self.lock:
+            self._refresh()
+
+            # close the active segment too if most of it is dead so it can be compacted like the others
+            active_path = self._segment_path(self.active_segment)
+            if os.path.exists(active_path) and self.live_bytes.get(self.active_segment, 0) < os.path.getsize(active_path) * ratio:
+                self._close_active()
+                self.active_segment += 1
+
+            for segment, live in list(self.live_bytes.items()):
+                path = self._segment_path(segment)
+                if segment == self.active_segment or not os.path.exists(path):
+                    continue
+
+                if live < os.path.getsize(path) * ratio:
+                    for key in [key for key, entry in self.entries.items() if entry[0] == segment]:
+                        self.put(key, self.get(key))
+
+            freed = self.reclaim()
+
+            # rewrite the index without the superseded records so it doesn't grow forever
+            with open(self.index_path + ".tmp", "w") as file:
+                for key, (segment, offset, length) in self.entries.items():
+                    file.write(json.dumps({"k": key, "s": segment, "o": offset, "n": length}, separators=(",", ":")) + "\n")
+
+            os.replace(self.index_path + ".tmp", self.index_path)
+            stat = os.stat(self.index_path)
+            self.index_inode = stat.st_ino
+            self.index_offset = stat.st_size
+
+            return freed
+
+#^# SEGMENT STORE #^#
+#####################
+
+#_# MEDIA ACCESS #_#
+####################
+
+# one store per directory and process so every streamlit session shares the same index
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(directory):
+
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = SegmentStore(directory)
+        return _stores[directory]
+
+def close_stores():
+
+    # close the active segments and forget the stores of this process
+    # (their paths are relative to the working directory, the next call opens them again)
+    with _stores_lock:
+        for store in _stores.values():
+            with store.lock:
+                store._close_active()
+        _stores.clear()
+
+def perm_store():
+    return get_store(PERM_STORE_DIR)
+
+def tmp_store():
+    return get_store(TMP_STORE_DIR)
+
+# the media paths in all_plates.json (e.g. /perm/<uuid>/video.mp4) are used as the keys of the perm store
+# logs created before the segment store still have their media as files under logs/
+
+def read_media(path):
+
+    # return the bytes of a logged media path or None if it was removed
+    if os.path.exists("logs" + path):
+        with open("logs" + path, "rb") as file:
+            return file.read()
+
+    return perm_store().get(path)
+
+def media_size(path):
+
+    if os.path.exists("logs" + path):
+        return os.path.getsize("logs" + path)
+
+    return perm_store().size(path)
+
+def delete_media(path):
+
+    # remove a logged media path and return its size
+    if os.path.exists("logs" + path):
+        size = os.path.getsize("logs" + path)
+        os.remove("logs" + path)
+        return size
+
+    return perm_store().delete(path)
+
+#^# MEDIA ACCESS #^#
+####################
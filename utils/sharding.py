@@ -0,0 +1,242 @@
+import os
+import multiprocessing
+import cv2
+import torch
+from ultralytics import YOLO
+from utils.ocr import load_ocr_engine, read_plate
+from utils.perm_log import MIN_PLATE_CHARS, MIN_PLATE_CONFIDENCE
+from utils.detections import vehicle_arrays, tracked_vehicles, plate_arrays, crop
+
+# each shard starts this many seconds before the previous one ends so the tracker is warmed up at the boundary
+SHARD_OVERLAP_S = 5
+
+# minimum mean IoU over the overlapping frames to treat two tracks from neighbouring shards as the same vehicle
+STITCH_IOU = 0.5
+
+#_# SHARD PLANNING #_#
+######################
+
+def plan_shards(total_frames, num_shards, overlap_frames):
+
+    # split [0, total_frames) into equal shards, each one starting overlap_frames before the previous one ends
+    length = -(-total_frames // num_shards) # ceil
+    shards = []
+
+    for i in range(num_shards):
+        start = i * length
+        end = min(total_frames, (i + 1) * length)
+        if start >= end:
+            break
+
+        shards.append((max(0, start - overlap_frames) if i > 0 else 0, end, start))
+
+    # (first frame to process, last frame (exclusive), first frame this shard owns)
+    return shards
+
+def sampled_frames(start, end, frame_skip):
+
+    # the live loop reads every (frame_skip + 1)th frame starting at frame_skip
+    # using one global grid means overlapping shards process exactly the same frames
+    step = frame_skip + 1
+    first = frame_skip + max(0, -(-(start - frame_skip) // step)) * step
+    return range(first, end, step)
+
+#^# SHARD PLANNING #^#
+######################
+
+#_# SHARD WORKER #_#
+####################
+
+def _init_worker(num_threads, engine):
+
+    # every worker process loads its own vehicle, plate and character models once
+    global vehicle_detector, plate_detector, character_detector, ocr_engine
+
+    # split the cores between the workers instead of every worker using all of them
+    torch.set_num_threads(num_threads)
+
+    vehicle_detector = YOLO('models/yolov9c.pt')
+    plate_detector = YOLO('models/license_plate.pt')
+    ocr_engine = engine
+    character_detector = load_ocr_engine(engine)
+
+def process_shard(job):
+
+    # run the detection pipeline over one shard and return the per frame results
+    # [(frame number, [(track id, vehicle box, plate box relative to the vehicle, [(plate string, confidence)])])]
+    stream_path, start, end, frame_skip = job
+
+    # the vehicle detector holds the tracker state, so every shard starts with a fresh tracker
+    # (the tracker is created on the first track() call of the worker)
+    if vehicle_detector.predictor is not None and getattr(vehicle_detector.predictor, "trackers", None):
+        vehicle_detector.predictor.trackers[0].reset()
+
+    stream = cv2.VideoCapture(stream_path)
+    stream.set(cv2.CAP_PROP_POS_FRAMES, start)
+    position = start
+
+    records = []
+
+    for frame_index in sampled_frames(start, end, frame_skip):
+
+        # decode the skipped frames with grab() instead of seeking on every frame
+        while position < frame_index:
+            stream.grab()
+            position += 1
+
+        ret, frame = stream.read()
+        position += 1
+        if not ret:
+            break
+
+        veh_results = vehicle_detector.track(frame, classes=[2,3,5,7], persist=True, verbose=False)
+        vehicles = []
+
+        # skip vehicles that aren't tracked yet (see utils/detections.py)
+        for veh_id, veh_plot in tracked_vehicles(vehicle_arrays(veh_results, frame.shape)):
+
+            veh_plot = tuple(veh_plot.tolist())
+            veh_crop = crop(frame, veh_plot)
+
+            plate_box = None
+            reads = []
+
+            plate_results = plate_detector(veh_crop, classes=0, verbose=False)
+            for plate_plot in plate_arrays(plate_results[0].boxes.data, veh_crop.shape)["boxes"].tolist():
+                plate_box = tuple(plate_plot)
+
+                plate_crop = cv2.cvtColor(crop(veh_crop, plate_plot), cv2.COLOR_BGR2GRAY)
+                character_results = read_plate(character_detector, plate_crop, ocr_engine)
+                reads += [(character[1], int(character[2] * 100)) for character in character_results]
+
+            vehicles.append((veh_id, veh_plot, plate_box, reads))
+
+        # the frame number matches CAP_PROP_POS_FRAMES after the read in the live loop
+        records.append((frame_index + 1, vehicles))
+
+    stream.release()
+    return records
+
+#^# SHARD WORKER #^#
+####################
+
+#_# STITCHING #_#
+#################
+
+def box_iou(a, b):
+
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+
+    return inter / union if union > 0 else 0
+
+def stitch_shards(shard_records, shard_owned_from):
+
+    # merge the shard results into one list of frames with globally unique track ids
+    # the overlap of every shard is only used to match its tracks to the previous shard's (the previous shard owns those frames)
+    stitched = []
+    next_id = 1
+    previous = {} # frame number: [(global id, box)] of the previous shard
+
+    for records, owned_from in zip(shard_records, shard_owned_from):
+
+        # sum the IoU of every pair of tracks over the overlapping frames
+        pair_iou = {}
+        overlap_frames = {}
+        for frame_number, vehicles in records:
+            if frame_number in previous:
+                for veh_id, box, plate_box, reads in vehicles:
+                    overlap_frames[veh_id] = overlap_frames.get(veh_id, 0) + 1
+                    for global_id, prev_box in previous[frame_number]:
+                        pair_iou[(veh_id, global_id)] = pair_iou.get((veh_id, global_id), 0) + box_iou(box, prev_box)
+
+        # greedily match the pairs with the highest mean IoU
+        id_map = {}
+        used = set()
+        for (veh_id, global_id), total in sorted(pair_iou.items(), key=lambda pair: -pair[1]):
+            if veh_id in id_map or global_id in used:
+                continue
+            if total / overlap_frames[veh_id] >= STITCH_IOU:
+                id_map[veh_id] = global_id
+                used.add(global_id)
+
+        previous = {}
+        for frame_number, vehicles in records:
+            mapped = []
+            for veh_id, box, plate_box, reads in vehicles:
+
+                # tracks that didn't continue from the previous shard get a new global id
+                if veh_id not in id_map:
+                    id_map[veh_id] = next_id
+                    next_id += 1
+                mapped.append((id_map[veh_id], box, plate_box, reads))
+
+            previous[frame_number] = [(global_id, box) for global_id, box, plate_box, reads in mapped]
+
+            if frame_number > owned_from:
+                stitched.append((frame_number, mapped))
+
+        # ids of the previous shards can't be reused
+        next_id = max([next_id] + [global_id + 1 for global_id in id_map.values()])
+
+    return stitched
+
+def collect_tracks(stitched, min_chars=MIN_PLATE_CHARS, min_confidence=MIN_PLATE_CONFIDENCE):
+
+    # group the stitched frames by track, starting each track at its first loggable plate read (like target_vehicles)
+    # {global id: {"plates": [...], "vehicle_track": {...}, "plate_track": {...}, "frames": [...], "last_frame": n}}
+    tracks = {}
+
+    for frame_number, vehicles in stitched:
+        for veh_id, box, plate_box, reads in vehicles:
+            good_reads = [{"plate": text, "confidence": str(conf)} for text, conf in reads
+                          if len(text) >= min_chars and conf >= min_confidence]
+
+            if veh_id not in tracks and not good_reads:
+                continue
+
+            track = tracks.setdefault(veh_id, {"plates": [], "vehicle_track": {}, "plate_track": {}, "frames": []})
+            track["plates"] += good_reads
+            track["frames"].append(frame_number)
+            track["last_frame"] = frame_number
+            track["vehicle_track"][str(frame_number)] = {"x1": str(box[0]), "y1": str(box[1]), "x2": str(box[2]), "y2": str(box[3])}
+
+            if plate_box is not None:
+                track["plate_track"][str(frame_number)] = {"x1": str(plate_box[0]), "y1": str(plate_box[1]), "x2": str(plate_box[2]), "y2": str(plate_box[3])}
+
+    return tracks
+
+#^# STITCHING #^#
+#################
+
+def run_sharded(stream_path, frame_skip, num_workers, progress=None, ocr_engine="full"):
+
+    # process a video file in overlapping time shards on a process pool and return the stitched tracks
+    stream = cv2.VideoCapture(stream_path)
+    total_frames = int(stream.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = stream.get(cv2.CAP_PROP_FPS)
+    stream.release()
+
+    # use two shards per worker so a slow shard doesn't leave the other workers idle at the end
+    shards = plan_shards(total_frames, num_workers * 2, int(SHARD_OVERLAP_S * fps))
+    jobs = [(stream_path, start, end, frame_skip) for start, end, owned_from in shards]
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    # spawn (not fork) so torch doesn't inherit the parent's thread pools
+    ctx = multiprocessing.get_context("spawn")
+    shard_records = [None] * len(jobs)
+
+    with ctx.Pool(num_workers, initializer=_init_worker, initargs=(threads, ocr_engine)) as pool:
+        for done, (index, records) in enumerate(pool.imap_unordered(_process_indexed_shard, list(enumerate(jobs))), 1):
+            shard_records[index] = records
+            if progress is not None:
+                progress(done, len(jobs))
+
+    stitched = stitch_shards(shard_records, [owned_from for start, end, owned_from in shards])
+    return collect_tracks(stitched)
+
+def _process_indexed_shard(indexed_job):
+    index, job = indexed_job
+    return index, process_shard(job)
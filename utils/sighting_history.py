@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import atexit
+import threading
+from utils.plate_index import load_plate_index, save_plate_index, resolve_plate
+from utils.plate_stats import load_plate_stats, save_plate_stats, update_plate_stats, rebuild_plate_stats, sighting_timestamp, STATS_PATH
+from utils.following import load_following, save_following, rebuild_following
+
+# the sighting history (all_plates.json) and everything derived from it (plate index, plate stats, following windows)
+# are kept in memory by the process that logs the sightings instead of being loaded and rewritten for every sighting
+#
+# a new sighting is appended as one line to the journal next to all_plates.json:
+#   {"seq": 42, "plate": "ABC123", "sighting": {"date": ..., "log_id": ..., ...}}
+# the full files are only written as a snapshot every SNAPSHOT_EVERY sightings (or after SNAPSHOT_INTERVAL_S) and the journal
+# is emptied after every snapshot, so the readers (the Analysis page, retention, the export) only replay a few lines on top
+#
+# the plate stats and the following state store the seq of the last sighting they contain, all_plates.json doesn't have room
+# for it so its sightings are matched by log id (replaying a journal that outlived its snapshot after a crash is harmless)
+
+ALL_PLATES_PATH = "logs/perm/all_plates.json"
+JOURNAL_NAME = "sightings.jsonl"
+
+# write the snapshot after this many sightings or when the last snapshot is this old
+SNAPSHOT_EVERY = 100
+SNAPSHOT_INTERVAL_S = 300
+
+#_# JOURNAL #_#
+###############
+
+def journal_path(path=ALL_PLATES_PATH):
+    return os.path.join(os.path.dirname(path), JOURNAL_NAME)
+
+def read_journal(path=ALL_PLATES_PATH):
+
+    # the sightings appended since the last snapshot (a line that is still being written is skipped)
+    records = []
+    try:
+        with open(journal_path(path), "r") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    except FileNotFoundError:
+        pass
+
+    return records
+
+def load_snapshot(path=ALL_PLATES_PATH):
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def add_to_all_plates(all_plates, record):
+
+    # skip the sightings the snapshot already has
+    detections = all_plates.setdefault(record["plate"], [])
+    if all(detection["log_id"] != record["sighting"]["log_id"] for detection in detections):
+        detections.append(record["sighting"])
+
+def copy_following(stats, following, plates):
+
+    # keep the following score next to the aggregates so the Analysis page can sort and filter on it
+    for plate in plates:
+        if plate in stats["plates"]:
+            stats["plates"][plate]["following_score"] = following.plates[plate]["peak"]
+            stats["plates"][plate]["trips"] = following.plates[plate]["trips"]
+            stats["plates"][plate]["following"] = following.plates[plate]["alerted_trip"] is not None
+
+def add_to_aggregates(stats, following, record):
+
+    # add a sighting to the plate stats and the following windows (unless they already have it)
+    # returns the following result of the sighting or None
+    plate = record["plate"]
+    timestamp = sighting_timestamp(record["sighting"])
+    following_result = None
+
+    if record["seq"] > following.seq:
+        following_result = following.observe(plate, timestamp)
+        following.seq = record["seq"]
+
+    if record["seq"] > stats.get("seq", 0):
+        update_plate_stats(stats, plate, timestamp)
+        stats["seq"] = record["seq"]
+
+    copy_following(stats, following, [plate])
+
+    return following_result
+
+#^# JOURNAL #^#
+###############
+
+#_# READERS #_#
+###############
+
+def current_all_plates(path=ALL_PLATES_PATH):
+
+    # all_plates.json with the sightings of the journal (for the pages and tools that only read the history)
+    all_plates = load_snapshot(path)
+    for record in read_journal(path):
+        add_to_all_plates(all_plates, record)
+
+    return all_plates
+
+def current_plate_stats():
+
+    # the Analysis aggregates with the sightings of the journal
+    records = read_journal()
+
+    # backfill from the full history if the aggregates have not been created yet
+    if not os.path.exists(STATS_PATH):
+        all_plates = current_all_plates()
+        stats = rebuild_plate_stats(all_plates)
+        copy_following(stats, rebuild_following(all_plates), stats["plates"])
+        return stats
+
+    stats = load_plate_stats()
+
+    # the following windows are only loaded if there are sightings the aggregates don't have yet
+    records = [record for record in records if record["seq"] > stats.get("seq", 0)]
+    if records:
+        following, _ = load_following()
+        for record in records:
+            add_to_aggregates(stats, following, record)
+
+    return stats
+
+def history_version():
+
+    # changes with every new sighting and snapshot (cache key of the pages)
+    version = []
+    for path in (ALL_PLATES_PATH, journal_path(), STATS_PATH):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+
+    return tuple(version)
+
+#^# READERS #^#
+###############
+
+#_# WRITER #_#
+##############
+
+class SightingHistory:
+
+    # the history of the process that logs the sightings (the streamlit script, the shards or the replay tool)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load()
+
+    def _signature(self):
+
+        # another process (or Clear Logs) changed the files if this differs from the one after our own last write
+        signature = []
+        for path in (ALL_PLATES_PATH, journal_path()):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+
+        return tuple(signature)
+
+    def load(self):
+
+        # the snapshot with the journal replayed on top, the aggregates are rebuilt if their files are missing
+        records = read_journal()
+        self.all_plates = current_all_plates()
+        self.seq = max([record["seq"] for record in records], default=0)
+
+        stats_rebuilt = not os.path.exists(STATS_PATH)
+        self.stats = load_plate_stats(self.all_plates)
+        if stats_rebuilt:
+            self.stats["seq"] = self.seq
+
+        self.following, following_rebuilt = load_following(self.all_plates)
+        if following_rebuilt:
+            self.following.seq = self.seq
+
+        # all plates if either was just rebuilt from the history
+        if stats_rebuilt or following_rebuilt:
+            copy_following(self.stats, self.following, self.following.plates)
+
+        for record in records:
+            add_to_aggregates(self.stats, self.following, record)
+
+        self.seq = max(self.seq, self.stats.get("seq", 0), self.following.seq)
+
+        # plates of the journal are backfilled into the index
+        self.plate_index = load_plate_index(self.all_plates)
+
+        self.pending = len(records)
+        self.last_snapshot = time.time()
+        self.signature = self._signature()
+
+    def add(self, voted_plate, perm_uuid, timestamp):
+
+        # add a sighting of the voted plate, returns the plate it was attached to, the sighting and its following result
+        with self.lock:
+            if self._signature() != self.signature:
+                self.load()
+
+            date = time.strftime("%m/%d/%Y", time.localtime(timestamp))
+            time_now = time.strftime("%H:%M", time.localtime(timestamp))
+
+            # Attach the sighting to a known plate if the voted plate only differs by an OCR confusion (8/B, 0/O, ...)
+            plate_identity = resolve_plate(self.plate_index, voted_plate, self.all_plates)
+
+            self.seq += 1
+            record = {"seq": self.seq, "plate": plate_identity, "sighting": {
+                "date": date,
+                "time": time_now,
+                "veh_crop_path": f"/perm/{perm_uuid}/cropped_vehicle.jpg",
+                "plate_crop_path": f"/perm/{perm_uuid}/cropped_plate.jpg",
+                "video_path": f"/perm/{perm_uuid}/video.mp4",
+                "log_id": perm_uuid,
+                "read_plate": voted_plate,
+                "timestamp": round(timestamp, 3)
+            }}
+
+            # one line per sighting instead of rewriting the whole history
+            os.makedirs(os.path.dirname(ALL_PLATES_PATH), exist_ok=True)
+            with open(journal_path(), "a") as file:
+                file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+            add_to_all_plates(self.all_plates, record)
+            following_result = add_to_aggregates(self.stats, self.following, record)
+            self.pending += 1
+
+            if self.pending >= SNAPSHOT_EVERY or time.time() - self.last_snapshot >= SNAPSHOT_INTERVAL_S:
+                self._snapshot()
+
+            self.signature = self._signature()
+
+            return plate_identity, record["sighting"], following_result, self.stats["plates"][plate_identity]["count"]
+
+    def _snapshot(self):
+
+        # the aggregates first and all_plates.json last, the journal is only emptied once everything is written
+        save_plate_index(self.plate_index)
+        save_plate_stats(self.stats)
+        save_following(self.following)
+
+        with open(ALL_PLATES_PATH + ".tmp", "w") as file:
+            json.dump(self.all_plates, file, indent=4)
+        os.replace(ALL_PLATES_PATH + ".tmp", ALL_PLATES_PATH)
+
+        open(journal_path(), "w").close()
+
+        self.pending = 0
+        self.last_snapshot = time.time()
+
+    def flush(self, max_age_s=0):
+
+        # write the snapshot if there are unsaved sightings older than max_age_s
+        with self.lock:
+            if self.pending and time.time() - self.last_snapshot >= max_age_s and self._signature() == self.signature:
+                self._snapshot()
+                self.signature = self._signature()
+
+# one history per process (module level so it survives streamlit reruns)
+_history = None
+_history_lock = threading.Lock()
+
+def sighting_history():
+
+    global _history
+
+    with _history_lock:
+        if _history is None:
+            _history = SightingHistory()
+            atexit.register(_history.flush)
+
+        return _history
+
+def flush_history(max_age_s=0):
+
+    # save the sightings of the journal to the full files (at the end of a run, and at exit)
+    if _history is not None:
+        _history.flush(max_age_s)
+
+#^# WRITER #^#
+###############
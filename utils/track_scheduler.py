@@ -0,0 +1,101 @@
+import threading
+
+# spends a per frame time budget for the plate detector and OCR on the vehicles where a read is worth the most
+# the other vehicles are still tracked, drawn and logged, only their plate reads are deferred to a later frame
+
+# a plate is stable once the voted plate stayed the same for this many votes in a row
+STABLE_VOTES = 5
+
+# value of reading a vehicle that already has a stable plate (a vehicle without one counts 1)
+STABLE_WEIGHT = 0.2
+
+# every frame a vehicle waits adds this much to its value so no vehicle is deferred forever
+AGE_WEIGHT = 0.25
+
+# the plate reads of one vehicle are assumed to take this long until they were measured
+DEFAULT_TRACK_MS = 50
+
+# weight of the newest measurement in the cost per vehicle
+COST_SMOOTHING = 0.2
+
+class TrackScheduler:
+
+    # select() ranks the vehicles of a frame and returns the ids that fit in the budget (at least min_tracks)
+    # done() feeds back how long the selected vehicles took, vote() whether their plate is stable yet
+    def __init__(self, budget_ms, min_tracks=1):
+        self.budget_ms = budget_ms
+        self.min_tracks = min_tracks
+        self.cost_ms = DEFAULT_TRACK_MS # smoothed time of the plate reads of one vehicle
+        self.frame_count = 0
+
+        # veh id: {"last_frame": frame the plate was last read, "plate": last voted plate, "streak": votes it stayed the same}
+        self.tracks = {}
+
+        # select() runs on the vehicle stage thread when pipelined, vote() on the main thread
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def _value(self, veh_id, box, frame_area):
+        track = self.tracks.get(veh_id)
+        if track is None:
+            track = {"last_frame": self.frame_count - 1, "plate": None, "streak": 0}
+            self.tracks[veh_id] = track
+
+        # vehicles without a stable plate first
+        priority = STABLE_WEIGHT if track["streak"] >= STABLE_VOTES else 1
+
+        # larger (closer) crops have more readable plates
+        area = max(float(box[2]) - float(box[0]), 0) * max(float(box[3]) - float(box[1]), 0)
+        size = min(area / frame_area, 1) ** 0.5
+
+        # vehicles that waited longer catch up
+        age = 1 + AGE_WEIGHT * (self.frame_count - track["last_frame"])
+
+        return priority * size * age
+
+    def select(self, vehicles, frame_shape):
+
+        # vehicles is a list of (veh id, [x1, y1, x2, y2, ...]), returns the set of ids to read on this frame
+        with self.lock:
+            self.frame_count += 1
+
+            # forget the vehicles that are no longer tracked (with the ids of this frame, when pipelined the main
+            # thread is a few frames behind and would drop the vehicles that just appeared)
+            active_ids = set(veh_id for veh_id, _ in vehicles)
+            for veh_id in [veh_id for veh_id in self.tracks if veh_id not in active_ids]:
+                del self.tracks[veh_id]
+            frame_area = max(frame_shape[0] * frame_shape[1], 1)
+
+            ranked = sorted(vehicles, key=lambda vehicle: self._value(vehicle[0], vehicle[1], frame_area), reverse=True)
+            count = max(self.min_tracks, int(self.budget_ms // max(self.cost_ms, 1e-3)))
+
+            selected = [veh_id for veh_id, _ in ranked[:count]]
+            for veh_id in selected:
+                self.tracks[veh_id]["last_frame"] = self.frame_count
+
+            return set(selected)
+
+    def done(self, elapsed_ms, count):
+
+        # the plate reads of count vehicles took elapsed_ms
+        if count == 0:
+            return
+
+        with self.lock:
+            self.cost_ms += COST_SMOOTHING * (elapsed_ms / count - self.cost_ms)
+
+    def vote(self, veh_id, voted_plate):
+
+        # called once per new vote (a read that was added to the plates of the vehicle)
+        with self.lock:
+            track = self.tracks.setdefault(veh_id, {"last_frame": self.frame_count, "plate": None, "streak": 0})
+            track["streak"] = track["streak"] + 1 if voted_plate == track["plate"] else 1
+            track["plate"] = voted_plate
+
+    def clear(self):
+
+        # forget the waiting times and votes of every vehicle (the cost per vehicle is kept)
+        with self.lock:
+            self.tracks.clear()
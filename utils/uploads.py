@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import cv2
+
+# uploaded videos are stored once per content hash so reruns and re-uploads reuse the same file
+UPLOAD_DIR = os.path.join(tempfile.gettempdir(), "pursuit-alert-uploads")
+
+# size of the chunks the upload is hashed and written in
+CHUNK_SIZE = 8 * (1024 ** 2)
+
+# uploads that haven't been used for this long are removed (the current one is always kept)
+MAX_UPLOAD_AGE_S = 24 * 3600
+
+# at most this many uploads are kept on disk
+MAX_UPLOADS = 3
+
+def save_upload(uploaded_file):
+
+    # stream the upload to disk in chunks while hashing it and return the path of the stored file
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    partial_path = os.path.join(UPLOAD_DIR, "upload_" + str(os.getpid()) + "_" + str(time.time_ns()) + ".part")
+    sha256 = hashlib.sha256()
+
+    uploaded_file.seek(0)
+    with open(partial_path, "wb") as file:
+        while True:
+            chunk = uploaded_file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            file.write(chunk)
+
+    # keep the existing copy if the same video was uploaded before
+    path = os.path.join(UPLOAD_DIR, sha256.hexdigest() + extension)
+    if os.path.exists(path):
+        os.remove(partial_path)
+    else:
+        os.replace(partial_path, path)
+
+    touch_upload(path)
+    return path
+
+def touch_upload(path):
+
+    # mark the upload as used so the cleanup keeps it
+    if os.path.exists(path):
+        os.utime(path)
+
+def probe_video(path):
+
+    # return the fps, resolution and frame count of a stored upload
+    # the result is cached next to the upload so the video is only opened once
+    meta_path = os.path.splitext(path)[0] + ".json"
+
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as file:
+            return json.load(file)
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+
+    metadata = {
+        "fps": cap.get(cv2.CAP_PROP_FPS),
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    }
+    cap.release()
+
+    with open(meta_path, "w") as file:
+        json.dump(metadata, file)
+
+    return metadata
+
+def cleanup_uploads(keep=None, max_age_s=MAX_UPLOAD_AGE_S, max_uploads=MAX_UPLOADS):
+
+    # remove stale uploads (and their cached metadata) and interrupted partial writes, newest uploads are kept
+    if not os.path.exists(UPLOAD_DIR):
+        return 0
+
+    now = time.time()
+    uploads = []
+    freed = 0
+
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.name.endswith(".json"):
+            continue
+
+        # partial files of uploads that are still being written are only a few seconds old
+        if entry.name.endswith(".part"):
+            if now - entry.stat().st_mtime > 3600:
+                freed += entry.stat().st_size
+                os.remove(entry.path)
+            continue
+
+        uploads.append((entry.stat().st_mtime, entry.path, entry.stat().st_size))
+
+    uploads.sort(reverse=True)
+    for index, (mtime, path, size) in enumerate(uploads):
+        if path == keep:
+            continue
+
+        if index >= max_uploads or now - mtime > max_age_s:
+            os.remove(path)
+            freed += size
+
+            meta_path = os.path.splitext(path)[0] + ".json"
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+
+    return freed
@@ -0,0 +1,226 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# tracker layer between the vehicle detector and detect_vehicles()
+# every tracker takes the detections of a frame as an array of [x1, y1, x2, y2, confidence, class]
+# and returns the tracked vehicles as [x1, y1, x2, y2, id, confidence, class] (the same columns as YOLO.track())
+
+TRACKERS = ["bytetrack", "sort"]
+
+#_# SORT TRACKER #_#
+####################
+
+# constant velocity kalman filter over [center x, center y, area, aspect ratio] (as in the SORT paper)
+# state: [cx, cy, s, r, vcx, vcy, vs]
+KF_F = np.eye(7)
+KF_F[0, 4] = KF_F[1, 5] = KF_F[2, 6] = 1
+KF_H = np.eye(4, 7)
+KF_Q = np.diag([1, 1, 1, 1, 0.01, 0.01, 0.0001])
+KF_R = np.diag([1, 1, 10, 10])
+KF_P0 = np.diag([10, 10, 10, 10, 10000, 10000, 10000])
+
+def boxes_to_z(boxes):
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    return np.stack([boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / np.maximum(h, 1e-6)], axis=1)
+
+def x_to_boxes(x):
+    w = np.sqrt(np.maximum(x[:, 2] * x[:, 3], 0))
+    h = np.where(w > 0, x[:, 2] / np.maximum(w, 1e-6), 0)
+    return np.stack([x[:, 0] - w / 2, x[:, 1] - h / 2, x[:, 0] + w / 2, x[:, 1] + h / 2], axis=1)
+
+def iou_matrix(a, b):
+
+    # intersection over union of every box in a (N, 4) with every box in b (M, 4)
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0)
+
+class SortTracker:
+
+    # SORT with every track in one set of numpy arrays, so predicting and matching all tracks is a few array operations
+    # predict() moves the tracks on a frame without detections (see IntervalTracker)
+    def __init__(self, max_age=30, min_hits=3, iou_threshold=0.3):
+        self.max_age = max_age # frames a track is kept without a matching detection
+        self.min_hits = min_hits # detections before a track is reported
+        self.iou_threshold = iou_threshold
+        self.next_id = 1 # id 0 means "not tracked yet" in detect_vehicles()
+        self.frame_count = 0
+
+        self.x = np.zeros((0, 7)) # kalman state
+        self.p = np.zeros((0, 7, 7)) # kalman covariance
+        self.ids = np.zeros(0, dtype=int)
+        self.hits = np.zeros(0, dtype=int)
+        self.since_update = np.zeros(0, dtype=int)
+        self.conf = np.zeros(0)
+        self.cls = np.zeros(0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _predict(self):
+
+        # don't let the area go negative
+        self.x[self.x[:, 2] + self.x[:, 6] <= 0, 6] = 0
+
+        self.x = self.x @ KF_F.T
+        self.p = KF_F @ self.p @ KF_F.T + KF_Q
+        self.since_update += 1
+        self.frame_count += 1
+
+    def _output(self, mask):
+        boxes = x_to_boxes(self.x[mask])
+        return np.column_stack([boxes, self.ids[mask], self.conf[mask], self.cls[mask]]).reshape(-1, 7)
+
+    def predict(self):
+
+        # move every track one frame ahead without a detection and return the confirmed tracks
+        self._predict()
+        self._remove_old()
+        return self._output(self.hits >= self.min_hits)
+
+    def update(self, detections, frame=None):
+
+        # match the detections to the predicted tracks, correct the matched tracks and start tracks for the rest
+        detections = np.asarray(detections, dtype=float).reshape(-1, 6)
+        self._predict()
+
+        matched_tracks, matched_detections = np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        if len(self.ids) and len(detections):
+            iou = iou_matrix(detections[:, :4], x_to_boxes(self.x))
+            rows, cols = linear_sum_assignment(-iou)
+            keep = iou[rows, cols] >= self.iou_threshold
+            matched_detections, matched_tracks = rows[keep], cols[keep]
+
+        # kalman correction of the matched tracks (batched over the matches)
+        if len(matched_tracks):
+            z = boxes_to_z(detections[matched_detections, :4])
+            x, p = self.x[matched_tracks], self.p[matched_tracks]
+
+            y = z - x @ KF_H.T
+            s = KF_H @ p @ KF_H.T + KF_R
+            k = p @ KF_H.T @ np.linalg.inv(s)
+
+            self.x[matched_tracks] = x + np.einsum("nij,nj->ni", k, y)
+            self.p[matched_tracks] = (np.eye(7) - k @ KF_H) @ p
+            self.hits[matched_tracks] += 1
+            self.since_update[matched_tracks] = 0
+            self.conf[matched_tracks] = detections[matched_detections, 4]
+            self.cls[matched_tracks] = detections[matched_detections, 5]
+
+        # every unmatched detection starts a new track
+        new = np.setdiff1d(np.arange(len(detections)), matched_detections)
+        if len(new):
+            x = np.zeros((len(new), 7))
+            x[:, :4] = boxes_to_z(detections[new, :4])
+
+            self.x = np.concatenate([self.x, x])
+            self.p = np.concatenate([self.p, np.repeat(KF_P0[None], len(new), axis=0)])
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + len(new))])
+            self.hits = np.concatenate([self.hits, np.ones(len(new), dtype=int)])
+            self.since_update = np.concatenate([self.since_update, np.zeros(len(new), dtype=int)])
+            self.conf = np.concatenate([self.conf, detections[new, 4]])
+            self.cls = np.concatenate([self.cls, detections[new, 5]])
+            self.next_id += len(new)
+
+        self._remove_old()
+
+        # report the tracks that were matched on this frame once they are confirmed (or during the first frames)
+        return self._output((self.since_update == 0) & ((self.hits >= self.min_hits) | (self.frame_count <= self.min_hits)))
+
+    def _remove_old(self):
+        keep = self.since_update <= self.max_age
+        if keep.all():
+            return
+
+        self.x, self.p, self.ids = self.x[keep], self.p[keep], self.ids[keep]
+        self.hits, self.since_update = self.hits[keep], self.since_update[keep]
+        self.conf, self.cls = self.conf[keep], self.cls[keep]
+
+    def shed(self):
+        # nothing is kept besides the live tracks
+        pass
+
+#^# SORT TRACKER #^#
+####################
+
+#_# BYTETRACK #_#
+#################
+
+class ByteTrackTracker:
+
+    # the ultralytics ByteTrack tracker (the one YOLO.track() uses) behind the same interface
+    # it needs a detection on every frame so it can't be used with a detection interval
+    def __init__(self, frame_rate=30):
+        from ultralytics.trackers.byte_tracker import BYTETracker
+        from ultralytics.utils import IterableSimpleNamespace, yaml_load
+        from ultralytics.utils.checks import check_yaml
+
+        config = IterableSimpleNamespace(**yaml_load(check_yaml("bytetrack.yaml")))
+        self.tracker = BYTETracker(args=config, frame_rate=frame_rate)
+
+    def __len__(self):
+        return len(self.tracker.tracked_stracks) + len(self.tracker.lost_stracks) + len(self.tracker.removed_stracks)
+
+    def update(self, detections, frame=None):
+        from ultralytics.engine.results import Boxes
+
+        # the tracker returns [x1, y1, x2, y2, id, confidence, class, detection index]
+        tracks = self.tracker.update(Boxes(np.asarray(detections).reshape(-1, 6), frame.shape[:2]), frame)
+        return np.asarray(tracks).reshape(-1, 8)[:, :7]
+
+    def shed(self):
+        # the removed tracks are only kept so their ids aren't matched again
+        self.tracker.removed_stracks.clear()
+
+#^# BYTETRACK #^#
+#################
+
+def make_tracker(name, frame_rate=30, max_age=30):
+    if name == "sort":
+        return SortTracker(max_age=max_age)
+    return ByteTrackTracker(frame_rate)
+
+def tracks_to_results(frame, tracks, names):
+
+    # wrap the tracks in the results object of YOLO.track() so detect_vehicles() reads them the same way
+    import torch
+    from ultralytics.engine.results import Results
+
+    return [Results(frame, path="", names=names, boxes=torch.as_tensor(np.asarray(tracks, dtype=np.float32).reshape(-1, 7)))]
+
+class IntervalTracker:
+
+    # runs the detector only on every interval-th frame, the tracker predicts the vehicles on the frames in between
+    # detect(frame) returns the detections as [x1, y1, x2, y2, confidence, class]
+    def __init__(self, detect, tracker, names, interval=1):
+        self.detect = detect
+        self.tracker = tracker
+        self.names = names
+        self.interval = interval if hasattr(tracker, "predict") else 1
+        self.frame_count = 0
+
+    def track(self, frame):
+
+        if self.frame_count % self.interval == 0:
+            tracks = self.tracker.update(self.detect(frame), frame)
+        else:
+            tracks = self.tracker.predict()
+        self.frame_count += 1
+
+        # predicted boxes can drift out of the frame, keep them inside so the vehicle crops are valid
+        h, w = frame.shape[:2]
+        tracks = np.array(tracks, dtype=float).reshape(-1, 7)
+        tracks[:, [0, 2]] = np.clip(tracks[:, [0, 2]], 0, w)
+        tracks[:, [1, 3]] = np.clip(tracks[:, [1, 3]], 0, h)
+        tracks = tracks[(tracks[:, 2] - tracks[:, 0] >= 2) & (tracks[:, 3] - tracks[:, 1] >= 2)]
+
+        return tracks_to_results(frame, tracks, self.names() if callable(self.names) else self.names)
@@ -0,0 +1,207 @@
+import os
+import csv
+import time
+import threading
+from utils.plate_index import OCR_CONFUSIONS, CONFUSION_COST, EDIT_COST, DEFAULT_MAX_DISTANCE, substitution_cost
+
+# the watchlist is configuration, so it's kept outside of logs/ (Clear Logs removes the whole folder)
+WATCHLIST_PATH = "config/watchlist.csv"
+
+# where older versions kept it, moved to WATCHLIST_PATH the first time it's read
+LEGACY_WATCHLIST_PATH = "logs/perm/watchlist.csv"
+
+# the watchlist file is checked for changes at most this often (it can be edited while the ALPR runs)
+RELOAD_INTERVAL_S = 2
+
+# key of the entry stored in a trie node (can't collide with a plate character)
+END = "$"
+
+# characters that a read character could really be (the OCR confusions in both directions)
+_confusions = {}
+for a, b in OCR_CONFUSIONS:
+    _confusions.setdefault(a, []).append(b)
+    _confusions.setdefault(b, []).append(a)
+
+def normalize_plate(plate):
+    return "".join(c for c in plate.upper() if c.isalnum())
+
+#_# TRIE #_#
+############
+
+class WatchlistTrie:
+
+    # trie of the watched plates, searched with the same costs as utils/plate_index.py
+    # (an OCR confusion costs 1, any other edit costs 2) so a read that is one confusion off still matches
+    def __init__(self):
+        self.root = {}
+        self.entries = {} # plate: note
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, plate, note=""):
+        node = self.root
+        for c in plate:
+            node = node.setdefault(c, {})
+
+        node[END] = (plate, note)
+        self.entries[plate] = note
+
+    def remove(self, plate):
+        if plate not in self.entries:
+            return
+
+        path = [self.root]
+        for c in plate:
+            path.append(path[-1][c])
+
+        del path[-1][END]
+        del self.entries[plate]
+
+        # prune the nodes that no other plate uses (from the end of the plate back up)
+        for depth in range(len(plate), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][plate[depth - 1]]
+
+    def find(self, plate, max_distance=DEFAULT_MAX_DISTANCE):
+
+        # return a list of (distance, watched plate, note) within max_distance, closest first
+        matches = {}
+
+        # depth first over (node, position in the read plate, cost so far)
+        stack = [(self.root, 0, 0)]
+        while stack:
+            node, i, cost = stack.pop()
+
+            if i == len(plate) and END in node:
+                watched, note = node[END]
+                if watched not in matches or cost < matches[watched][0]:
+                    matches[watched] = (cost, note)
+
+            if i < len(plate):
+                c = plate[i]
+
+                # within the confusion budget only the read character and its OCR confusions have to be followed
+                if max_distance - cost < EDIT_COST:
+                    if c in node:
+                        stack.append((node[c], i + 1, cost))
+                    if cost + CONFUSION_COST <= max_distance:
+                        for other in _confusions.get(c, ()):
+                            if other in node:
+                                stack.append((node[other], i + 1, cost + CONFUSION_COST))
+                else:
+                    for other, child in node.items():
+                        if other != END:
+                            stack.append((child, i + 1, cost + substitution_cost(c, other)))
+
+            # a missing or extra character
+            if cost + EDIT_COST <= max_distance:
+                if i < len(plate):
+                    stack.append((node, i + 1, cost + EDIT_COST))
+                for other, child in node.items():
+                    if other != END:
+                        stack.append((child, i, cost + EDIT_COST))
+
+        return sorted((dist, watched, note) for watched, (dist, note) in matches.items() if dist <= max_distance)
+
+#^# TRIE #^#
+############
+
+#_# WATCHLIST FILE #_#
+######################
+
+def migrate_watchlist(path=WATCHLIST_PATH):
+
+    if path == WATCHLIST_PATH and not os.path.exists(path) and os.path.exists(LEGACY_WATCHLIST_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(LEGACY_WATCHLIST_PATH, path)
+
+def read_watchlist(path=WATCHLIST_PATH):
+
+    # csv of plate,note (the note is optional), returns {plate: note}
+    migrate_watchlist(path)
+
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+
+    with open(path, "r", newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].strip().startswith("#"):
+                continue
+
+            plate = normalize_plate(row[0])
+            if plate:
+                entries[plate] = ",".join(row[1:]).strip()
+
+    return entries
+
+def write_watchlist(entries, path=WATCHLIST_PATH):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + ".tmp", "w", newline="") as file:
+        writer = csv.writer(file)
+        for plate, note in entries.items():
+            writer.writerow([plate, note])
+
+    os.replace(path + ".tmp", path)
+
+class Watchlist:
+
+    # the trie of the watchlist file, updated in place when the file changes so the running ALPR doesn't restart
+    def __init__(self, path=WATCHLIST_PATH, max_distance=DEFAULT_MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self.trie = WatchlistTrie()
+        self.mtime = None
+        self.last_check = 0
+        self.lock = threading.Lock()
+
+        migrate_watchlist(path)
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+
+        # returns (added, removed) plates if the file changed
+        now = time.time()
+        if not force and now - self.last_check < RELOAD_INTERVAL_S:
+            return None
+        self.last_check = now
+
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self.mtime:
+            return None
+        self.mtime = mtime
+
+        # only the plates that were added, removed or whose note changed touch the trie
+        entries = read_watchlist(self.path)
+        with self.lock:
+            removed = [plate for plate in self.trie.entries if plate not in entries]
+            added = [plate for plate, note in entries.items() if self.trie.entries.get(plate) != note]
+
+            for plate in removed:
+                self.trie.remove(plate)
+            for plate in added:
+                self.trie.add(plate, entries[plate])
+
+        if added or removed:
+            print("Watchlist: " + str(len(added)) + " added, " + str(len(removed)) + " removed (" + str(len(self.trie)) + " plates)")
+
+        return added, removed
+
+    def match(self, plate):
+
+        # return the (distance, watched plate, note) matches of a read plate, closest first
+        self.refresh()
+
+        plate = normalize_plate(plate)
+        if not plate:
+            return []
+
+        with self.lock:
+            return self.trie.find(plate, self.max_distance)
+
+#^# WATCHLIST FILE #^#
+######################
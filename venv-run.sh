@@ -39,6 +39,10 @@ if [ ! -d "$VENV_DIR" ]; then
     pip install --upgrade pip
     pip install -r requirements.txt
 
+    # Fetch the small vehicle detector weights of the detector cascade so it runs offline
+    echo "Fetching the detector cascade models..."
+    python -c "from utils.detector_cascade import fetch_models; fetch_models()"
+
     # Remove the custom TMPDIR
     rm -rf $PIP_TMP_DIR
 